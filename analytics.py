@@ -0,0 +1,167 @@
+import threading
+import numpy as np
+
+# microstructure metrics over the top of the book, for any number of books at once
+#
+# each book's top levels come in as one contiguous array (BookSnapshot.level_array), the
+# books are stacked into a (books, side, (price, size), rank) block and every metric is a
+# handful of numpy passes over the whole block, no python loop per metric or per level.
+#
+# prices are ticks and sizes lots like the rest of the book, distances are basis points of
+# the mid. everything only sees the top VIEW_DEPTH levels, so liquidity out to a distance the
+# view doesn't reach (view_bps) is a floor. metrics a book can't have (one sided) are None.
+
+# levels per side the metrics see, the book's deepest running total
+VIEW_DEPTH = 50
+
+# imbalance at each of these depths, bid size / (bid + ask size) over the top n levels
+IMBALANCE_DEPTHS = (5, 10, 25, 50)
+
+# levels per side in the size weighted mid
+WEIGHTED_DEPTH = 5
+
+# size within this many bps of the mid, per side
+DISTANCES_BPS = (5, 10, 25)
+
+def metric_names():
+	names = ['microprice', 'weighted_mid']
+	names += [f'imbalance_{depth}' for depth in IMBALANCE_DEPTHS]
+	names += ['bid_slope', 'ask_slope', 'view_bps']
+	for distance in DISTANCES_BPS:
+		names += [f'bid_within_{distance}bp', f'ask_within_{distance}bp']
+	return names
+
+METRIC_NAMES = tuple(metric_names())
+
+# stack the books' level arrays into one float block, sides a book doesn't have are all zero size
+def level_view(snapshots, depth=VIEW_DEPTH):
+	return np.stack([snapshot.level_array(depth) for snapshot in snapshots]).astype(np.float64)
+
+# {metric: array with one value per book} for a (books, 2, 2, depth) block, NaN where undefined
+def compute(view):
+	bid_prices, bid_sizes = view[:, 0, 0], view[:, 0, 1]
+	ask_prices, ask_sizes = view[:, 1, 0], view[:, 1, 1]
+	bid_valid = bid_sizes > 0
+	ask_valid = ask_sizes > 0
+	two_sided = bid_valid[:, 0] & ask_valid[:, 0]
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		best_bid, best_ask = bid_prices[:, 0], ask_prices[:, 0]
+		mid = np.where(two_sided, (best_bid + best_ask) / 2, np.nan)
+		results = {}
+
+		# the touch weighted toward the thinner side, where the next trade is likely to push the price
+		top_bid, top_ask = bid_sizes[:, 0], ask_sizes[:, 0]
+		results['microprice'] = (best_bid * top_ask + best_ask * top_bid) / (top_bid + top_ask)
+
+		# the same over the top WEIGHTED_DEPTH levels, each side at its size weighted average price
+		bid_notional = np.cumsum(bid_prices * bid_sizes, axis=1)
+		ask_notional = np.cumsum(ask_prices * ask_sizes, axis=1)
+		bid_depth = np.cumsum(bid_sizes, axis=1)
+		ask_depth = np.cumsum(ask_sizes, axis=1)
+		weighted = min(WEIGHTED_DEPTH, view.shape[-1]) - 1
+		bid_average = bid_notional[:, weighted] / bid_depth[:, weighted]
+		ask_average = ask_notional[:, weighted] / ask_depth[:, weighted]
+		results['weighted_mid'] = (bid_average * ask_depth[:, weighted] + ask_average * bid_depth[:, weighted]) / (
+			bid_depth[:, weighted] + ask_depth[:, weighted])
+
+		# all depths in one fancy index, depths past the view use what the view has
+		columns = np.minimum(IMBALANCE_DEPTHS, view.shape[-1]) - 1
+		bids_at, asks_at = bid_depth[:, columns], ask_depth[:, columns]
+		imbalances = bids_at / (bids_at + asks_at)
+		for index, depth in enumerate(IMBALANCE_DEPTHS):
+			results[f'imbalance_{depth}'] = imbalances[:, index]
+
+		# distance of every level from the mid, levels that aren't there are pushed out of reach
+		bid_distance = np.where(bid_valid, (mid[:, None] - bid_prices) / mid[:, None] * 10000, np.inf)
+		ask_distance = np.where(ask_valid, (ask_prices - mid[:, None]) / mid[:, None] * 10000, np.inf)
+
+		# book slope: least squares fit of cumulative size against distance, size added per bp
+		# a steep book absorbs flow without moving, a flat one gives way
+		for side, distance, cumulative, valid in (('bid', bid_distance, bid_depth, bid_valid), ('ask', ask_distance, ask_depth, ask_valid)):
+			count = valid.sum(axis=1)
+			x = np.where(valid, distance, 0.0)
+			y = np.where(valid, cumulative, 0.0)
+			x_mean = x.sum(axis=1) / count
+			y_mean = y.sum(axis=1) / count
+			dx = np.where(valid, x - x_mean[:, None], 0.0)
+			dy = np.where(valid, y - y_mean[:, None], 0.0)
+			results[f'{side}_slope'] = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+
+		# how far out the view reaches on its shorter side
+		results['view_bps'] = np.minimum(
+			np.where(bid_valid, bid_distance, -np.inf).max(axis=1),
+			np.where(ask_valid, ask_distance, -np.inf).max(axis=1))
+
+		# size within each distance, every distance in one broadcast
+		limits = np.asarray(DISTANCES_BPS, dtype=np.float64)
+		bid_within = (bid_sizes[:, :, None] * (bid_distance[:, :, None] <= limits)).sum(axis=1)
+		ask_within = (ask_sizes[:, :, None] * (ask_distance[:, :, None] <= limits)).sum(axis=1)
+		for index, distance in enumerate(DISTANCES_BPS):
+			results[f'bid_within_{distance}bp'] = bid_within[:, index]
+			results[f'ask_within_{distance}bp'] = ask_within[:, index]
+
+	# nothing is defined on a one sided book
+	for values in results.values():
+		values[~two_sided] = np.nan
+	return results
+
+# compute() for a list of snapshots -> one {metric: float or None} per snapshot
+def snapshot_metrics(snapshots, depth=VIEW_DEPTH):
+	if not snapshots:
+		return []
+	results = compute(level_view(snapshots, depth))
+	rows = np.column_stack([results[name] for name in METRIC_NAMES]).tolist()
+	return [{name: (value if value == value else None) for name, value in zip(METRIC_NAMES, row)} for row in rows]
+
+# metrics for a set of books, worked out together and cached per book version
+# asking for one book also brings every other book that moved since up to date, in the same pass
+class BookAnalytics:
+	def __init__(self, books, depth=VIEW_DEPTH):
+		# {key: book}, anything with a .snapshot
+		self.books = books
+		self.depth = depth
+		# key -> (version, metrics)
+		self.cache = {}
+		self.lock = threading.Lock()
+
+		# stats
+		self.passes = 0
+		self.computed = 0
+
+	def metrics(self, key, snapshot=None):
+		snapshot = snapshot if snapshot is not None else self.books[key].snapshot
+		cached = self.cache.get(key)
+		if cached is not None and cached[0] == snapshot.version:
+			return cached[1]
+		keys = [key]
+		snapshots = [snapshot]
+		for other, book in self.books.items():
+			if other == key:
+				continue
+			other_snapshot = book.snapshot
+			other_cached = self.cache.get(other)
+			if other_snapshot.best_bid is not None and (other_cached is None or other_cached[0] != other_snapshot.version):
+				keys.append(other)
+				snapshots.append(other_snapshot)
+		results = snapshot_metrics(snapshots, self.depth)
+		with self.lock:
+			for other, other_snapshot, values in zip(keys, snapshots, results):
+				self.cache[other] = (other_snapshot.version, values)
+			self.passes += 1
+			self.computed += len(keys)
+		return results[0]
+
+	def stats(self):
+		return {'passes': self.passes, 'books_computed': self.computed}
+
+# analytics of a book's snapshot for its get_metrics: from the engine the book was given
+# (products.ProductRegistry gives every book the same one), else worked out for this book
+# alone and kept on it until the next version
+def book_metrics(book, snapshot):
+	if book.analytics is not None:
+		return book.analytics.metrics(book.analytics_key, snapshot)
+	cached = book.analytics_values
+	if cached is None or cached[0] != snapshot.version:
+		cached = book.analytics_values = (snapshot.version, snapshot_metrics([snapshot])[0])
+	return cached[1]
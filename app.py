@@ -1,22 +1,66 @@
+import os
+import time
 import dash
+import flask
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash import no_update, Patch
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import numpy as np
 from datetime import datetime
 import plotly.graph_objs as go
-from websocket_client import CoinbaseWebSocket
-from order_book import OrderBook
+from websocket_client import CoinbaseWebSocket, COINBASE_URL, FEED_CHANNELS
+from capture import FeedRecorder
+from replay import CaptureReplay
+from sampler import MetricsSampler
+from shared_book import SharedBookWriter, SharedOrderBook, SHM_NAME
+from products import ProductRegistry, ShardedIngest, parse_products, base_currency, DEFAULT_PRODUCTS
+from book_sync import BookSync
+from latency import LatencyRecorder
+from profiling import Profiler
+from metrics_store import MetricsStore
+from depth import BUCKET_CHOICES, DEFAULT_BUCKET, bucket_label, cumulative_depth
+from push import PushBroadcaster
+from cache import VersionedCache
 
 ##################
 # Global Vars
 ##################
 
-orderbook = OrderBook()
+#deployment mode
+#  standalone: this process runs the feed, the book and the dashboard (default)
+#  ingest:     runs the feed and the book and publishes them to shared memory (see shared_book.py)
+#  web:        dashboard only, reads the ingest process' book; run as many of these as you like,
+#              e.g. MMV_MODE=ingest python app.py & MMV_MODE=web gunicorn -w 8 -k gthread --threads 32 app:server
+mode = os.environ.get('MMV_MODE', 'standalone')
+shm_name = os.environ.get('MMV_SHM_NAME', SHM_NAME)
+if mode not in ('standalone', 'ingest', 'web'):
+    raise ValueError(f"MMV_MODE must be standalone, ingest or web, not {mode!r}")
+
+#products to follow, all over one feed connection; pairs quoted finer than cents say how fine,
+#e.g. MMV_PRODUCTS=BTC-USD,ETH-USD,DOGE-USD:5 (web workers need the same list as the ingest side)
+products = parse_products(os.environ.get('MMV_PRODUCTS', DEFAULT_PRODUCTS))
+
+#applier threads the products are dealt across, 0 = one per product
+ingest_shards = int(os.environ.get('MMV_INGEST_SHARDS', '1'))
+
+# every product gets its own shared memory segment
+def shared_name(product_id):
+    return f"{shm_name}-{product_id}"
+
+if mode == 'web':
+    registry = ProductRegistry(products,
+        lambda product_id, price_decimals: SharedOrderBook(shared_name(product_id), price_decimals=price_decimals))
+else:
+    registry = ProductRegistry(products)
+# the first product is the default view and the one paper trading runs against
+orderbook = registry.primary
+# microprice, multi depth imbalance, slope... for the quick facts, every product that moved in one pass
+book_analytics = registry.analytics
 ws_client = None
+shared_writers = []
 
-#state for fast interpolation
-previous_metrics = {'best_bid': 0, 'best_ask': 0, 'spread': 0, 'mid_price': 0, 'imbalance': 0.5}
-target_metrics = {'best_bid': 0, 'best_ask': 0, 'spread': 0, 'mid_price': 0, 'imbalance': 0.5}
+# per book version render results shared by every callback and session (see cache.py)
+render_cache = VersionedCache()
 
 # track trades
 portfolio = {
@@ -30,12 +74,81 @@ transaction_history_limit = 100
 #how often graphs updated
 graph_interval = 2
 
-#method for interpolating vals (makes site look fast haha)
-def interpolate_value(old, new, steps=10, current_step = 0):
-    if old is None or new is None:
-        return new or old or 0
-    alpha = min(current_step / steps, 1.0)
-    return old + (new-old) *alpha #lin interp formula
+#seconds between history samples, independent of how many clients are polling
+sample_interval = float(os.environ.get('MMV_SAMPLE_INTERVAL', '1'))
+
+#seconds of history on the spread chart, long windows are drawn from the 1m / 15m rollups
+spread_window = float(os.environ.get('MMV_SPREAD_WINDOW', '300'))
+
+#sampled metrics are also kept on disk here so a restart picks the charts back up, '' to turn off
+history_dir = os.environ.get('MMV_HISTORY_DIR', 'history')
+
+#push market updates to browsers over server-sent events (/stream) instead of interval polling
+#MMV_PUSH=0 goes back to polling; the interval is the fastest the server will render a push
+push_enabled = os.environ.get('MMV_PUSH', '1') != '0'
+push_interval = float(os.environ.get('MMV_PUSH_INTERVAL', '0.1'))
+
+#set MMV_START_FEED=0 to import the app without connecting (benchmarks, tooling)
+start_feed = os.environ.get('MMV_START_FEED', '1') != '0'
+
+#feed to connect to, point at feed_server.py for local load testing
+feed_url = os.environ.get('MMV_FEED_URL', COINBASE_URL)
+
+#book channel: level2_batch (coinbase batches changes into ~50ms frames) or level2 (every change
+#as it happens); coinbase only serves level2 to subscriptions signed with an exchange api key
+feed_channel = os.environ.get('MMV_FEED_CHANNEL', 'level2_batch')
+if feed_channel not in FEED_CHANNELS:
+    raise ValueError(f"MMV_FEED_CHANNEL must be one of {', '.join(FEED_CHANNELS)}, not {feed_channel!r}")
+feed_credentials = tuple(os.environ.get(f'MMV_COINBASE_{part}') for part in ('KEY', 'SECRET', 'PASSPHRASE'))
+feed_credentials = feed_credentials if all(feed_credentials) else None
+
+#record the raw feed here when set (see capture.py), off by default
+record_dir = os.environ.get('MMV_RECORD_DIR')
+recorder = None
+
+#replay a capture instead of connecting to coinbase (air-gapped boxes, reproducing renders)
+#speed 1 = real time, N = N times faster, 0 = as fast as possible; start is epoch seconds
+replay_path = os.environ.get('MMV_REPLAY')
+replay_speed = float(os.environ.get('MMV_REPLAY_SPEED', '1'))
+replay_start = os.environ.get('MMV_REPLAY_START')
+
+#how far either side of the mid the cumulative depth chart reaches, as a fraction of the mid
+#(set the same on ingest and web processes, the ingest side decides what's in shared memory)
+depth_band = float(os.environ.get('MMV_DEPTH_BAND', '0.05'))
+
+#time every callback, book method and book lock and serve /profile (see profiling.py), off by default
+profile_enabled = os.environ.get('MMV_PROFILE', '0') != '0'
+
+# the book works in integer ticks/lots, these turn a snapshot into display floats
+# (each product's book has its own tick size, so these take the book the snapshot came from)
+def display_metrics(book, snapshot, analytics=None):
+    metrics = {
+        'best_bid': book.to_price(snapshot.best_bid),
+        'best_ask': book.to_price(snapshot.best_ask),
+        'spread': book.to_price(snapshot.spread),
+        'mid_price': book.to_price(snapshot.mid_price),
+        'imbalance': snapshot.imbalance,
+    }
+    # analytics.py values, ticks -> price, lots -> size; slope is size per bp, averaged over both sides
+    if analytics is not None:
+        metrics.update({
+            'microprice': book.to_price(analytics['microprice']),
+            'weighted_mid': book.to_price(analytics['weighted_mid']),
+            'imbalance_5': analytics['imbalance_5'],
+            'imbalance_50': analytics['imbalance_50'],
+            'book_slope': book.to_size((analytics['bid_slope'] + analytics['ask_slope']) / 2)
+                if analytics['bid_slope'] is not None and analytics['ask_slope'] is not None else None,
+            'within_10bp': book.to_size(analytics['bid_within_10bp'] + analytics['ask_within_10bp'])
+                if analytics['bid_within_10bp'] is not None else None,
+        })
+    return metrics
+
+def display_depth(book, snapshot, levels):
+    depth = snapshot.depth(levels)
+    return {
+        side: [(book.to_price(price), book.to_size(size)) for price, size in depth[side]]
+        for side in ('bids', 'asks')
+    }
 
 
 # Sleek Dark Mode: Professional trading terminal—clean blacks, subtle grays, precise accents
@@ -55,6 +168,193 @@ FONTS = {
     'body': '"Inter", sans-serif',
 }
 
+# the same renderers feed the dash callbacks and the push stream (push.py), so both look identical
+# metric tiles + gauge are drawn in the browser (assets/metrics.js) from this list of raw numbers
+METRIC_FIELDS = ('best_bid', 'best_ask', 'spread', 'mid_price', 'imbalance',
+    'microprice', 'weighted_mid', 'imbalance_5', 'imbalance_50', 'book_slope', 'within_10bp')
+
+def metric_values(product_id, book, snapshot):
+    metrics = display_metrics(book, snapshot, book_analytics.metrics(product_id, snapshot))
+    return [metrics[field] for field in METRIC_FIELDS]
+
+# the charts are sent once as empty shells in the layout, callbacks then only patch
+# trace data and axis ranges into them (see orderbook_patch / spread_patch)
+def orderbook_figure(base='BTC', price_decimals=2):
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        y=[],
+        x=[],
+        orientation='h',
+        name='Bids',
+        marker_color=COLORS['bid_green'],
+        hovertemplate=orderbook_hover(base, price_decimals)
+    ))
+    fig.add_trace(go.Bar(
+        y=[],
+        x=[],
+        orientation='h',
+        name='Asks',
+        marker_color=COLORS['ask_red'],
+        hovertemplate=orderbook_hover(base, price_decimals)
+    ))
+    fig.update_layout(
+        plot_bgcolor=COLORS['card_bg'],
+        paper_bgcolor=COLORS['card_bg'],
+        font={'color': COLORS['text'], 'family': FONTS['body'], 'size': 12},
+        showlegend=False,
+        margin=dict(l=60, r=40, t=20, b=40),
+        xaxis=dict(
+            title=f"Volume ({base})",
+            gridcolor=COLORS['grid'],
+            zerolinecolor=COLORS['grid'],
+            zerolinewidth=1,
+        ),
+        yaxis=dict(
+            title="Price (USD)",
+            gridcolor=COLORS['grid'],
+            tickformat=price_tickformat(price_decimals),
+        ),
+        hovermode='closest',
+        bargap=0.4,
+        bargroupgap=0,
+    )
+    fig.update_traces(
+        width=0.6,
+        selector=dict(type='bar')
+    )
+    
+    return fig
+
+def orderbook_hover(base, price_decimals):
+    return f'Price: $%{{y:,.{max(price_decimals, 2)}f}}<br>Size: %{{x:.4f}} {base}'
+
+# whole dollars unless the pair trades below a cent
+def price_tickformat(price_decimals):
+    return '$,.0f' if price_decimals <= 2 else f'$,.{price_decimals}f'
+
+# units and price format go along too, the page may have switched product
+def orderbook_patch(depth, base, price_decimals):
+    bid_sizes = [-size for price, size in depth['bids']]
+    ask_sizes = [size for price, size in depth['asks']]
+    max_volume = max([abs(x) for x in bid_sizes + ask_sizes], default=0)
+    patch = Patch()
+    patch['data'][0]['y'] = [price for price, size in depth['bids']]
+    patch['data'][0]['x'] = bid_sizes
+    patch['data'][1]['y'] = [price for price, size in depth['asks']]
+    patch['data'][1]['x'] = ask_sizes
+    patch['layout']['xaxis']['range'] = [-max_volume * 1.1, max_volume * 1.1]
+    patch['layout']['xaxis']['title']['text'] = f"Volume ({base})"
+    patch['layout']['yaxis']['tickformat'] = price_tickformat(price_decimals)
+    patch['data'][0]['hovertemplate'] = orderbook_hover(base, price_decimals)
+    patch['data'][1]['hovertemplate'] = orderbook_hover(base, price_decimals)
+    return patch
+
+# cumulative size out from the mid, bids to the left and asks to the right, steps at each bucket's far edge
+def cumulative_figure(base='BTC', price_decimals=2):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        mode='lines',
+        name='Bids',
+        line=dict(color=COLORS['bid_green'], width=2, shape='vh'),
+        fill='tozeroy',
+        fillcolor='rgba(16, 185, 129, 0.15)',
+        hovertemplate=cumulative_hover(base, price_decimals)
+    ))
+    fig.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        mode='lines',
+        name='Asks',
+        line=dict(color=COLORS['ask_red'], width=2, shape='hv'),
+        fill='tozeroy',
+        fillcolor='rgba(239, 68, 68, 0.15)',
+        hovertemplate=cumulative_hover(base, price_decimals)
+    ))
+    fig.update_layout(
+        plot_bgcolor=COLORS['card_bg'],
+        paper_bgcolor=COLORS['card_bg'],
+        font={'color': COLORS['text'], 'family': FONTS['body'], 'size': 12},
+        showlegend=False,
+        margin=dict(l=60, r=40, t=20, b=40),
+        xaxis=dict(
+            title="Price (USD)",
+            gridcolor=COLORS['grid'],
+            tickformat=price_tickformat(price_decimals),
+        ),
+        yaxis=dict(
+            title=f"Cumulative size ({base})",
+            gridcolor=COLORS['grid'],
+            zerolinecolor=COLORS['grid'],
+        ),
+        hovermode='closest',
+    )
+    return fig
+
+def cumulative_hover(base, price_decimals):
+    return f'Price: $%{{x:,.{max(price_decimals, 2)}f}}<br>Within: %{{y:,.4f}} {base}'
+
+# the curves start from nothing at the mid, so the first bucket shows as a step
+def cumulative_patch(book, snapshot, choice, base):
+    mid_price = snapshot.mid_price
+    bid_edges, bid_depth, ask_edges, ask_depth = cumulative_depth(book.bucket_band(depth_band), book.bucket_ticks, mid_price, choice)
+    mid = book.to_price(mid_price)
+    patch = Patch()
+    # bids drawn left to right, so from the far end in to the mid
+    patch['data'][0]['x'] = (bid_edges[::-1] / book.price_scale).tolist() + [mid]
+    patch['data'][0]['y'] = (bid_depth[::-1] / book.size_scale).tolist() + [0]
+    patch['data'][1]['x'] = [mid] + (ask_edges / book.price_scale).tolist()
+    patch['data'][1]['y'] = [0] + (ask_depth / book.size_scale).tolist()
+    patch['layout']['xaxis']['range'] = [mid * (1 - depth_band), mid * (1 + depth_band)]
+    patch['layout']['xaxis']['tickformat'] = price_tickformat(book.price_decimals)
+    patch['layout']['yaxis']['title']['text'] = f"Cumulative size ({base})"
+    patch['data'][0]['hovertemplate'] = cumulative_hover(base, book.price_decimals)
+    patch['data'][1]['hovertemplate'] = cumulative_hover(base, book.price_decimals)
+    return patch
+
+def bucket_options(book):
+    return [{'label': bucket_label(value, book.bucket_ticks, book.price_decimals), 'value': value} for value, kind, size in BUCKET_CHOICES]
+
+# x is sample time (epoch ms on a date axis) so new points can be appended as they come
+def spread_figure(price_decimals=2):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        mode='lines',
+        name='Spread',
+        line=dict(
+            color=COLORS['accent'],
+            width=2
+        ),
+        fill='tozeroy',
+        fillcolor=f'rgba(59, 130, 246, 0.1)',
+        hovertemplate=f'$%{{y:.{max(price_decimals, 2)}f}}'
+    ))
+
+    #styling
+    fig.update_layout(
+        plot_bgcolor=COLORS['card_bg'],
+        paper_bgcolor=COLORS['card_bg'],
+        font={'color': COLORS['text'], 'family': FONTS['body'], 'size': 12},
+        showlegend=False,
+        margin=dict(l=40, r=20, t=20, b=40),
+        xaxis=dict(
+            title="Time (UTC)",
+            type='date',
+            gridcolor=COLORS['grid'],
+            tickformat='%H:%M:%S'
+        ),
+        yaxis=dict(
+            title="Spread (USD)",
+            gridcolor=COLORS['grid'],
+            tickformat=f'$,.{max(price_decimals, 2)}f',
+        ),
+        hovermode='x unified'
+    )
+    return fig
+
 ##################
 # Create application
 ##################
@@ -66,6 +366,13 @@ app.title = "BTC-USD Visualizer"
 app.config.update_title = None
 app.config.suppress_callback_exceptions = True
 
+# has to wrap the books before the feed touches them and app.callback before the callbacks below
+profiler = Profiler() if profile_enabled else None
+if profiler:
+    profiler.instrument_app(app)
+    for product_id, book in registry.items():
+        profiler.instrument_book(book, product_id)
+
 ##################
 # Layout
 ##################
@@ -151,6 +458,44 @@ app.index_string = '''
                 font-weight: 700;
                 line-height: 1.2;
             }
+
+            .feed-status {
+                font-size: 12px;
+                color: ''' + COLORS['accent'] + ''';
+                margin-top: 8px;
+                min-height: 18px;
+            }
+
+            .profile-panel {
+                font-size: 12px;
+                color: ''' + COLORS['accent'] + ''';
+                overflow-x: auto;
+            }
+
+            .profile-panel table {
+                width: 100%;
+                border-collapse: collapse;
+                margin-bottom: 16px;
+            }
+
+            .profile-panel th,
+            .profile-panel td {
+                padding: 4px 8px;
+                text-align: right;
+                border-bottom: 1px solid ''' + COLORS['grid'] + ''';
+            }
+
+            .profile-panel th:first-child,
+            .profile-panel td:first-child {
+                text-align: left;
+            }
+
+            .product-select {
+                width: 180px;
+                margin: 12px auto 0 auto;
+                color: #0c0c0c;
+                text-align: left;
+            }
         </style>
     </head>
     <body>
@@ -173,8 +518,19 @@ app.layout = html.Div(style={
 
     # Header: Clean title bar
     html.Div([
-        html.H1("BTC-USD Microstructure Visualizer",
+        html.H1("Microstructure Visualizer" if len(registry) > 1 else f"{registry.primary_id} Microstructure Visualizer",
                 style={'color': COLORS['text'], 'textAlign': 'center', 'fontSize': '28px', 'marginBottom': '4px'}),
+        # which product's book the page shows, every market callback follows it
+        dcc.Dropdown(
+            id='product-select',
+            options=[{'label': product_id, 'value': product_id} for product_id in registry],
+            value=registry.primary_id,
+            clearable=False,
+            searchable=False,
+            className='product-select',
+        ),
+        # feed channel, how far behind the exchange the book is and what ingest costs
+        html.Div(id='feed-status', className='feed-status'),
     ], className='sleek-card', style={'marginBottom': '32px', 'textAlign': 'center'}),
 
     html.Div(className='sleek-divider'),
@@ -228,6 +584,60 @@ app.layout = html.Div(style={
             })
         ], className='sleek-card', style={'flex': '1', 'minWidth': '180px'}),
 
+        # Microprice
+        html.Div([
+            html.Div("Microprice", className='metric-label'),
+            html.Div(id='microprice-value', children="$0.00", style={
+                'color': COLORS['text'],
+                'className': 'metric-value',
+            })
+        ], className='sleek-card', style={'flex': '1', 'minWidth': '180px'}),
+
+        # Weighted Mid (5)
+        html.Div([
+            html.Div("Weighted Mid (5)", className='metric-label'),
+            html.Div(id='weighted-mid-value', children="$0.00", style={
+                'color': COLORS['text'],
+                'className': 'metric-value',
+            })
+        ], className='sleek-card', style={'flex': '1', 'minWidth': '180px'}),
+
+        # Imbalance (5)
+        html.Div([
+            html.Div("Imbalance (5)", className='metric-label'),
+            html.Div(id='imbalance-5-value', children="0.00%", style={
+                'color': COLORS['accent'],
+                'className': 'metric-value',
+            })
+        ], className='sleek-card', style={'flex': '1', 'minWidth': '180px'}),
+
+        # Imbalance (50)
+        html.Div([
+            html.Div("Imbalance (50)", className='metric-label'),
+            html.Div(id='imbalance-50-value', children="0.00%", style={
+                'color': COLORS['accent'],
+                'className': 'metric-value',
+            })
+        ], className='sleek-card', style={'flex': '1', 'minWidth': '180px'}),
+
+        # Book Slope / bp
+        html.Div([
+            html.Div("Book Slope / bp", className='metric-label'),
+            html.Div(id='book-slope-value', children="0", style={
+                'color': COLORS['text'],
+                'className': 'metric-value',
+            })
+        ], className='sleek-card', style={'flex': '1', 'minWidth': '180px'}),
+
+        # Size Within 10 bps
+        html.Div([
+            html.Div("Size Within 10 bps", className='metric-label'),
+            html.Div(id='within-10bp-value', children="0", style={
+                'color': COLORS['text'],
+                'className': 'metric-value',
+            })
+        ], className='sleek-card', style={'flex': '1', 'minWidth': '180px'}),
+
     ], style={
         'display': 'grid',
         'gridTemplateColumns': 'repeat(auto-fit, minmax(180px, 1fr))',
@@ -251,6 +661,7 @@ app.layout = html.Div(style={
             }),
             dcc.Graph(
                 id='orderbook-chart',
+                figure=orderbook_figure(base_currency(registry.primary_id), orderbook.price_decimals),
                 config={'displayModeBar': False},
                 style={'height': '200px'}
             )
@@ -265,6 +676,7 @@ app.layout = html.Div(style={
             }),
             dcc.Graph(
                 id='spread-chart',
+                figure=spread_figure(orderbook.price_decimals),
                 config={'displayModeBar': False},
                 style={'height': '200px'}
             )
@@ -272,6 +684,32 @@ app.layout = html.Div(style={
         
     ], style={'display': 'flex', 'gap': '16px', 'marginBottom': '32px'}),
 
+    # Cumulative depth over the whole band, from the book's price bucket totals (see depth.py)
+    html.Div([
+        html.Div([
+            html.H3(f"Cumulative Depth (±{depth_band * 100:g}%)", style={
+                'color': COLORS['text'],
+                'fontSize': '16px',
+                'margin': '0',
+            }),
+            dcc.Dropdown(
+                id='bucket-select',
+                options=bucket_options(orderbook),
+                value=DEFAULT_BUCKET,
+                clearable=False,
+                searchable=False,
+                className='product-select',
+                style={'margin': '0'},
+            ),
+        ], style={'display': 'flex', 'justifyContent': 'space-between', 'alignItems': 'center', 'marginBottom': '16px'}),
+        dcc.Graph(
+            id='cumulative-chart',
+            figure=cumulative_figure(base_currency(registry.primary_id), orderbook.price_decimals),
+            config={'displayModeBar': False},
+            style={'height': '260px'}
+        )
+    ], className='sleek-card', style={'marginBottom': '32px'}),
+
     # Imbalance Gauge
     html.Div([
         html.H3("Order Imbalance", style={
@@ -308,14 +746,12 @@ app.layout = html.Div(style={
             html.Div(id='imbalance-bar-sell', style={
                 'backgroundColor': COLORS['ask_red'],
                 'height': '6px',
-                'transition': 'width 0.3s ease',
                 'borderRadius': '3px',
                 'width': '50%',
             }),
             html.Div(id='imbalance-bar-buy', style={
                 'backgroundColor': COLORS['bid_green'],
                 'height': '6px',
-                'transition': 'width 0.3s ease',
                 'borderRadius': '3px',
                 'width': '50%',
             }),
@@ -506,10 +942,35 @@ app.layout = html.Div(style={
         'marginBottom': '20px',
         'boxShadow': '0 8px 32px rgba(0,0,0,0.2)'
     }),
+    # where the time goes, only with MMV_PROFILE=1
+    *([html.Div([
+        html.Div("Profile", className='metric-label'),
+        html.Div(id='profile-panel', className='profile-panel'),
+    ], className='sleek-card', style={'marginBottom': '20px'})] if profiler else []),
     # Interval component (keep as-is)
+    # with push on it starts disabled, assets/push.js turns it back on if the stream can't connect
     dcc.Interval(
         id='interval-component',
         interval=500,
+        n_intervals=0,
+        disabled=push_enabled
+    ),
+    # versions the market callbacks hang off, set by `tick` only when they change
+    # so an idle book costs one tiny request per interval instead of four renders
+    dcc.Store(id='book-version'),
+    dcc.Store(id='depth-version'),
+    dcc.Store(id='history-version'),
+    # history count this page's spread chart holds, so it only gets the rows after it
+    dcc.Store(id='spread-sent'),
+    # [best bid, best ask, spread, mid, imbalance] for the clientside tiles / gauge
+    dcc.Store(id='metrics-store'),
+    dcc.Store(id='metrics-rendered'),
+    # product the push stream is following, set clientside by assets/push.js
+    dcc.Store(id='push-product'),
+    # portfolio value marks to market on its own slower clock, it isn't part of the push stream
+    dcc.Interval(
+        id='portfolio-interval',
+        interval=1000,
         n_intervals=0
     ),
 ])
@@ -520,196 +981,394 @@ app.layout = html.Div(style={
 
 def handle_websocket_message(msg_type, data):
 	if msg_type == "snapshot":
-		orderbook.initialize_snapshot(data['bids'], data['asks'])
-		print("Orderbook Initialized.")
+		registry.book(data.get('product_id')).initialize_snapshot(data['bids'], data['asks'])
+		print(f"Orderbook Initialized ({data.get('product_id')}).")
 
 	elif msg_type == "l2update":
-		orderbook.process_update(data['changes'])
+		registry.book(data.get('product_id')).process_update(data['changes'])
+
+# sequence gaps, crossed books and disconnects resubscribe the product (see book_sync.py)
+sync = BookSync(registry.product_ids)
+
+# exchange -> receive -> decode -> apply -> publish -> serve times per product, on /metrics (see latency.py)
+latency = LatencyRecorder()
+
+# raw frames go websocket thread -> ring buffer -> applier thread -> orderbook
+# one ring + applier per shard, frames are routed to theirs by product (see products.py)
+# book messages are applied by the pipeline, everything else still lands in handle_websocket_message
+ingest = ShardedIngest(registry, shards=ingest_shards or len(registry), on_message=handle_websocket_message, sync=sync,
+	latency=latency)
+
+# spread / mid / imbalance history of every product is recorded here, the charts only read it
+sampler = MetricsSampler(list(registry.books.values()), interval=sample_interval)
 
 def start_websocket():
-	global ws_client
-	ws_client = CoinbaseWebSocket(on_message_callback=handle_websocket_message)
+	global ws_client, recorder
+	ingest.start()
+	if replay_path:
+		ws_client = CaptureReplay(replay_path, speed=replay_speed,
+			start_time=float(replay_start) if replay_start else None)
+	else:
+		if feed_channel == 'level2' and feed_url == COINBASE_URL and not feed_credentials:
+			print("- level2 needs MMV_COINBASE_KEY / _SECRET / _PASSPHRASE, coinbase will refuse the subscription -")
+		ws_client = CoinbaseWebSocket(url=feed_url, product_ids=registry.product_ids, channel=feed_channel,
+			credentials=feed_credentials)
+	ingest.attach(ws_client)
+	sync.attach(ws_client)
+	if record_dir:
+		recorder = FeedRecorder(record_dir)
+		recorder.start()
+		ws_client.add_frame_listener(recorder.push)
 	ws_client.start()
 	print("Websocket Started.")
 
+##################
+# Push
+##################
+
+# everything the browser renders from one snapshot, keyed by what assets/push.js updates
+# metrics as the metrics-store list, depth as [[price, size], ...] per side
+# rendered right before it goes out, so this is when the push stream serves the snapshot
+def push_parts(product_id, snapshot):
+	book = registry.book(product_id)
+	latency.served(product_id, snapshot)
+	return {
+		'metrics': render_cache.get(f'metrics:{product_id}', snapshot.version, lambda: metric_values(product_id, book, snapshot)),
+		'depth': display_depth(book, snapshot, levels=15),
+	}
+
+# figure / style shells the client fills with data, built by the same functions as the callbacks
+def push_templates(product_id):
+	return {
+		'orderbook': orderbook_figure(base_currency(product_id), registry.book(product_id).price_decimals).to_plotly_json(),
+		'spread': spread_figure(registry.book(product_id).price_decimals).to_plotly_json(),
+	}
+
+# one broadcaster per product, a page listens to the one it has selected
+broadcasters = {
+	product_id: PushBroadcaster(book, lambda snapshot, product_id=product_id: push_parts(product_id, snapshot),
+		templates=push_templates(product_id), window=spread_window, interval=push_interval)
+	for product_id, book in registry.items()
+} if push_enabled else {}
+
+# server-sent events, one long lived response per browser, ?product= picks the book
+# needs a threaded server: app.run is by default, under gunicorn use -k gthread --threads N
+@server.route('/stream')
+def stream():
+	if not broadcasters:
+		# 204 tells EventSource not to reconnect, the page keeps polling
+		return flask.Response(status=204)
+	broadcaster = broadcasters.get(flask.request.args.get('product'), broadcasters[registry.primary_id])
+	return flask.Response(broadcaster.stream(), mimetype='text/event-stream',
+		headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def shared_stats():
+	if mode == 'web':
+		return {
+			product_id: {'attached': book.layout is not None, 'retries': book.retries, 'staleness': book.staleness()}
+			for product_id, book in registry.items()
+		}
+	if shared_writers:
+		return {writer.name: {'publishes': writer.publishes} for writer in shared_writers}
+	return None
+
+# counters from the moving parts, for a quick look without a debugger
+@server.route('/stats')
+def stats():
+	return flask.jsonify({
+		'version': {product_id: book.version for product_id, book in registry.items()},
+		'render_cache': render_cache.stats(),
+		'ingest': ingest.stats(),
+		'feed': ws_client.stats() if hasattr(ws_client, 'stats') else None,
+		'sync': sync.stats(),
+		'latency': latency.stats(),
+		'analytics': book_analytics.stats(),
+		'profile': profiler.stats() if profiler else None,
+		'sampler': {'samples': sampler.samples, 'late': sampler.late},
+		'push': {product_id: broadcaster.stats() for product_id, broadcaster in broadcasters.items()} or None,
+		'recorder': recorder.stats() if recorder else None,
+		'shared': shared_stats(),
+	})
+
+# latency histograms in prometheus' text format, every process (ingest, each web worker) has its own
+@server.route('/metrics')
+def metrics():
+	return flask.Response(latency.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# every thread's stacks sampled for ?seconds= (default 5, max 60) as collapsed stacks, ready for
+# flamegraph.pl or speedscope; only with MMV_PROFILE=1, it shows the app's internals
+if profiler:
+	@server.route('/profile')
+	def profile():
+		seconds = min(max(flask.request.args.get('seconds', 5.0, type=float), 0.1), 60.0)
+		interval = min(max(flask.request.args.get('interval', 0.005, type=float), 0.001), 1.0)
+		return flask.Response(profiler.sample(seconds, interval), content_type='text/plain; charset=utf-8')
+
 ##################
 # Callback
 ##################
 
+# (product id, book) for the dropdown value, a stale or unknown one falls back to the first product
+def selected(product_id):
+    if product_id not in registry.books:
+        product_id = registry.primary_id
+    return product_id, registry.books[product_id]
+
+# fans the interval out into versions: book (metrics, gauge), depth (orderbook chart, every
+# graph_interval ticks) and history (spread chart, once per sample); unchanged ones are left alone
+# versions are [product, n] so switching product always counts as a change, and renders at once
 @app.callback(
-	[
-		Output('best-bid-value', 'children'),
-		Output('best-ask-value', 'children'),
-		Output('spread-value', 'children'),
-		Output('mid-price-value', 'children'),
-		Output('imbalance-value', 'children'),
-	],
-	Input('interval-component', 'n_intervals')
+    [
+        Output('book-version', 'data'),
+        Output('depth-version', 'data'),
+        Output('history-version', 'data'),
+    ],
+    [
+        Input('interval-component', 'n_intervals'),
+        Input('product-select', 'value'),
+    ],
+    [
+        State('book-version', 'data'),
+        State('depth-version', 'data'),
+        State('history-version', 'data'),
+    ]
 )
 
-def update_metrics(n):
-    if not orderbook or orderbook.get_best_bid() is None:
-        return []
-    metrics = orderbook.get_metrics()
-    return [
-        f"${metrics['best_bid']:,.2f}",
-        f"${metrics['best_ask']:,.2f}",
-        f"${metrics['spread']:,.2f}",
-        f"${metrics['mid_price']:,.2f}",
-        f"{metrics['imbalance']:,.1%}",
-    ]
+def tick(n, product_id, book_seen, depth_seen, history_seen):
+    product_id, book = selected(product_id)
+    snapshot = book.snapshot
+    if snapshot.best_bid is None:
+        raise dash.exceptions.PreventUpdate
+    version = [product_id, snapshot.version]
+    history_count = [product_id, book.history.raw.count]
+    due = n % graph_interval == 0 or not same_product(depth_seen, product_id)
+    book_version = version if version != book_seen else no_update
+    depth = version if due and version != depth_seen else no_update
+    history = history_count if due and history_count != history_seen else no_update
+    if book_version is no_update and depth is no_update and history is no_update:
+        raise dash.exceptions.PreventUpdate
+    return book_version, depth, history
+
+def same_product(seen, product_id):
+    return isinstance(seen, list) and seen[0] == product_id
 
+# the server only ships the numbers, formatting and animating is up to the browser
 @app.callback(
-    Output('orderbook-chart', 'figure'),
-    Input('interval-component', 'n_intervals')
+    Output('metrics-store', 'data'),
+    Input('book-version', 'data'),
+    State('product-select', 'value')
 )
 
-def update_orderbook_chart(n):
-    if not orderbook or orderbook.get_best_bid() is None:
-        return None
-    if n % graph_interval != 0:
+def update_metrics_store(version, product_id):
+    product_id, book = selected(product_id)
+    snapshot = book.snapshot
+    if snapshot.best_bid is None:
         raise dash.exceptions.PreventUpdate
-    depth = orderbook.get_depth_snapshot(levels=15)
-    bid_prices = [price for price, size in depth['bids']]
-    bid_sizes = [size for price, size in depth['bids']]
-    ask_prices = [price for price, size in depth['asks']]
-    ask_sizes = [size for price, size in depth['asks']]
-    bid_sizes = [-size for size in bid_sizes]
-    max_volume = max(max(abs(x) for x in bid_sizes), max(abs(x) for x in ask_sizes))
-    # make chart
-    fig = go.Figure()
-    fig.add_trace(go.Bar(
-        y=bid_prices,
-        x=bid_sizes,
-        orientation='h',
-        name='Bids',
-        marker_color=COLORS['bid_green'],
-        hovertemplate='Price: $%{y:,.2f}<br>Size: %{x:.4f} BTC'
-    ))
-    fig.add_trace(go.Bar(
-        y=ask_prices,
-        x=ask_sizes,
-        orientation='h',
-        name='Asks',
-        marker_color=COLORS['ask_red'],
-        hovertemplate='Price: $%{y:,.2f}<br>Size: %{x:.4f} BTC'
-    ))
-    fig.update_layout(
-        plot_bgcolor=COLORS['card_bg'],
-        paper_bgcolor=COLORS['card_bg'],
-        font={'color': COLORS['text'], 'family': FONTS['body'], 'size': 12},
-        showlegend=False,
-        margin=dict(l=60, r=40, t=20, b=40),
-        xaxis=dict(
-            title="Volume (BTC)",
-            gridcolor=COLORS['grid'],
-            zerolinecolor=COLORS['grid'],
-            zerolinewidth=1,
-            range=[-max_volume * 1.1, max_volume * 1.1]
-        ),
-        yaxis=dict(
-            title="Price (USD)",
-            gridcolor=COLORS['grid'],
-            tickformat='$,.0f',
-        ),
-        hovermode='closest',
-        bargap=0.4,
-        bargroupgap=0,
-    )
-    fig.update_traces(
-        width=0.6,
-        selector=dict(type='bar')
-    )
-    
-    return fig
+    latency.served(product_id, snapshot)
+    return render_cache.get(f'metrics:{product_id}', snapshot.version, lambda: metric_values(product_id, book, snapshot))
+
+# tiles + imbalance gauge, eased toward the latest numbers every animation frame
+app.clientside_callback(
+    ClientsideFunction(namespace='metrics', function_name='render'),
+    Output('metrics-rendered', 'data'),
+    Input('metrics-store', 'data')
+)
+
+# (re)connect the push stream to the selected product
+app.clientside_callback(
+    ClientsideFunction(namespace='push', function_name='select'),
+    Output('push-product', 'data'),
+    Input('product-select', 'value')
+)
 
 @app.callback(
-    Output('spread-chart', 'figure'),
-    Input('interval-component', 'n_intervals')
+    Output('orderbook-chart', 'figure'),
+    Input('depth-version', 'data'),
+    State('product-select', 'value')
 )
 
-def update_spread_chart(n):
-    if not orderbook or orderbook.get_best_bid() is None:
-        return None
-    if n % graph_interval != 0:
+def update_orderbook_chart(version, product_id):
+    product_id, book = selected(product_id)
+    snapshot = book.snapshot
+    if snapshot.best_bid is None:
         raise dash.exceptions.PreventUpdate
-    fig = go.Figure()
-    orderbook.update_history()
-    spread_data = list(orderbook.spread_history)
-    spread_data=[s for s in spread_data if s is not None]
-    x_values = list(range(len(spread_data)- 1, -1, -1))
+    latency.served(product_id, snapshot)
+    # only the bars and the volume range, the layout is already in the page
+    return render_cache.get(f'orderbook_patch:{product_id}', snapshot.version,
+        lambda: orderbook_patch(display_depth(book, snapshot, levels=15), base_currency(product_id), book.price_decimals))
 
-    fig.add_trace(go.Scatter(
-        x=x_values,
-        y=spread_data,
-        mode='lines',
-        name='Spread',
-        line=dict(
-            color=COLORS['accent'],
-            width=2
-        ),
-        fill='tozeroy',
-        fillcolor=f'rgba(59, 130, 246, 0.1)',
-        hovertemplate='$%{y:.2f}'
-    ))
+@app.callback(
+    [
+        Output('spread-chart', 'figure'),
+        Output('spread-sent', 'data'),
+    ],
+    Input('history-version', 'data'),
+    [
+        State('spread-sent', 'data'),
+        State('product-select', 'value'),
+    ]
+)
 
-    #styling
-    fig.update_layout(
-        plot_bgcolor=COLORS['card_bg'],
-        paper_bgcolor=COLORS['card_bg'],
-        font={'color': COLORS['text'], 'family': FONTS['body'], 'size': 12},
-        showlegend=False,
-        margin=dict(l=40, r=20, t=20, b=40),
-        xaxis=dict(
-            title="Time Ago (Seconds)",
-            gridcolor=COLORS['grid'],
-            tickformat='d'
-        ),
-        yaxis=dict(
-            title="Spread (USD)",
-            gridcolor=COLORS['grid'],
-            tickformat='$,.2f',
-            range=[0, max(spread_data) * 1.2]
-        ),
-        hovermode='x unified'
+def update_spread_chart(version, sent, product_id):
+    product_id, book = selected(product_id)
+    if book.snapshot.best_bid is None:
+        raise dash.exceptions.PreventUpdate
+    # history is filled by the sampler thread; a page that's caught up gets just the new rows
+    # appended, anything else (first render, other product, restart, fell too far behind,
+    # window drawn from a rollup) gets the whole window, cached per history row
+    raw = book.history.raw
+    count = raw.count
+    now = time.time()
+    incremental = (
+        sent is not None
+        and sent.get('product') == product_id
+        and sent['count'] <= count
+        and count - sent['base'] < raw.capacity
+        and book.history.source(now - spread_window) is raw
     )
-    return fig
+    if not incremental:
+        patch = render_cache.get(f'spread_patch:{product_id}', (count, spread_window), lambda: spread_patch(product_id, book, now))
+        return patch, {'product': product_id, 'count': count, 'base': count}
+    if sent['count'] == count:
+        raise dash.exceptions.PreventUpdate
+    times, data = raw.last(count - sent['count'])
+    x_values, spread_data = spread_points(book, times, raw.column(data, 'spread'))
+    patch = Patch()
+    patch['data'][0]['x'].extend(x_values)
+    patch['data'][0]['y'].extend(spread_data)
+    spread_ranges(product_id, book, patch, now)
+    return patch, {'product': product_id, 'count': count, 'base': sent['base']}
+
+# (x in epoch ms, y in dollars) lists for the rows with a spread
+def spread_points(book, times, spreads):
+    valid = ~np.isnan(spreads)
+    return (times[valid] * 1000).tolist(), (spreads[valid] / book.price_scale).tolist()
+
+# the whole window, replacing whatever the chart had
+def spread_patch(product_id, book, now):
+    times, series = book.history.window(spread_window, now)
+    x_values, spread_data = spread_points(book, times, series['spread'])
+    patch = Patch()
+    patch['data'][0]['x'] = x_values
+    patch['data'][0]['y'] = spread_data
+    # only full patches, they're what a product switch gets
+    patch['data'][0]['hovertemplate'] = f'$%{{y:.{max(book.price_decimals, 2)}f}}'
+    patch['layout']['yaxis']['tickformat'] = f'$,.{max(book.price_decimals, 2)}f'
+    spread_ranges(product_id, book, patch, now)
+    return patch
+
+# slide the x axis to the window and fit y to the largest spread in it
+def spread_ranges(product_id, book, patch, now):
+    patch['layout']['xaxis']['range'] = [(now - spread_window) * 1000, now * 1000]
+    max_spread = render_cache.get(f'spread_max:{product_id}', (book.history.raw.count, spread_window),
+        lambda: window_max_spread(book, now))
+    if max_spread is not None:
+        patch['layout']['yaxis']['range'] = [0, max_spread * 1.2]
 
+def window_max_spread(book, now):
+    times, series = book.history.window(spread_window, now)
+    spreads = series['spread']
+    if np.isnan(spreads).all():
+        return None
+    return float(np.nanmax(spreads)) / book.price_scale
+
+# the wide view moves slowly, it refreshes with the portfolio once a second whether or not push is on
 @app.callback(
+    Output('cumulative-chart', 'figure'),
     [
-        Output('imbalance-gauge-value', 'children'),
-        Output('imbalance-bar-sell', 'style'),
-        Output('imbalance-bar-buy', 'style'),
-    ],
-    Input('interval-component', 'n_intervals')
+        Input('portfolio-interval', 'n_intervals'),
+        Input('bucket-select', 'value'),
+        Input('product-select', 'value'),
+    ]
 )
 
-def update_imbalance_gauge(n):
-    if not orderbook or orderbook.get_best_bid() is None:
-        return None,None,None
-    imbalance = orderbook.get_imbalance()
-    if imbalance is None: imbalance = 0.5
-    buy_percentage = imbalance * 100
-    sell_percentage = (1-imbalance) * 100
-    gauge_text = f"{imbalance:.1%}"
-
-    sell_style = {
-        'backgroundColor': COLORS['ask_red'],
-        'height': '6px',
-        'transition': 'width 0.3s ease',
-        'borderRadius': '3px',
-        'width': f'{sell_percentage}%'
-    }
+def update_cumulative_chart(n, choice, product_id):
+    product_id, book = selected(product_id)
+    snapshot = book.snapshot
+    if snapshot.mid_price is None:
+        raise dash.exceptions.PreventUpdate
+    return render_cache.get(f'cumulative:{product_id}:{choice}', snapshot.version,
+        lambda: cumulative_patch(book, snapshot, choice, base_currency(product_id)))
 
-    buy_style = {
-        'backgroundColor': COLORS['bid_green'],
-        'height': '6px',
-        'transition': 'width 0.3s ease',
-        'borderRadius': '3px',
-        'width': f'{buy_percentage}%'
-    }
+# bucket labels follow the product's price decimals ($1 on btc, $0.001 on doge)
+@app.callback(
+    Output('bucket-select', 'options'),
+    Input('product-select', 'value')
+)
 
-    return gauge_text, sell_style, buy_style
+def update_bucket_options(product_id):
+    product_id, book = selected(product_id)
+    return bucket_options(book)
+
+# feed channel, book staleness and ingest cpu of the selected product, once a second
+# so level2 and level2_batch can be compared side by side (in web mode only the book's age is known here)
+@app.callback(
+    Output('feed-status', 'children'),
+    Input('portfolio-interval', 'n_intervals'),
+    State('product-select', 'value')
+)
+
+def update_feed_status(n, product_id):
+    product_id, book = selected(product_id)
+    return render_cache.get(f'feed_status:{product_id}', int(time.time()), lambda: feed_status(product_id, book))
+
+def feed_status(product_id, book):
+    snapshot = book.snapshot
+    if snapshot.best_bid is None:
+        return "Waiting for the feed"
+    if mode == 'web':
+        return f"Book age {(time.time() - snapshot.timestamp) * 1000:,.0f} ms"
+    products, cpu_percent = ingest.usage()
+    usage = products.get(product_id)
+    source = 'replay' if replay_path else ' + '.join(ws_client.channels) if ws_client else feed_channel
+    parts = [source]
+    if usage and usage['staleness_ms'] is not None:
+        parts.append(f"book ~{usage['staleness_ms']:,.0f} ms stale ({usage['latency_ms']:,.0f} ms latency)")
+    if usage:
+        parts.append(f"{usage['changes_per_sec']:,.0f} changes/s")
+    parts.append(f"ingest CPU {sum(cpu_percent.values()):.1f}%")
+    return " · ".join(parts)
+
+# slowest callbacks / book methods by total time and the book locks, from MMV_PROFILE's counters
+if profiler:
+    @app.callback(
+        Output('profile-panel', 'children'),
+        Input('portfolio-interval', 'n_intervals')
+    )
+
+    def update_profile_panel(n):
+        return render_cache.get('profile_panel', int(time.time()), profile_panel)
+
+def profile_panel():
+    stats = profiler.stats()
+    calls = sorted(stats['calls'].items(), key=lambda item: item[1]['total_s'], reverse=True)[:15]
+    elapsed = max(time.time() - stats['since'], 1e-9)
+    call_rows = [html.Tr([html.Th(heading) for heading in ("Call", "Calls", "Avg ms", "Max ms", "CPU", "Share of wall", "Avg KB")])]
+    for name, call in calls:
+        call_rows.append(html.Tr([
+            html.Td(name),
+            html.Td(f"{call['calls']:,}"),
+            html.Td(f"{call['avg_ms']:.2f}"),
+            html.Td(f"{call['max_ms']:.1f}"),
+            html.Td(f"{call['cpu_s'] / call['total_s'] * 100:.0f}%" if call['total_s'] else "-"),
+            html.Td(f"{call['total_s'] / elapsed * 100:.1f}%"),
+            html.Td(f"{call['avg_bytes'] / 1024:.1f}" if call['avg_bytes'] else "-"),
+        ]))
+    lock_rows = [html.Tr([html.Th(heading) for heading in ("Lock / thread", "Acquires", "Avg wait ms", "Max wait ms", "Avg hold ms", "Max hold ms")])]
+    for product_id, groups in stats['locks'].items():
+        for group, lock in sorted(groups.items(), key=lambda item: item[1]['hold_s'], reverse=True):
+            lock_rows.append(html.Tr([
+                html.Td(f"{product_id} · {group}"),
+                html.Td(f"{lock['acquires']:,}"),
+                html.Td(f"{lock['avg_wait_ms']:.3f}"),
+                html.Td(f"{lock['max_wait_ms']:.1f}"),
+                html.Td(f"{lock['avg_hold_ms']:.3f}"),
+                html.Td(f"{lock['max_hold_ms']:.1f}"),
+            ]))
+    tables = [html.Table(call_rows)]
+    if len(lock_rows) > 1:
+        tables.append(html.Table(lock_rows))
+    return tables
 
 # paper trading
 @app.callback(
@@ -723,7 +1382,7 @@ def update_imbalance_gauge(n):
     [
         Input('buy-button', 'n_clicks'),
         Input('sell-button', 'n_clicks'),
-        Input('interval-component', 'n_intervals'),
+        Input('portfolio-interval', 'n_intervals'),
     ],
     [
         dash.dependencies.State('trade-amount', 'value')
@@ -731,18 +1390,20 @@ def update_imbalance_gauge(n):
 )
 def handle_trading(buy_clicks, sell_clicks, n, amount):
     # At the start of each callback
-    if not orderbook or orderbook.get_best_bid() is None:
+    # one snapshot read so bid and ask come from the same book state
+    snapshot = orderbook.snapshot
+    if snapshot.best_bid is None:
         return "", "", "", "", []
     global portfolio
     
     if amount is None or amount <= 0:
         amount = 0.01
 
-    best_ask = orderbook.get_best_ask()
+    best_ask = orderbook.to_price(snapshot.best_ask)
     if best_ask is None:
         best_ask = 0
 
-    best_bid = orderbook.get_best_bid()
+    best_bid = orderbook.to_price(snapshot.best_bid)
     if best_bid is None:
         best_bid = 0
     
@@ -833,8 +1494,31 @@ def handle_trading(buy_clicks, sell_clicks, n, amount):
 # Main
 ##################
 
-start_websocket()
-if __name__ == '__main__':
+if start_feed and mode != 'web':
+	for product_id, book in registry.items():
+		if mode == 'ingest':
+			# first, so the history rings (and the backfill below) live in shared memory
+			shared_writers.append(SharedBookWriter(book, shared_name(product_id), latency=latency, product_id=product_id,
+				band=depth_band))
+		if history_dir:
+			book.open_store(MetricsStore(os.path.join(history_dir, product_id)))
+	start_websocket()
+	sampler.start()
+	for writer in shared_writers:
+		writer.start()
+if start_feed and mode != 'ingest':
+	for broadcaster in broadcasters.values():
+		broadcaster.start()
+if __name__ == '__main__' and mode == 'ingest':
+	# no dashboard here, the web workers serve it
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		print("\n- User Interrupt (keypress) -\n")
+	for writer in shared_writers:
+		writer.stop()
+elif __name__ == '__main__':
 	app.run(debug=False, 
             dev_tools_hot_reload=False,
             dev_tools_ui=False,
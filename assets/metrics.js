@@ -0,0 +1,112 @@
+// clientside rendering of the metric tiles and the imbalance gauge
+// the server (or the push stream) only sets metrics-store to
+//   [best bid, best ask, spread, mid price, imbalance, microprice, weighted mid,
+//    imbalance top 5, imbalance top 50, book slope, size within 10 bps]   (see METRIC_FIELDS in app.py)
+// and this eases the displayed numbers toward it on every animation frame.
+(function () {
+    // [tile id, format] in METRIC_FIELDS order
+    var TILES = [
+        ['best-bid-value', 'money'], ['best-ask-value', 'money'], ['spread-value', 'money'],
+        ['mid-price-value', 'money'], ['imbalance-value', 'percent'],
+        ['microprice-value', 'money'], ['weighted-mid-value', 'money'],
+        ['imbalance-5-value', 'percent'], ['imbalance-50-value', 'percent'],
+        ['book-slope-value', 'size'], ['within-10bp-value', 'size']
+    ];
+    var IMBALANCE = 4;
+    var money = new Intl.NumberFormat('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+    // sub-dollar pairs (and their spreads) need more than cents
+    var fine = new Intl.NumberFormat('en-US', {minimumFractionDigits: 2, maximumSignificantDigits: 4});
+    var size = new Intl.NumberFormat('en-US', {maximumSignificantDigits: 4});
+
+    var shown = null;   // what's on screen right now
+    var from = null;    // where the current animation started
+    var target = null;  // latest numbers from the server
+    var startedAt = 0;
+    var duration = 300;
+    var lastUpdate = 0;
+    var frame = null;
+
+    function percent(value) {
+        return (value * 100).toFixed(1) + '%';
+    }
+
+    function format(kind, value) {
+        if (kind === 'percent') {
+            return percent(value);
+        }
+        if (kind === 'size') {
+            return size.format(value);
+        }
+        return '$' + (Math.abs(value) < 1 ? fine : money).format(value);
+    }
+
+    function setText(id, text) {
+        var element = document.getElementById(id);
+        if (element && element.textContent !== text) {
+            element.textContent = text;
+        }
+    }
+
+    function setWidth(id, fraction) {
+        var element = document.getElementById(id);
+        if (element) {
+            element.style.width = (fraction * 100) + '%';
+        }
+    }
+
+    function draw(values) {
+        TILES.forEach(function (tile, i) {
+            if (values[i] === null || values[i] === undefined) {
+                return;
+            }
+            setText(tile[0], format(tile[1], values[i]));
+        });
+        var imbalance = values[IMBALANCE] === null ? 0.5 : values[IMBALANCE];
+        setText('imbalance-gauge-value', percent(imbalance));
+        setWidth('imbalance-bar-sell', 1 - imbalance);
+        setWidth('imbalance-bar-buy', imbalance);
+    }
+
+    function step(time) {
+        var alpha = Math.min((time - startedAt) / duration, 1);
+        var eased = 1 - Math.pow(1 - alpha, 3);
+        shown = target.map(function (value, i) {
+            var start = from[i];
+            if (value === null || start === null) {
+                return value;
+            }
+            return start + (value - start) * eased;
+        });
+        draw(shown);
+        frame = alpha < 1 ? requestAnimationFrame(step) : null;
+    }
+
+    function render(data) {
+        var no_update = window.dash_clientside.no_update;
+        if (!data) {
+            return no_update;
+        }
+        var now = performance.now();
+        // spread each move over the gap between updates so the motion is continuous
+        if (lastUpdate) {
+            duration = Math.max(100, Math.min(now - lastUpdate, 1000));
+        }
+        lastUpdate = now;
+        from = shown || data;
+        target = data;
+        startedAt = now;
+        if (frame === null) {
+            frame = requestAnimationFrame(step);
+        }
+        return no_update;
+    }
+
+    // next numbers are drawn as they are, without easing from what's shown
+    function reset() {
+        shown = null;
+        lastUpdate = 0;
+    }
+
+    window.dash_clientside = window.dash_clientside || {};
+    window.dash_clientside.metrics = {render: render, reset: reset};
+})();
@@ -0,0 +1,130 @@
+// renders the market push stream (/stream, see push.py) in the browser
+// the server sends a full state once, then only the parts that changed; this keeps the
+// last full state, applies the deltas and pushes props into the dash components.
+// if the stream isn't available the interval polling is switched back on.
+// the stream is per product (/stream?product=...), the product dropdown reconnects it via select().
+(function () {
+    var state = null;
+    var templates = null;
+    var samples = [];
+    var windowSeconds = 300;
+    var connected = false;
+    var source = null;
+    var product = null;
+
+    function setProps(id, props) {
+        if (!window.dash_clientside || !window.dash_clientside.set_props) {
+            return;
+        }
+        try {
+            window.dash_clientside.set_props(id, props);
+        } catch (e) {
+            // layout not rendered yet, the next message catches up
+        }
+    }
+
+    function clone(value) {
+        return JSON.parse(JSON.stringify(value));
+    }
+
+    function renderDepth(depth) {
+        var figure = clone(templates.orderbook);
+        var bidSizes = depth.bids.map(function (level) { return -level[1]; });
+        var askSizes = depth.asks.map(function (level) { return level[1]; });
+        figure.data[0].y = depth.bids.map(function (level) { return level[0]; });
+        figure.data[0].x = bidSizes;
+        figure.data[1].y = depth.asks.map(function (level) { return level[0]; });
+        figure.data[1].x = askSizes;
+        var maxVolume = Math.max.apply(null, bidSizes.map(Math.abs).concat(askSizes, [0]));
+        figure.layout.xaxis.range = [-maxVolume * 1.1, maxVolume * 1.1];
+        setProps('orderbook-chart', {figure: figure});
+    }
+
+    function renderSpread(now) {
+        var cutoff = now - windowSeconds;
+        while (samples.length && samples[0][0] < cutoff) {
+            samples.shift();
+        }
+        if (!samples.length) {
+            return;
+        }
+        var figure = clone(templates.spread);
+        figure.data[0].x = samples.map(function (sample) { return sample[0] * 1000; });
+        figure.data[0].y = samples.map(function (sample) { return sample[1]; });
+        var maxSpread = Math.max.apply(null, figure.data[0].y);
+        figure.layout.yaxis.range = [0, maxSpread * 1.2];
+        figure.layout.xaxis.range = [cutoff * 1000, now * 1000];
+        setProps('spread-chart', {figure: figure});
+    }
+
+    function render(parts, now, newSamples) {
+        Object.keys(parts).forEach(function (name) {
+            if (name === 'depth') {
+                renderDepth(parts.depth);
+            } else if (name === 'metrics') {
+                // tiles + gauge are drawn by assets/metrics.js off this store
+                setProps('metrics-store', {data: parts.metrics});
+            }
+        });
+        if (newSamples) {
+            renderSpread(now);
+        }
+    }
+
+    function onMessage(event) {
+        var message = JSON.parse(event.data);
+        if (message.type === 'full') {
+            templates = message.templates;
+            windowSeconds = message.window || windowSeconds;
+            state = message.parts;
+            samples = message.samples;
+            render(state, message.now, true);
+        } else if (state) {
+            Object.assign(state, message.parts);
+            Array.prototype.push.apply(samples, message.samples);
+            render(message.parts, message.now, message.samples.length > 0);
+        }
+    }
+
+    function connect() {
+        if (source) {
+            source.close();
+        }
+        // the first message on the new stream is a full one, nothing carries over
+        state = null;
+        samples = [];
+        var current = new EventSource('/stream?product=' + encodeURIComponent(product));
+        current.onopen = function () {
+            connected = true;
+            setProps('interval-component', {disabled: true});
+        };
+        current.onmessage = onMessage;
+        current.onerror = function () {
+            // closed for good (push disabled, 204) or dropped and retrying: poll until it's back
+            if (connected || current.readyState === EventSource.CLOSED) {
+                setProps('interval-component', {disabled: false});
+            }
+            connected = false;
+        };
+        source = current;
+    }
+
+    // clientside callback on the product dropdown, also runs once when the page loads
+    function select(value) {
+        if (value === product) {
+            return window.dash_clientside.no_update;
+        }
+        product = value;
+        // don't ease the tiles from the old product's prices to the new one's
+        if (window.dash_clientside.metrics) {
+            window.dash_clientside.metrics.reset();
+        }
+        if (window.EventSource) {
+            connect();
+        }
+        return value;
+    }
+
+    window.dash_clientside = window.dash_clientside || {};
+    window.dash_clientside.push = {select: select};
+})();
@@ -0,0 +1,115 @@
+import argparse
+import json
+import random
+import time
+from order_book import OrderBook
+from decoder import Level2Decoder
+
+# micro-benchmark: fast level2 decoder vs json.loads + string parsing
+# run from the repo root:
+#   python -m benchmarks.bench_decoder
+#   python -m benchmarks.bench_decoder --frames recorded.txt   (one raw frame per line)
+
+# coinbase shaped frames around 67k, one snapshot then l2updates
+def make_frames(count, levels=1000, seed=7):
+	rng = random.Random(seed)
+	frames = [json.dumps({
+		"type": "snapshot",
+		"product_id": "BTC-USD",
+		"bids": [[f"{67000 - i * 0.01:.2f}", f"{rng.random():.8f}"] for i in range(levels)],
+		"asks": [[f"{67000.01 + i * 0.01:.2f}", f"{rng.random():.8f}"] for i in range(levels)],
+	}, separators=(',', ':'))]
+	for _ in range(count):
+		changes = []
+		for _ in range(rng.randint(1, 8)):
+			side = rng.choice(("buy", "sell"))
+			offset = rng.randint(0, levels) * 0.01
+			price = 67000 - offset if side == "buy" else 67000.01 + offset
+			size = "0" if rng.random() < 0.3 else f"{rng.random():.8f}"
+			changes.append([side, f"{price:.2f}", size])
+		frames.append(json.dumps({
+			"type": "l2update",
+			"product_id": "BTC-USD",
+			"changes": changes,
+			"time": "2025-01-01T00:00:00.000000Z",
+		}, separators=(',', ':')))
+	return frames
+
+def load_frames(path):
+	with open(path) as f:
+		return [line.rstrip('\n') for line in f if line.strip()]
+
+# the old path: generic dicts, then OrderBook parses every string
+def decode_json(frames, orderbook):
+	parse_price = orderbook.parse_price
+	parse_size = orderbook.parse_size
+	for frame in frames:
+		data = json.loads(frame)
+		msg_type = data.get("type")
+		if msg_type == "l2update":
+			for side, price, size in data['changes']:
+				parse_price(price)
+				parse_size(size)
+		elif msg_type == "snapshot":
+			for price, size in data['bids']:
+				parse_price(price)
+				parse_size(size)
+			for price, size in data['asks']:
+				parse_price(price)
+				parse_size(size)
+
+# the ingest applier hands the decoder a batch at a time
+BATCH = 256
+
+def decode_fast(frames, orderbook):
+	decode_batch = Level2Decoder(orderbook.price_decimals, orderbook.size_decimals).decode_batch
+	for start in range(0, len(frames), BATCH):
+		decode_batch(frames[start:start + BATCH])
+
+def apply_json(frames, orderbook):
+	for frame in frames:
+		data = json.loads(frame)
+		msg_type = data.get("type")
+		if msg_type == "l2update":
+			orderbook.process_update(data['changes'])
+		elif msg_type == "snapshot":
+			orderbook.initialize_snapshot(data['bids'], data['asks'])
+
+def apply_fast(frames, orderbook):
+	decode_batch = Level2Decoder(orderbook.price_decimals, orderbook.size_decimals).decode_batch
+	for start in range(0, len(frames), BATCH):
+		for msg_type, data in decode_batch(frames[start:start + BATCH]):
+			if msg_type == "l2update":
+				orderbook.apply_changes(data.sides.tolist(), data.prices.tolist(), data.sizes.tolist())
+			elif msg_type == "snapshot":
+				orderbook.load_snapshot(data.bid_prices.tolist(), data.bid_sizes.tolist(), data.ask_prices.tolist(), data.ask_sizes.tolist())
+
+# best of `repeat` runs, in seconds
+def timed(fn, frames, repeat):
+	best = None
+	for _ in range(repeat):
+		orderbook = OrderBook()
+		start = time.perf_counter()
+		fn(frames, orderbook)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def main():
+	parser = argparse.ArgumentParser(description="fast level2 decoder vs json.loads")
+	parser.add_argument('--frames', help="file with one raw frame per line (default: synthetic)")
+	parser.add_argument('--count', type=int, default=50000, help="synthetic l2update frames")
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	frames = load_frames(args.frames) if args.frames else make_frames(args.count)
+	print(f"{len(frames)} frames, {sum(len(f) for f in frames) / 1e6:.1f} MB")
+	for name, baseline, fast in (("decode", decode_json, decode_fast), ("decode+apply", apply_json, apply_fast)):
+		slow_time = timed(baseline, frames, args.repeat)
+		fast_time = timed(fast, frames, args.repeat)
+		print(f"{name:>14}: json {len(frames) / slow_time:>10,.0f} frames/s | "
+			f"fast {len(frames) / fast_time:>10,.0f} frames/s | {slow_time / fast_time:.2f}x")
+
+if __name__ == "__main__":
+	main()
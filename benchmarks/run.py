@@ -0,0 +1,291 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+# benchmark suite for OrderBook operations and Dash callback render cost
+# run from the repo root:
+#   python -m benchmarks.run                       run everything, compare to baseline.json
+#   python -m benchmarks.run --quick               small iteration counts (CI smoke)
+#   python -m benchmarks.run --filter orderbook    only cases whose name contains "orderbook"
+#   python -m benchmarks.run --save-baseline       store this run as the new baseline
+# every case reports throughput (ops/s), p50/p99 latency (us) and peak traced memory (KB).
+# results are written as json (--output) so CI can diff them.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, 'baseline.json')
+
+BOOK_SIZES = (1000, 10000, 100000)
+UPDATE_BATCHES = (1, 10, 100)
+
+# imported lazily so --help works without the app's dependencies
+def load_orderbook():
+	from order_book import OrderBook
+	return OrderBook
+
+# wire format book with `levels` total levels around 67k
+def make_wire_book(levels, rng):
+	half = levels // 2
+	bids = [[f"{67000 - i * 0.01:.2f}", f"{rng.random():.8f}"] for i in range(half)]
+	asks = [[f"{67000.01 + i * 0.01:.2f}", f"{rng.random():.8f}"] for i in range(half)]
+	return bids, asks
+
+# wire format change lists that mostly hit the top of a `levels` book
+def make_wire_changes(levels, batch, count, rng):
+	half = levels // 2
+	updates = []
+	for _ in range(count):
+		changes = []
+		for _ in range(batch):
+			side = rng.choice(("buy", "sell"))
+			offset = min(int(rng.expovariate(1 / 50)), half) * 0.01
+			price = 67000 - offset if side == "buy" else 67000.01 + offset
+			changes.append([side, f"{price:.2f}", "0" if rng.random() < 0.3 else f"{rng.random():.8f}"])
+		updates.append(changes)
+	return updates
+
+def loaded_book(levels, rng):
+	OrderBook = load_orderbook()
+	orderbook = OrderBook()
+	bids, asks = make_wire_book(levels, rng)
+	orderbook.initialize_snapshot(bids, asks)
+	return orderbook
+
+##################
+# Cases
+##################
+
+# each case is (name, setup) where setup() returns (op, iterations_hint) or
+# (op, iterations_hint, prepare); op(i) runs the measured thing once, prepare(i) runs
+# untimed before it
+def orderbook_cases():
+	cases = []
+	for levels in BOOK_SIZES:
+		def snapshot_setup(levels=levels):
+			OrderBook = load_orderbook()
+			bids, asks = make_wire_book(levels, random.Random(1))
+			orderbook = OrderBook()
+			return (lambda i: orderbook.initialize_snapshot(bids, asks)), max(3, 200000 // levels)
+		cases.append((f"orderbook.initialize_snapshot/{levels}", snapshot_setup))
+
+		for batch in UPDATE_BATCHES:
+			def update_setup(levels=levels, batch=batch):
+				rng = random.Random(2)
+				orderbook = loaded_book(levels, rng)
+				updates = make_wire_changes(levels, batch, 2000, rng)
+				return (lambda i: orderbook.process_update(updates[i % len(updates)])), 20000 // batch
+			cases.append((f"orderbook.process_update/{levels}x{batch}", update_setup))
+
+		for method in ("get_metrics", "get_imbalance", "get_depth_snapshot"):
+			def read_setup(levels=levels, method=method):
+				orderbook = loaded_book(levels, random.Random(3))
+				fn = getattr(orderbook, method)
+				return (lambda i: fn()), 20000
+			cases.append((f"orderbook.{method}/{levels}", read_setup))
+	return cases
+
+# end to end dash callbacks through the flask test client, so json serialization
+# of the figure / children is included like it is for a real browser
+def callback_cases():
+	state = {}
+
+	def app_client():
+		if 'client' not in state:
+			os.environ['MMV_START_FEED'] = '0'
+			import app as dash_app
+			rng = random.Random(4)
+			bids, asks = make_wire_book(10000, rng)
+			dash_app.orderbook.initialize_snapshot(bids, asks)
+			for changes in make_wire_changes(10000, 10, 300, rng):
+				dash_app.orderbook.process_update(changes)
+				dash_app.orderbook.update_history()
+			client = dash_app.app.server.test_client()
+			client.get('/')
+			state['app'] = dash_app
+			state['client'] = client
+			state['updates'] = make_wire_changes(10000, 10, 2000, rng)
+		return state['app'], state['client']
+
+	# a new book version and history row before every request, like the live feed gives,
+	# otherwise every request after the first is a render cache hit and nothing is rendered
+	def advance(i):
+		dash_app = state['app']
+		dash_app.orderbook.process_update(state['updates'][i % len(state['updates'])])
+		dash_app.orderbook.update_history()
+
+	# build the /_dash-update-component body for the callback whose function is `name`
+	def request_body(dash_app, name, n_intervals):
+		for output, spec in dash_app.app.callback_map.items():
+			# clientside callbacks have no python function
+			if 'callback' not in spec or spec['callback'].__name__ != name:
+				continue
+			inputs = []
+			for item in spec['inputs']:
+				value = n_intervals if item['property'] == 'n_intervals' else 0
+				inputs.append({'id': item['id'], 'property': item['property'], 'value': value})
+			states = [{'id': item['id'], 'property': item['property'], 'value': 0.01 if item['property'] == 'value' else None}
+				for item in spec.get('state', [])]
+			if output.startswith('..'):
+				outputs = [dict(zip(('id', 'property'), part.split('.', 1))) for part in output[2:-2].split('...')]
+			else:
+				outputs = dict(zip(('id', 'property'), output.split('.', 1)))
+			return {
+				'output': output,
+				'outputs': outputs,
+				'inputs': inputs,
+				'state': states,
+				'changedPropIds': ['interval-component.n_intervals'],
+			}
+		raise KeyError(name)
+
+	cases = []
+	for name in ("tick", "update_metrics_store", "update_orderbook_chart", "update_spread_chart", "handle_trading"):
+		def setup(name=name):
+			dash_app, client = app_client()
+			# graph callbacks only render on every graph_interval'th tick
+			body = request_body(dash_app, name, dash_app.graph_interval * 10)
+			def op(i):
+				response = client.post('/_dash-update-component', json=body)
+				if response.status_code not in (200, 204):
+					raise RuntimeError(f"{name}: HTTP {response.status_code}")
+				state['bytes'] = len(response.data)
+			return op, 2000, advance
+		cases.append((f"callback.{name}", setup))
+	return cases
+
+##################
+# Measuring
+##################
+
+def percentile(sorted_values, fraction):
+	if not sorted_values:
+		return 0.0
+	index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+	return sorted_values[index]
+
+def run_case(setup, scale, memory):
+	op, iterations, *prepare = setup()
+	prepare = prepare[0] if prepare else None
+	iterations = max(3, int(iterations * scale))
+	# warm up
+	for i in range(min(iterations, 10)):
+		if prepare:
+			prepare(i)
+		op(i)
+	gc.collect()
+	timings = []
+	perf = time.perf_counter_ns
+	for i in range(iterations):
+		if prepare:
+			prepare(i)
+		t0 = perf()
+		op(i)
+		timings.append(perf() - t0)
+	# throughput from the timed ops only, prepare isn't part of the case
+	total = sum(timings)
+	timings.sort()
+	result = {
+		'iterations': iterations,
+		'ops_per_sec': iterations / (total / 1e9),
+		'p50_us': percentile(timings, 0.50) / 1e3,
+		'p99_us': percentile(timings, 0.99) / 1e3,
+	}
+	# separate short pass for memory, tracemalloc would skew the timings
+	if memory:
+		tracemalloc.start()
+		peak = 0
+		for i in range(min(iterations, 50)):
+			if prepare:
+				prepare(i)
+			# peak over what was live when the op started, so prepare's allocations don't count
+			tracemalloc.reset_peak()
+			base = tracemalloc.get_traced_memory()[0]
+			op(i)
+			peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+		result['peak_kb'] = peak / 1024
+		tracemalloc.stop()
+	return result
+
+# relative change of each metric vs the baseline, + is better
+def compare(results, baseline, threshold):
+	regressions = []
+	print(f"\n{'case':<45} {'ops/s':>12} {'p50 us':>10} {'p99 us':>10} {'peak KB':>9}  vs baseline")
+	for name, result in results.items():
+		line = (f"{name:<45} {result['ops_per_sec']:>12,.0f} {result['p50_us']:>10.1f} "
+			f"{result['p99_us']:>10.1f} {result.get('peak_kb', 0):>9.1f}")
+		old = baseline.get(name)
+		if old:
+			throughput = result['ops_per_sec'] / old['ops_per_sec'] - 1
+			p99 = old['p99_us'] / result['p99_us'] - 1 if result['p99_us'] else 0
+			line += f"  {throughput:+.0%} thru, {p99:+.0%} p99"
+			if throughput < -threshold:
+				regressions.append((name, throughput))
+				line += "  <-- REGRESSION"
+		else:
+			line += "  (not in baseline)"
+		print(line)
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description="order book + dash callback benchmarks")
+	parser.add_argument('--filter', default='', help="only run cases containing this text")
+	parser.add_argument('--quick', action='store_true', help="10%% of the usual iterations")
+	parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+	parser.add_argument('--output', default=os.path.join(HERE, 'results.json'))
+	parser.add_argument('--baseline', default=BASELINE_PATH)
+	parser.add_argument('--save-baseline', action='store_true')
+	parser.add_argument('--threshold', type=float, default=0.25, help="throughput drop that counts as a regression")
+	parser.add_argument('--fail-on-regression', action='store_true')
+	args = parser.parse_args()
+
+	# the book prints on every snapshot, keep the report readable
+	real_stdout = sys.stdout
+	scale = 0.1 if args.quick else 1.0
+	results = {}
+	for name, setup in orderbook_cases() + callback_cases():
+		if args.filter not in name:
+			continue
+		print(f"running {name}...", file=sys.stderr)
+		sys.stdout = open(os.devnull, 'w')
+		try:
+			results[name] = run_case(setup, scale, not args.no_memory)
+		finally:
+			sys.stdout.close()
+			sys.stdout = real_stdout
+
+	report = {
+		'python': platform.python_version(),
+		'machine': platform.machine(),
+		'timestamp': time.time(),
+		'results': results,
+	}
+	with open(args.output, 'w') as f:
+		json.dump(report, f, indent=1)
+
+	baseline = {}
+	if os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			baseline = json.load(f).get('results', {})
+	regressions = compare(results, baseline, args.threshold)
+	# a renamed or removed case would otherwise just drop out of the comparison
+	missing = [name for name in baseline if args.filter in name and name not in results]
+	if missing:
+		print(f"\nin the baseline but not run: {', '.join(missing)} (--save-baseline to drop them)")
+	print(f"\nresults written to {args.output}")
+
+	if args.save_baseline:
+		with open(args.baseline, 'w') as f:
+			json.dump(report, f, indent=1)
+		print(f"baseline saved to {args.baseline}")
+	if regressions:
+		print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+		if args.fail_on_regression:
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,164 @@
+import threading
+import time
+
+# keeps each product's book honest against the feed
+#
+# a book is out of sync when the connection drops, a numbered message goes missing (sequence
+# gap), one of its frames is dropped on a full ingest ring (overflow, the only way to notice a
+# loss on the unnumbered level2_batch channel) or the book ends up crossed (best bid >= best ask). the product is then resubscribed,
+# which makes the exchange send a fresh snapshot; until it lands, that product's updates are
+# dropped (they'd go on top of a book we know is wrong) and readers keep the last good book,
+# never an empty one. time from noticing to the new snapshot being live is the time to recover.
+#
+# feeds that can't resubscribe (replays) only get the problems counted.
+
+class ProductSync:
+	def __init__(self):
+		# last sequence applied, None until a numbered message arrives
+		self.sequence = None
+		# monotonic time the current resync started, None while in sync
+		self.resyncing_since = None
+		self.reason = None
+
+		# stats
+		self.events = {'gap': 0, 'crossed': 0, 'disconnect': 0, 'overflow': 0}
+		self.recoveries = 0
+		self.last_recover = None
+		self.max_recover = 0.0
+		self.total_recover = 0.0
+		self.dropped_frames = 0
+		self.stale_frames = 0
+
+class BookSync:
+	def __init__(self, product_ids):
+		self.products = {product_id: ProductSync() for product_id in product_ids}
+		# callable(product_ids) that gets fresh snapshots sent, see attach
+		self.resubscribe = None
+		self.lock = threading.Lock()
+
+	# follow a feed: resync requests go to its resubscribe(), its disconnects mark every book
+	def attach(self, feed):
+		self.resubscribe = getattr(feed, 'resubscribe', None)
+		if hasattr(feed, 'add_close_listener'):
+			feed.add_close_listener(self.disconnected)
+
+	# the rest run on the applier thread of the product's shard
+
+	# a snapshot replaced the book, whatever was wrong with it is fixed
+	def snapshot(self, product_id, sequence):
+		state = self.products.get(product_id)
+		if state is None:
+			return
+		with self.lock:
+			state.sequence = sequence
+			if state.resyncing_since is not None:
+				elapsed = time.monotonic() - state.resyncing_since
+				state.resyncing_since = None
+				state.recoveries += 1
+				state.last_recover = elapsed
+				state.total_recover += elapsed
+				if elapsed > state.max_recover:
+					state.max_recover = elapsed
+				print(f"+ {product_id} resynced after {state.reason} in {elapsed:.2f}s +")
+
+	# (start, end) of the run of update frames with these sequences that's safe to apply
+	# frames the book has already seen are skipped, a gap cuts the run short and starts a resync
+	def updates(self, product_id, sequences):
+		state = self.products.get(product_id)
+		if state is None:
+			return 0, len(sequences)
+		gap = False
+		with self.lock:
+			if state.resyncing_since is not None:
+				state.dropped_frames += len(sequences)
+				return 0, 0
+			start = 0
+			end = len(sequences)
+			expected = state.sequence
+			for index, sequence in enumerate(sequences):
+				if sequence is None or expected is None:
+					expected = sequence if sequence is not None else expected
+					continue
+				if sequence <= expected:
+					# still in flight from before the snapshot
+					if index == start:
+						start += 1
+						state.stale_frames += 1
+						continue
+				elif sequence == expected + 1:
+					expected = sequence
+					continue
+				gap = self.start_resync(state, 'gap')
+				end = index
+				break
+			state.sequence = expected
+		if gap:
+			print(f"- {product_id} missed messages after sequence {expected}, resyncing -")
+			self.request(product_id)
+		return start, end
+
+	# the book after a batch of updates, a crossed one can't be right
+	def check(self, product_id, snapshot):
+		state = self.products.get(product_id)
+		if state is None or snapshot.best_bid is None or snapshot.best_ask is None or snapshot.best_bid < snapshot.best_ask:
+			return
+		with self.lock:
+			crossed = state.resyncing_since is None and self.start_resync(state, 'crossed')
+		if crossed:
+			print(f"- {product_id} book crossed ({snapshot.best_bid} >= {snapshot.best_ask}), resyncing -")
+			self.request(product_id)
+
+	# receive thread: a frame of this product didn't fit in the ingest ring
+	# only the first drop of an episode asks for a snapshot, the rest are in the window we're
+	# replacing anyway, unless what got dropped was the snapshot we asked for
+	def overflow(self, product_id, snapshot=False):
+		state = self.products.get(product_id)
+		if state is None:
+			return
+		with self.lock:
+			if state.resyncing_since is None:
+				request = self.start_resync(state, 'overflow')
+			else:
+				request = snapshot
+		if request:
+			print(f"- {product_id} frames dropped on a full ingest ring, resyncing -")
+			self.request(product_id)
+
+	# feed thread: the connection went away, every book is suspect until the reconnect's snapshots
+	def disconnected(self):
+		with self.lock:
+			for state in self.products.values():
+				if state.resyncing_since is None:
+					self.start_resync(state, 'disconnect')
+				state.sequence = None
+
+	# caller holds the lock; True when the product is now waiting on a snapshot
+	def start_resync(self, state, reason):
+		state.events[reason] += 1
+		if self.resubscribe is None and reason != 'disconnect':
+			return False
+		state.resyncing_since = time.monotonic()
+		state.reason = reason
+		return True
+
+	def request(self, product_id):
+		if self.resubscribe is not None:
+			self.resubscribe([product_id])
+
+	def stats(self):
+		with self.lock:
+			return {
+				product_id: {
+					'resyncing': state.resyncing_since is not None,
+					'reason': state.reason if state.resyncing_since is not None else None,
+					'sequence': state.sequence,
+					'events': dict(state.events),
+					'recoveries': state.recoveries,
+					'last_recover_seconds': state.last_recover,
+					'max_recover_seconds': state.max_recover,
+					'avg_recover_seconds': state.total_recover / state.recoveries if state.recoveries else None,
+					'dropped_frames': state.dropped_frames,
+					'stale_frames': state.stale_frames,
+				}
+				for product_id, state in self.products.items()
+			}
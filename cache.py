@@ -0,0 +1,56 @@
+import threading
+
+# memo layer for the dash callbacks, keyed on the book version
+# every callback / session asking for the same thing at the same version shares one result;
+# only the latest version of each entry is kept, older ones are simply replaced.
+class VersionedCache:
+	def __init__(self):
+		self.entries = {} # name -> (key, value)
+		self.locks = {}
+		self.lock = threading.Lock()
+
+		# stats, name -> [hits, misses]
+		self.counts = {}
+
+	# cached value of `name` at `key` (usually the snapshot version), compute() on a miss
+	# concurrent misses on the same name wait for the first one instead of all computing
+	def get(self, name, key, compute):
+		entry = self.entries.get(name)
+		if entry is not None and entry[0] == key:
+			self.count(name, 0)
+			return entry[1]
+		with self.name_lock(name):
+			entry = self.entries.get(name)
+			if entry is not None and entry[0] == key:
+				self.count(name, 0)
+				return entry[1]
+			value = compute()
+			self.entries[name] = (key, value)
+			self.count(name, 1)
+			return value
+
+	def name_lock(self, name):
+		lock = self.locks.get(name)
+		if lock is None:
+			with self.lock:
+				lock = self.locks.setdefault(name, threading.Lock())
+		return lock
+
+	def count(self, name, index):
+		counts = self.counts.get(name)
+		if counts is None:
+			counts = self.counts.setdefault(name, [0, 0])
+		counts[index] += 1
+
+	def clear(self):
+		self.entries.clear()
+
+	def stats(self):
+		hits = sum(counts[0] for counts in self.counts.values())
+		misses = sum(counts[1] for counts in self.counts.values())
+		return {
+			'hits': hits,
+			'misses': misses,
+			'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+			'entries': {name: {'hits': counts[0], 'misses': counts[1]} for name, counts in self.counts.items()},
+		}
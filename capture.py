@@ -0,0 +1,269 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from ingest import RingBuffer
+from decoder import string_field
+
+# raw feed capture format
+#
+# every frame the websocket receives is stored with its receive time in an
+# append-only, chunked, zlib compressed log:
+#
+#   <name>.mmvcap   FILE_MAGIC, then chunks back to back
+#     chunk = CHUNK_HEADER (magic, frame count, raw bytes, compressed bytes, first ns, last ns)
+#             + zlib(records)
+#     record = RECORD_HEADER (recv time ns, frame bytes) + utf-8 frame
+#   <name>.idx      one INDEX_ENTRY (recv time ns, chunk offset) per chunk that starts with a snapshot
+#
+# a snapshot always starts a fresh chunk, so seeking is: find the index entry, jump to
+# the offset, decompress one chunk. a torn chunk at the end (crash) is just ignored on read.
+
+FILE_MAGIC = b'MMVCAP1\n'
+CHUNK_MAGIC = b'CHNK'
+CHUNK_HEADER = struct.Struct('<4sIIIqq')
+RECORD_HEADER = struct.Struct('<qI')
+INDEX_ENTRY = struct.Struct('<qQ')
+CAPTURE_SUFFIX = '.mmvcap'
+INDEX_SUFFIX = '.idx'
+
+def is_snapshot(frame):
+	return frame.startswith('{"type":"snapshot"') or '"type":"snapshot"' in frame[:64]
+
+# writes one capture file (+ index), no threading here
+class CaptureWriter:
+	def __init__(self, path, chunk_bytes=1 << 20, compress_level=1):
+		self.path = path
+		self.chunk_bytes = chunk_bytes
+		self.compress_level = compress_level
+		self.file = open(path, 'wb')
+		self.index = open(path[:-len(CAPTURE_SUFFIX)] + INDEX_SUFFIX, 'wb')
+		self.file.write(FILE_MAGIC)
+		self.offset = len(FILE_MAGIC)
+		self.created = time.time()
+
+		# chunk being built
+		self.buffer = bytearray()
+		self.count = 0
+		self.first_ns = 0
+		self.last_ns = 0
+		self.chunk_started = 0.0
+		self.chunk_is_snapshot = False
+
+	def write(self, frame, recv_ns):
+		snapshot = is_snapshot(frame)
+		# snapshots open their own chunk so the index can point straight at them
+		if snapshot and self.count:
+			self.flush()
+		if not self.count:
+			self.first_ns = recv_ns
+			self.chunk_started = time.time()
+			self.chunk_is_snapshot = snapshot
+		data = frame.encode('utf-8') if isinstance(frame, str) else frame
+		self.buffer += RECORD_HEADER.pack(recv_ns, len(data))
+		self.buffer += data
+		self.count += 1
+		self.last_ns = recv_ns
+		if len(self.buffer) >= self.chunk_bytes:
+			self.flush()
+
+	# compress and append the current chunk
+	# plain write, no fsync, the os gets it to disk when it wants
+	def flush(self):
+		if not self.count:
+			return
+		payload = zlib.compress(bytes(self.buffer), self.compress_level)
+		if self.chunk_is_snapshot:
+			self.index.write(INDEX_ENTRY.pack(self.first_ns, self.offset))
+			self.index.flush()
+		self.file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self.count, len(self.buffer), len(payload), self.first_ns, self.last_ns))
+		self.file.write(payload)
+		self.file.flush()
+		self.offset += CHUNK_HEADER.size + len(payload)
+		self.buffer = bytearray()
+		self.count = 0
+
+	def close(self):
+		self.flush()
+		self.file.close()
+		self.index.close()
+
+# records every frame CoinbaseWebSocket receives, off the receive thread
+# register `push` as a frame listener; frames go into a bounded ring and a writer
+# thread compresses them to disk, so memory stays flat however long it runs.
+# files rotate by size and age: <directory>/<prefix>-YYYYmmdd-HHMMSS-micros.mmvcap
+class FeedRecorder:
+	def __init__(self, directory, prefix="capture", max_file_bytes=256 << 20, max_file_seconds=3600,
+			chunk_bytes=1 << 20, chunk_seconds=2.0, capacity=65536):
+		self.directory = directory
+		self.prefix = prefix
+		self.max_file_bytes = max_file_bytes
+		self.max_file_seconds = max_file_seconds
+		self.chunk_bytes = chunk_bytes
+		self.chunk_seconds = chunk_seconds
+		self.ring = RingBuffer(capacity)
+		self.writer = None
+		self.running = False
+		self.thread = None
+
+		# stats
+		self.frames = 0
+		self.files = 0
+
+	# frame listener, runs on the receive thread, just enqueues
+	def push(self, frame, recv_time):
+		self.ring.push((int(recv_time * 1e9), frame))
+
+	def start(self):
+		os.makedirs(self.directory, exist_ok=True)
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name='recorder')
+		self.thread.daemon = True
+		self.thread.start()
+		print(f"+ Recording feed to {self.directory} +")
+
+	def stop(self):
+		self.running = False
+		self.ring.ready.set()
+		if self.thread:
+			self.thread.join(timeout=5)
+		print("- Recorder stopped -")
+
+	def open_file(self):
+		# microseconds keep names unique across fast rotations and sort in time order
+		stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+		path = os.path.join(self.directory, f"{self.prefix}-{stamp}{CAPTURE_SUFFIX}")
+		self.writer = CaptureWriter(path, self.chunk_bytes)
+		self.files += 1
+
+	def rotate_if_needed(self):
+		if self.writer is None:
+			self.open_file()
+			return
+		if self.writer.offset >= self.max_file_bytes or time.time() - self.writer.created >= self.max_file_seconds:
+			self.writer.close()
+			self.open_file()
+
+	def run(self):
+		while self.running or len(self.ring):
+			self.ring.wait(timeout=0.5)
+			for recv_ns, frame in self.ring.pop_batch(4096):
+				self.rotate_if_needed()
+				self.writer.write(frame, recv_ns)
+				self.frames += 1
+			# don't sit on a half built chunk forever when the feed is quiet
+			if self.writer and self.writer.count and time.time() - self.writer.chunk_started >= self.chunk_seconds:
+				self.writer.flush()
+				self.rotate_if_needed()
+		if self.writer:
+			self.writer.close()
+
+	def stats(self):
+		return {
+			'frames': self.frames,
+			'files': self.files,
+			'queue_depth': len(self.ring),
+			'dropped': self.ring.dropped,
+			'file': self.writer.path if self.writer else None,
+			'file_bytes': self.writer.offset if self.writer else 0,
+		}
+
+##################
+# Reading
+##################
+
+# capture files in a directory (or a single file), oldest first
+def capture_files(path):
+	if os.path.isfile(path):
+		return [path]
+	names = sorted(name for name in os.listdir(path) if name.endswith(CAPTURE_SUFFIX))
+	return [os.path.join(path, name) for name in names]
+
+# (recv ns, chunk offset) for every chunk that starts with a snapshot
+def read_index(path):
+	entries = []
+	index_path = path[:-len(CAPTURE_SUFFIX)] + INDEX_SUFFIX
+	if not os.path.exists(index_path):
+		return entries
+	with open(index_path, 'rb') as f:
+		data = f.read()
+	usable = len(data) - len(data) % INDEX_ENTRY.size
+	for start in range(0, usable, INDEX_ENTRY.size):
+		entries.append(INDEX_ENTRY.unpack_from(data, start))
+	return entries
+
+# product id of the snapshot a chunk from read_index starts with (None if it has none)
+# only the first few hundred bytes are inflated, not the whole snapshot
+def snapshot_product(path, offset):
+	with open(path, 'rb') as f:
+		f.seek(offset)
+		header = f.read(CHUNK_HEADER.size)
+		if len(header) < CHUNK_HEADER.size:
+			return None
+		magic, count, raw_len, comp_len, first_ns, last_ns = CHUNK_HEADER.unpack(header)
+		if magic != CHUNK_MAGIC:
+			return None
+		payload = f.read(min(comp_len, 4096))
+	data = zlib.decompressobj().decompress(payload, RECORD_HEADER.size + 512)
+	return string_field(data[RECORD_HEADER.size:].decode('utf-8', 'ignore'), '"product_id":"')
+
+# yields (offset, first ns, last ns, records) per chunk starting at `offset`
+# records is a list of (recv ns, frame str); stops quietly at a torn tail
+def iter_chunks(path, offset=None):
+	with open(path, 'rb') as f:
+		if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+			raise ValueError(f"{path} is not a capture file")
+		if offset is not None:
+			f.seek(offset)
+		while True:
+			chunk_offset = f.tell()
+			header = f.read(CHUNK_HEADER.size)
+			if len(header) < CHUNK_HEADER.size:
+				return
+			magic, count, raw_len, comp_len, first_ns, last_ns = CHUNK_HEADER.unpack(header)
+			if magic != CHUNK_MAGIC:
+				return
+			payload = f.read(comp_len)
+			if len(payload) < comp_len:
+				return
+			yield chunk_offset, first_ns, last_ns, decode_records(zlib.decompress(payload), count)
+
+def decode_records(data, count):
+	records = []
+	position = 0
+	for _ in range(count):
+		recv_ns, length = RECORD_HEADER.unpack_from(data, position)
+		position += RECORD_HEADER.size
+		records.append((recv_ns, data[position:position + length].decode('utf-8')))
+		position += length
+	return records
+
+# every (recv ns, frame) in a file or directory, in order
+def iter_frames(path):
+	for file_path in capture_files(path):
+		for offset, first_ns, last_ns, records in iter_chunks(file_path):
+			yield from records
+
+# record the live feed standalone
+if __name__ == "__main__":
+	import argparse
+	from websocket_client import CoinbaseWebSocket
+	parser = argparse.ArgumentParser(description="record the raw coinbase feed")
+	parser.add_argument('directory')
+	parser.add_argument('--seconds', type=float, default=60)
+	args = parser.parse_args()
+
+	recorder = FeedRecorder(args.directory)
+	recorder.start()
+	client = CoinbaseWebSocket()
+	client.add_frame_listener(recorder.push)
+	client.start()
+	try:
+		time.sleep(args.seconds)
+	except KeyboardInterrupt:
+		print("\n- User Interrupt (keypress) -\n")
+	client.stop()
+	recorder.stop()
+	print(f"+ finished. {recorder.stats()} +")
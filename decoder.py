@@ -0,0 +1,211 @@
+import json
+import re
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+from order_book import PRICE_DECIMALS, SIZE_DECIMALS
+
+# schema specific decoder for coinbase level2 frames
+# snapshot and l2update go straight from the raw frame to typed arrays
+# (sides, price ticks, size lots) without building the generic dict / list-of-lists first.
+# anything else falls back to json.loads.
+
+# a run of consecutive l2update frames decoded together
+# product_ids / times / counts / sequences have one entry per frame (counts = number of changes
+# in it, sequences None when the feed doesn't number its messages),
+# sides / prices / sizes are flat numpy arrays over the whole run (sides 1 = bid, 0 = ask)
+L2Updates = namedtuple('L2Updates', ['product_ids', 'times', 'counts', 'sequences', 'sides', 'prices', 'sizes'])
+L2Snapshot = namedtuple('L2Snapshot', ['product_id', 'sequence', 'bid_prices', 'bid_sizes', 'ask_prices', 'ask_sizes'])
+
+CHANGE_RE = re.compile(r'\["(buy|sell)","([0-9.]+)","([0-9.]+)"\]')
+LEVEL_RE = re.compile(r'\["([0-9.]+)","([0-9.]+)"\]')
+
+# value of a top level string field, e.g. "product_id":"BTC-USD"
+def string_field(frame, key):
+	start = frame.find(key)
+	if start < 0:
+		return None
+	start += len(key)
+	return frame[start:frame.find('"', start)]
+
+# value of a top level integer field, e.g. "sequence":123
+def number_field(frame, key):
+	start = frame.find(key)
+	if start < 0:
+		return None
+	start += len(key)
+	end = start
+	while end < len(frame) and frame[end].isdigit():
+		end += 1
+	return int(frame[start:end]) if end > start else None
+
+# coinbase "2025-01-01T00:00:00.123456Z" -> epoch seconds, None if it isn't a time
+def parse_time(text):
+	try:
+		return datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+	except (ValueError, AttributeError):
+		return None
+
+# 10^n for every digit position an int64 can hold
+POW10 = 10 ** np.arange(18, dtype=np.int64)
+
+# tuple of decimal strings -> int64 units of 10^-decimals, the same numbers parse_fixed gives
+# (extra decimals are cut, not rounded). numpy's float parser does most batches: a string of
+# at most 15 characters is the nearest double to its decimal, and while the result stays under
+# 10^15 units, rint(value * scale) is exactly it, and scaling back matches the double only when
+# the string had no digits past `decimals`. anything else takes exact_column.
+def fixed_column(strings, decimals):
+	if not len(strings):
+		return np.zeros(0, dtype=np.int64)
+	scale = 10 ** decimals
+	values = np.array(strings, dtype=np.float64)
+	units = np.rint(values * scale)
+	if max(map(len, strings)) <= 15 and np.abs(units).max() < 1e15 and np.array_equal(units / scale, values):
+		return units.astype(np.int64)
+	return exact_column(strings, decimals)
+
+# fixed_column digit by digit over the strings as a byte matrix, no float anywhere
+# raises ValueError on anything that isn't plain digits with at most one dot, or won't fit an int64
+def exact_column(strings, decimals):
+	chars = np.array(strings, dtype=np.bytes_)
+	chars = chars.view(np.uint8).reshape(len(chars), -1)
+	is_digit = (chars >= 48) & (chars <= 57)
+	is_dot = chars == 46
+	dots = is_dot.sum(axis=1)
+	lengths = (chars != 0).sum(axis=1)
+	if (is_digit.sum(axis=1) + dots != lengths).any() or (dots > 1).any() or not lengths.all():
+		raise ValueError(f"not a decimal number in {strings!r:.200}")
+	dot = np.where(dots, is_dot.argmax(axis=1), lengths)[:, None]
+	# power of ten each character is worth in 10^-decimals units, negative past the precision we keep
+	columns = np.arange(chars.shape[1])
+	exponent = np.where(columns < dot, dot - 1 - columns + decimals, decimals - (columns - dot))
+	keep = is_digit & (exponent >= 0)
+	if (exponent[keep] >= len(POW10)).any():
+		raise ValueError(f"too many digits for int64 in {strings!r:.200}")
+	return np.where(keep, (chars - 48) * POW10[np.clip(exponent, 0, len(POW10) - 1)], 0).sum(axis=1)
+
+class Level2Decoder:
+	def __init__(self, price_decimals=PRICE_DECIMALS, size_decimals=SIZE_DECIMALS):
+		self.price_decimals = price_decimals
+		self.size_decimals = size_decimals
+
+		# how many frames took each path
+		self.fast = 0
+		self.fallback = 0
+
+	# raw frames -> list of (msg_type, payload) in order
+	# consecutive l2update frames collapse into one L2Updates so the regex and
+	# number parsing run once per run of frames instead of once per frame
+	def decode_batch(self, frames):
+		decoded = []
+		run = []
+		for frame in frames:
+			# coinbase always leads with the type, anything unusual goes through decode()
+			if frame.startswith('{"type":"l2update"'):
+				run.append(frame)
+				continue
+			if run:
+				decoded.append(("l2update", self.decode_updates(run)))
+				run = []
+			decoded.append(self.decode(frame))
+		if run:
+			decoded.append(("l2update", self.decode_updates(run)))
+		return decoded
+
+	# single raw frame -> (msg_type, payload)
+	# payload is L2Updates / L2Snapshot for book data, the json.loads dict otherwise
+	# raises ValueError (json.JSONDecodeError or a bad number) on garbage
+	def decode(self, frame):
+		if frame.startswith('{"type":"l2update"'):
+			return "l2update", self.decode_updates([frame])
+		if frame.startswith('{"type":"snapshot"'):
+			payload = self.decode_snapshot(frame)
+			if payload is not None:
+				self.fast += 1
+				return "snapshot", payload
+
+		# not book data, or didn't look like the compact schema we expect
+		self.fallback += 1
+		data = json.loads(frame)
+		msg_type = data.get("type")
+		if msg_type == "l2update":
+			return msg_type, self.updates_from_dicts([data])
+		if msg_type == "snapshot":
+			return msg_type, self.snapshot_from_dict(data)
+		return msg_type, data
+
+	def decode_updates(self, frames):
+		found = CHANGE_RE.findall('\n'.join(frames))
+		# every change starts with [" so if the counts differ the pattern skipped one
+		# (extra whitespace, odd side...) and we let json handle the run
+		counts = [frame.count('["') for frame in frames]
+		if len(found) != sum(counts):
+			self.fallback += len(frames)
+			return self.updates_from_dicts([json.loads(frame) for frame in frames])
+		self.fast += len(frames)
+		sides, prices, sizes = zip(*found) if found else ((), (), ())
+		return L2Updates(
+			[string_field(frame, '"product_id":"') for frame in frames],
+			[string_field(frame, '"time":"') for frame in frames],
+			counts,
+			[number_field(frame, '"sequence":') for frame in frames],
+			np.fromiter(map("buy".__eq__, sides), dtype=np.int8, count=len(sides)),
+			fixed_column(prices, self.price_decimals),
+			fixed_column(sizes, self.size_decimals),
+		)
+
+	def decode_snapshot(self, frame):
+		bids_at = frame.find('"bids":[')
+		asks_at = frame.find('"asks":[')
+		if bids_at < 0 or asks_at < 0:
+			return None
+		# each side runs until the other key (or the end of the frame)
+		bids_end = asks_at if asks_at > bids_at else len(frame)
+		asks_end = bids_at if bids_at > asks_at else len(frame)
+		bid_levels = LEVEL_RE.findall(frame, bids_at, bids_end)
+		ask_levels = LEVEL_RE.findall(frame, asks_at, asks_end)
+		if len(bid_levels) + len(ask_levels) != frame.count('["'):
+			return None
+		bid_prices, bid_sizes = zip(*bid_levels) if bid_levels else ((), ())
+		ask_prices, ask_sizes = zip(*ask_levels) if ask_levels else ((), ())
+		return L2Snapshot(
+			string_field(frame, '"product_id":"'),
+			number_field(frame, '"sequence":'),
+			fixed_column(bid_prices, self.price_decimals),
+			fixed_column(bid_sizes, self.size_decimals),
+			fixed_column(ask_prices, self.price_decimals),
+			fixed_column(ask_sizes, self.size_decimals),
+		)
+
+	# slow path conversions from already decoded dicts
+	def updates_from_dicts(self, messages):
+		changes = []
+		counts = []
+		for data in messages:
+			frame_changes = [change for change in data.get('changes', []) if change[0] == "buy" or change[0] == "sell"]
+			changes.extend(frame_changes)
+			counts.append(len(frame_changes))
+		sides, prices, sizes = zip(*changes) if changes else ((), (), ())
+		return L2Updates(
+			[data.get('product_id') for data in messages],
+			[data.get('time') for data in messages],
+			counts,
+			[data.get('sequence') for data in messages],
+			np.fromiter(map("buy".__eq__, sides), dtype=np.int8, count=len(sides)),
+			fixed_column(prices, self.price_decimals),
+			fixed_column(sizes, self.size_decimals),
+		)
+
+	def snapshot_from_dict(self, data):
+		bids = data.get('bids', [])
+		asks = data.get('asks', [])
+		bid_prices, bid_sizes = zip(*bids) if bids else ((), ())
+		ask_prices, ask_sizes = zip(*asks) if asks else ((), ())
+		return L2Snapshot(
+			data.get('product_id'),
+			data.get('sequence'),
+			fixed_column(bid_prices, self.price_decimals),
+			fixed_column(bid_sizes, self.size_decimals),
+			fixed_column(ask_prices, self.price_decimals),
+			fixed_column(ask_sizes, self.size_decimals),
+		)
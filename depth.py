@@ -0,0 +1,67 @@
+import numpy as np
+
+# cumulative depth over a wide band of the book
+#
+# the book keeps the size in every BUCKET_TICKS wide price bucket up to date as changes land
+# (OrderBook.bid_buckets / ask_buckets), bucket_band copies the ones near the mid and this adds
+# them up into the chart's buckets and accumulates them outward from the mid.
+#
+# chart buckets are either a multiple of the book's bucket ('price', lined up on round prices)
+# or basis points of the mid ('bps', measured from the mid). a book bucket goes whole into the
+# chart bucket its middle falls in, so bps buckets are only as sharp as the book's buckets.
+
+# (value, kind, size) of the bucket choices on the chart
+BUCKET_CHOICES = (
+	('x1', 'price', 1),
+	('x10', 'price', 10),
+	('x100', 'price', 100),
+	('1bp', 'bps', 1),
+	('5bp', 'bps', 5),
+	('10bp', 'bps', 10),
+)
+DEFAULT_BUCKET = 'x10'
+
+def bucket_choice(value):
+	for choice in BUCKET_CHOICES:
+		if choice[0] == value:
+			return choice
+	return bucket_choice(DEFAULT_BUCKET)
+
+# dropdown label of a choice on a book quoted to `price_decimals`, e.g. "$10 buckets" or "5 bps"
+def bucket_label(value, bucket_ticks, price_decimals):
+	value, kind, size = bucket_choice(value)
+	if kind == 'bps':
+		return f"{size} bp" if size == 1 else f"{size} bps"
+	width = size * bucket_ticks / 10 ** price_decimals
+	return f"${width:,.{max(0, -int(np.floor(np.log10(width))))}f} buckets"
+
+# sums of `lots` over runs of equal `bins` (bins are monotonic, nearest the mid first)
+def add_up(bins, lots):
+	if not len(bins):
+		return bins, lots
+	starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+	return bins[starts], np.add.reduceat(lots, starts)
+
+# one side's book buckets -> (far edge price of each chart bucket in ticks, cumulative lots), nearest first
+def side_depth(keys, lots, bucket_ticks, mid_price, kind, size, is_bid):
+	if not len(keys):
+		return np.zeros(0), np.zeros(0, dtype=np.int64)
+	if kind == 'bps':
+		width = mid_price * size / 10000
+		middles = (keys + 0.5) * bucket_ticks
+		distance = mid_price - middles if is_bid else middles - mid_price
+		bins, totals = add_up(np.maximum(distance // width, 0).astype(np.int64), lots)
+		edges = mid_price - (bins + 1) * width if is_bid else mid_price + (bins + 1) * width
+	else:
+		bins, totals = add_up(keys // size, lots)
+		width = size * bucket_ticks
+		edges = bins * width if is_bid else (bins + 1) * width
+	return edges.astype(np.float64), np.cumsum(totals)
+
+# band from OrderBook.bucket_band -> (bid edges, bid cumulative, ask edges, ask cumulative), ticks / lots
+def cumulative_depth(band, bucket_ticks, mid_price, choice=DEFAULT_BUCKET):
+	value, kind, size = bucket_choice(choice)
+	bid_keys, bid_lots, ask_keys, ask_lots = band
+	bid_edges, bid_depth = side_depth(bid_keys, bid_lots, bucket_ticks, mid_price, kind, size, True)
+	ask_edges, ask_depth = side_depth(ask_keys, ask_lots, bucket_ticks, mid_price, kind, size, False)
+	return bid_edges, bid_depth, ask_edges, ask_depth
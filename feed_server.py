@@ -0,0 +1,319 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import websockets
+
+# local stand-in for wss://ws-feed.exchange.coinbase.com
+# speaks the same subscribe -> subscriptions -> snapshot -> l2update protocol with a
+# synthetic book, so the ingest path can be pushed hard in CI without network access.
+# channels: level2 (every update as it happens, numbered), level2_batch (updates coalesced
+# into one frame per product every 50ms, unnumbered, like coinbase) and heartbeat.
+# the book is kept --levels ticks deep either side of a random walk mid, so every mid move costs
+# updates of its own on top of --changes; --volatility 0 holds the mid still for an exact load:
+#   python feed_server.py --rate 5000 --changes 5 --volatility 0      (25k updates/sec)
+#   MMV_FEED_URL=ws://localhost:8765 python app.py
+
+# iso timestamp like coinbase sends, "2025-01-01T00:00:00.123456Z"
+def iso_time(now):
+	return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + f'.{int(now % 1 * 1e6):06d}Z'
+
+# one product's synthetic book: random walk mid, levels that come and go near the top
+class SyntheticBook:
+	def __init__(self, product_id, mid=67000.0, levels=1000, tick=0.01, volatility=0.0001, seed=None):
+		self.product_id = product_id
+		self.tick = tick
+		self.decimals = max(0, -math.floor(math.log10(tick)))
+		self.levels = levels
+		# fraction of price the mid moves per sqrt(second)
+		self.volatility = volatility
+		self.rng = random.Random(seed)
+		self.mid = round(mid / tick)
+		# bumped per update frame, snapshots carry the sequence they're current as of
+		self.sequence = 0
+		# price ticks -> size, both sides
+		self.bids = {}
+		self.asks = {}
+		for i in range(levels):
+			self.bids[self.mid - 1 - i] = self.random_size()
+			self.asks[self.mid + 1 + i] = self.random_size()
+
+	def random_size(self):
+		return round(self.rng.expovariate(2.0) + 0.0001, 8)
+
+	def price_text(self, ticks):
+		return f"{ticks * self.tick:.{self.decimals}f}"
+
+	def snapshot_frame(self):
+		bids = sorted(self.bids.items(), reverse=True)
+		asks = sorted(self.asks.items())
+		return json.dumps({
+			"type": "snapshot",
+			"product_id": self.product_id,
+			"sequence": self.sequence,
+			"asks": [[self.price_text(price), f"{size:.8f}"] for price, size in asks],
+			"bids": [[self.price_text(price), f"{size:.8f}"] for price, size in bids],
+		}, separators=(',', ':'))
+
+	# move the mid, then return `count` changes as (side, price ticks, size) with 0 = delete
+	def step(self, count, elapsed):
+		move = int(round(self.rng.gauss(0, self.volatility * math.sqrt(max(elapsed, 1e-6))) * self.mid))
+		changes = self.recentre(self.mid + move) if move else []
+		rng = self.rng
+		for _ in range(count):
+			is_bid = rng.random() < 0.5
+			book = self.bids if is_bid else self.asks
+			# most activity sits near the top of the book, a thin side refills further out
+			if len(book) < self.levels and rng.random() < 0.2:
+				distance = rng.randint(1, self.levels)
+			else:
+				distance = min(1 + int(rng.expovariate(1 / max(self.levels / 20, 1))), self.levels)
+			price = self.mid - distance if is_bid else self.mid + distance
+			if price in book and (len(book) > self.levels or rng.random() < 0.4):
+				del book[price]
+				size = 0
+			else:
+				size = self.random_size()
+				book[price] = size
+			changes.append(("buy" if is_bid else "sell", price, size))
+		return changes
+
+	# keep the book on `levels` ticks either side of a new mid, returns the changes that takes:
+	# anything the mid walks through gets pulled so the book never crosses, the side it moved
+	# into gets levels up to the new mid, the side it moved towards gets levels out to the new
+	# edge, and whatever ended up too far out behind it is dropped
+	def recentre(self, mid):
+		changes = []
+		old, self.mid = self.mid, mid
+		levels = self.levels
+		if mid > old:
+			for price in range(old, mid + 1):
+				if self.asks.pop(price, None) is not None:
+					changes.append(("sell", price, 0))
+			for price in range(old - levels, min(old, mid - levels)):
+				if self.bids.pop(price, None) is not None:
+					changes.append(("buy", price, 0))
+			changes.extend(self.fill("buy", self.bids, max(old, mid - levels), mid))
+			changes.extend(self.fill("sell", self.asks, max(old + levels, mid) + 1, mid + levels + 1))
+		else:
+			for price in range(mid, old + 1):
+				if self.bids.pop(price, None) is not None:
+					changes.append(("buy", price, 0))
+			for price in range(max(old, mid + levels) + 1, old + levels + 1):
+				if self.asks.pop(price, None) is not None:
+					changes.append(("sell", price, 0))
+			changes.extend(self.fill("sell", self.asks, mid + 1, min(old, mid + levels) + 1))
+			changes.extend(self.fill("buy", self.bids, mid - levels, min(old - levels, mid)))
+		return changes
+
+	# a fresh level on every tick in [start, stop)
+	def fill(self, side, book, start, stop):
+		changes = []
+		for price in range(start, stop):
+			book[price] = size = self.random_size()
+			changes.append((side, price, size))
+		return changes
+
+	def update_frame(self, changes, now, sequence=None):
+		body = ','.join(f'["{side}","{self.price_text(price)}","{size:.8f}"]' for side, price, size in changes)
+		numbered = f'"sequence":{sequence},' if sequence is not None else ''
+		return (f'{{"type":"l2update","product_id":"{self.product_id}",{numbered}'
+			f'"changes":[{body}],"time":"{iso_time(now)}"}}')
+
+	def heartbeat_frame(self, now):
+		return json.dumps({
+			"type": "heartbeat",
+			"sequence": self.sequence,
+			"last_trade_id": 0,
+			"product_id": self.product_id,
+			"time": iso_time(now),
+		}, separators=(',', ':'))
+
+CHANNELS = ("level2", "level2_batch", "heartbeat")
+BATCH_SECONDS = 0.05
+
+class FeedServer:
+	def __init__(self, products, rate=100, changes=5, levels=1000, volatility=0.0001,
+			burst_factor=1.0, burst_chance=0.0, burst_seconds=1.0, drop_chance=0.0, disconnect_every=0.0, seed=None):
+		self.books = {
+			product_id: SyntheticBook(product_id, levels=levels, volatility=volatility,
+				seed=None if seed is None else seed + index)
+			for index, product_id in enumerate(products)
+		}
+		# l2update messages per second per product, changes per message
+		self.rate = rate
+		self.changes = changes
+		# bursts: each second there's burst_chance of the rate jumping by burst_factor for burst_seconds
+		self.burst_factor = burst_factor
+		self.burst_chance = burst_chance
+		self.burst_seconds = burst_seconds
+		self.burst_until = 0.0
+		self.rng = random.Random(seed)
+		# faults for exercising the client's recovery: frames that never go out (a sequence gap)
+		# and every connection dropped every disconnect_every seconds
+		self.drop_chance = drop_chance
+		self.disconnect_every = disconnect_every
+		self.dropped = 0
+		# product_id -> channel -> connected subscribers
+		self.subscribers = {product_id: {channel: set() for channel in CHANNELS} for product_id in products}
+		# level2_batch changes waiting for the next batch window, per product
+		self.batched = {product_id: [] for product_id in products}
+		self.sent = 0
+		self.changes_sent = 0
+
+	async def handler(self, websocket):
+		try:
+			async for message in websocket:
+				request = json.loads(message)
+				wanted = [product_id for product_id in request.get("product_ids", []) if product_id in self.books]
+				channels = [channel for channel in request.get("channels", ["level2_batch"]) if channel in CHANNELS]
+				if request.get("type") == "subscribe":
+					await websocket.send(json.dumps({
+						"type": "subscriptions",
+						"channels": [{"name": channel, "product_ids": wanted} for channel in channels],
+					}))
+					# snapshot and subscribe with no await in between, or updates stepped while the
+					# snapshot goes out are lost (a gap on level2, uncollected changes on level2_batch).
+					# send writes the frame before it can yield, so it still goes out ahead of them
+					for product_id in wanted:
+						snapshot = None
+						if "level2" in channels or "level2_batch" in channels:
+							snapshot = self.books[product_id].snapshot_frame()
+						for channel in channels:
+							self.subscribers[product_id][channel].add(websocket)
+						if snapshot is not None:
+							await websocket.send(snapshot)
+				elif request.get("type") == "unsubscribe":
+					for product_id in wanted:
+						for channel in channels:
+							self.subscribers[product_id][channel].discard(websocket)
+		finally:
+			for channels in self.subscribers.values():
+				for subscribers in channels.values():
+					subscribers.discard(websocket)
+
+	def current_rate(self, now):
+		if now < self.burst_until:
+			return self.rate * self.burst_factor
+		return self.rate
+
+	# generate and broadcast updates on a short tick, carrying fractional messages over
+	async def generate(self, tick=0.005):
+		last = time.perf_counter()
+		owed = 0.0
+		next_burst_roll = last + 1
+		while True:
+			await asyncio.sleep(tick)
+			now = time.perf_counter()
+			elapsed = now - last
+			last = now
+			if self.burst_chance and now >= next_burst_roll:
+				next_burst_roll = now + 1
+				if self.rng.random() < self.burst_chance:
+					self.burst_until = now + self.burst_seconds
+			owed += self.current_rate(now) * elapsed
+			messages = int(owed)
+			owed -= messages
+			if not messages:
+				continue
+			wall = time.time()
+			for product_id, book in self.books.items():
+				subscribers = self.subscribers[product_id]["level2"]
+				batching = bool(self.subscribers[product_id]["level2_batch"])
+				for _ in range(messages):
+					changes = book.step(self.changes, elapsed / messages)
+					book.sequence += 1
+					if batching:
+						self.batched[product_id].extend(changes)
+					if not subscribers:
+						continue
+					# drops only hit the numbered channel, where the client can notice them
+					if self.drop_chance and self.rng.random() < self.drop_chance:
+						self.dropped += 1
+						continue
+					websockets.broadcast(subscribers, book.update_frame(changes, wall, book.sequence))
+					self.sent += 1
+					self.changes_sent += len(changes)
+
+	# level2_batch: whatever changed in the last window goes out as one frame per product
+	async def flush_batches(self):
+		while True:
+			await asyncio.sleep(BATCH_SECONDS)
+			wall = time.time()
+			for product_id, book in self.books.items():
+				changes = self.batched[product_id]
+				subscribers = self.subscribers[product_id]["level2_batch"]
+				if not changes or not subscribers:
+					changes.clear()
+					continue
+				# only the last change to a level matters within a window
+				latest = {(side, price): size for side, price, size in changes}
+				changes.clear()
+				websockets.broadcast(subscribers, book.update_frame([(side, price, size) for (side, price), size in latest.items()], wall))
+				self.sent += 1
+				self.changes_sent += len(latest)
+
+	async def heartbeats(self):
+		while True:
+			await asyncio.sleep(1)
+			wall = time.time()
+			for product_id, book in self.books.items():
+				subscribers = self.subscribers[product_id]["heartbeat"]
+				if subscribers:
+					websockets.broadcast(subscribers, book.heartbeat_frame(wall))
+
+	async def disconnect(self):
+		while True:
+			await asyncio.sleep(self.disconnect_every)
+			clients = self.clients()
+			for websocket in clients:
+				await websocket.close(code=1012, reason="synthetic disconnect")
+			print(f"- Dropped {len(clients)} clients -")
+
+	async def report(self, every=5.0):
+		last_sent = last_changes = 0
+		while True:
+			await asyncio.sleep(every)
+			rate = (self.sent - last_sent) / every
+			changes = (self.changes_sent - last_changes) / every
+			last_sent, last_changes = self.sent, self.changes_sent
+			print(f"+ {len(self.clients())} clients, {rate:,.0f} msgs/s, {changes:,.0f} updates/s +")
+
+	def clients(self):
+		return set().union(*(subscribers for channels in self.subscribers.values() for subscribers in channels.values()))
+
+	async def serve(self, host, port):
+		async with websockets.serve(self.handler, host, port, max_size=None):
+			print(f"+ Synthetic feed on ws://{host}:{port} ({', '.join(self.books)}) +")
+			tasks = [self.generate(), self.flush_batches(), self.heartbeats(), self.report()]
+			if self.disconnect_every:
+				tasks.append(self.disconnect())
+			await asyncio.gather(*tasks)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="synthetic coinbase level2 feed")
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('--products', default='BTC-USD', help="comma separated product ids")
+	parser.add_argument('--levels', type=int, default=1000, help="price levels per side")
+	parser.add_argument('--rate', type=float, default=100, help="l2update messages per second per product (level2 channel)")
+	parser.add_argument('--changes', type=int, default=5, help="changes per message")
+	parser.add_argument('--volatility', type=float, default=0.0001, help="mid move per sqrt(second), fraction of price")
+	parser.add_argument('--burst-factor', type=float, default=1.0, help="rate multiplier during bursts")
+	parser.add_argument('--burst-chance', type=float, default=0.0, help="chance per second a burst starts")
+	parser.add_argument('--burst-seconds', type=float, default=1.0)
+	parser.add_argument('--drop-chance', type=float, default=0.0, help="chance each level2 frame is skipped (sequence gap)")
+	parser.add_argument('--disconnect-every', type=float, default=0.0, help="drop every connection this often, seconds")
+	parser.add_argument('--seed', type=int)
+	args = parser.parse_args()
+
+	server = FeedServer(args.products.split(','), rate=args.rate, changes=args.changes, levels=args.levels,
+		volatility=args.volatility, burst_factor=args.burst_factor, burst_chance=args.burst_chance,
+		burst_seconds=args.burst_seconds, drop_chance=args.drop_chance, disconnect_every=args.disconnect_every,
+		seed=args.seed)
+	try:
+		asyncio.run(server.serve(args.host, args.port))
+	except KeyboardInterrupt:
+		print("\n- User Interrupt (keypress) -\n")
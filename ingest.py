@@ -0,0 +1,322 @@
+import threading
+import time
+from decoder import Level2Decoder, string_field, parse_time
+
+# staged ingest between the websocket thread and the order book
+# receive thread -> RingBuffer -> applier thread -> OrderBook
+# the receive thread only enqueues raw frames so a slow book never back-pressures the socket
+
+# fixed size ring of slots, one producer (receive thread) and one consumer (applier)
+# each index is only ever moved by one side so no lock is needed around push/pop
+class RingBuffer:
+	def __init__(self, capacity=65536):
+		self.capacity = capacity
+		self.slots = [None] * capacity
+		self.head = 0 # next slot to read, consumer only
+		self.tail = 0 # next slot to write, producer only
+		self.ready = threading.Event()
+		# set by the consumer when it frees slots, for push_wait
+		self.space = threading.Event()
+
+		# overflow stats
+		self.dropped = 0
+		self.high_water = 0
+
+	def __len__(self):
+		return self.tail - self.head
+
+	# producer side, never blocks
+	# when full the new item is dropped and counted
+	def push(self, item):
+		depth = self.tail - self.head
+		if depth >= self.capacity:
+			self.dropped += 1
+			return False
+		self.slots[self.tail % self.capacity] = item
+		self.tail += 1
+		if depth + 1 > self.high_water:
+			self.high_water = depth + 1
+		self.ready.set()
+		return True
+
+	# consumer side, takes up to max_items in order
+	def pop_batch(self, max_items):
+		count = min(self.tail - self.head, max_items)
+		items = []
+		for i in range(count):
+			index = (self.head + i) % self.capacity
+			items.append(self.slots[index])
+			self.slots[index] = None
+		self.head += count
+		if count:
+			self.space.set()
+		return items
+
+	# consumer side, sleep until something is pushed (or timeout)
+	def wait(self, timeout=None):
+		if self.tail != self.head:
+			return True
+		self.ready.clear()
+		# re-check after clearing so a push in between isn't missed
+		if self.tail != self.head:
+			return True
+		return self.ready.wait(timeout)
+
+	# producer side, sleep until there's a free slot (or timeout)
+	def wait_space(self, timeout=None):
+		if self.tail - self.head < self.capacity:
+			return True
+		self.space.clear()
+		# re-check after clearing so a pop in between isn't missed
+		if self.tail - self.head < self.capacity:
+			return True
+		return self.space.wait(timeout)
+
+# drains the ring in batches and applies them to the book
+# l2update changes to the same (side, price) are coalesced so each batch takes the lock once
+# anything that isn't book data goes to on_message like the old direct callback
+# orderbook is one book for everything, or {product_id: book} to split frames by product (see products.py)
+# sync (book_sync.BookSync) vets sequences and crossed books per product when given
+# latency (latency.LatencyRecorder) gets the receive / decode / apply stage times per product
+class IngestPipeline:
+	def __init__(self, orderbook, on_message=None, capacity=65536, max_batch=1024, sync=None, latency=None):
+		self.books = orderbook if isinstance(orderbook, dict) else None
+		self.orderbook = None if self.books is not None else orderbook
+		self.on_message = on_message
+		self.sync = sync
+		self.latency = latency
+		# False for a feed whose exchange times aren't now's (replay): they're not carried to the
+		# books, so nothing measures latency or staleness from them. see ShardedIngest.attach
+		self.live = True
+		# one decoder per book, they can have different tick sizes
+		self.decoders = {}
+		self.ring = RingBuffer(capacity)
+		self.max_batch = max_batch
+		self.running = False
+		self.thread = None
+
+		# applier stats
+		self.frames = 0
+		self.batches = 0
+		self.changes_received = 0
+		self.changes_applied = 0
+		self.last_batch_size = 0
+		self.max_batch_size = 0
+		self.decode_errors = 0
+		self.reported_drops = 0
+		self.unrouted = 0
+		# product -> [frames, changes applied, book updates, avg latency, last latency]
+		# latency is exchange time -> applied to the book, seconds
+		self.per_product = {}
+		# cpu time of the applier thread
+		self.cpu_seconds = 0.0
+
+	# frame listener for CoinbaseWebSocket, runs on the receive thread
+	# a dropped frame leaves its product's book wrong, so it goes to sync for a fresh snapshot
+	def push(self, frame, recv_time):
+		if not self.ring.push((recv_time, frame)):
+			# only shout once per overflow episode
+			if self.ring.dropped == self.reported_drops + 1:
+				print(f"- Ingest ring full ({self.ring.capacity}), dropping frames -")
+			if self.sync is not None:
+				self.sync.overflow(string_field(frame, '"product_id":"'), string_field(frame, '"type":"') == 'snapshot')
+
+	# frame listener for sources that can slow down (replay), waits for room in the ring instead of dropping
+	# gives up when no applier is running to make room (never started, or stopped)
+	def push_wait(self, frame, recv_time):
+		while not self.ring.wait_space(0.5):
+			if not self.running:
+				break
+		self.push(frame, recv_time)
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name='ingest')
+		self.thread.daemon = True
+		self.thread.start()
+		print("+ Ingest applier started +")
+
+	def stop(self):
+		self.running = False
+		self.ring.ready.set()
+		if self.thread:
+			self.thread.join(timeout=1)
+
+	def run(self):
+		while self.running:
+			if not self.ring.wait(timeout=0.5):
+				continue
+			batch = self.ring.pop_batch(self.max_batch)
+			if batch:
+				self.apply_batch(batch)
+			self.cpu_seconds = time.thread_time()
+			if self.ring.dropped != self.reported_drops and not len(self.ring):
+				print(f"- Ingest caught up, {self.ring.dropped - self.reported_drops} frames dropped -")
+				self.reported_drops = self.ring.dropped
+
+	# the book a product's frames go to, None for products we don't follow
+	def book_for(self, product_id):
+		if self.books is None:
+			return self.orderbook
+		return self.books.get(product_id)
+
+	def decoder_for(self, book):
+		decoder = self.decoders.get(book)
+		if decoder is None:
+			if book is None:
+				decoder = Level2Decoder()
+			else:
+				decoder = Level2Decoder(book.price_decimals, book.size_decimals)
+			self.decoders[book] = decoder
+		return decoder
+
+	# split a batch of raw frames by product and apply each product's run to its book
+	def apply_batch(self, batch):
+		if self.books is None:
+			received, applied, exchange_time = self.apply_frames(None, self.orderbook, [frame for recv_time, frame in batch],
+				batch[-1][0])
+		else:
+			groups = {}
+			# newest receive time per product, frames are in arrival order
+			recv_times = {}
+			for recv_time, frame in batch:
+				product_id = string_field(frame, '"product_id":"')
+				groups.setdefault(product_id, []).append(frame)
+				recv_times[product_id] = recv_time
+			received = applied = 0
+			for product_id, frames in groups.items():
+				orderbook = self.book_for(product_id)
+				product_received, product_applied, exchange_time = self.apply_frames(product_id, orderbook, frames,
+					recv_times[product_id])
+				received += product_received
+				applied += product_applied
+				if orderbook is None:
+					continue
+				counts = self.per_product.get(product_id)
+				if counts is None:
+					counts = self.per_product.setdefault(product_id, [0, 0, 0, None, None])
+				counts[0] += len(frames)
+				counts[1] += product_applied
+				if product_applied:
+					counts[2] += 1
+				# how far behind the exchange the book is, as of the newest update just applied
+				if exchange_time is not None:
+					latency = time.time() - exchange_time
+					counts[3] = latency if counts[3] is None else counts[3] + 0.05 * (latency - counts[3])
+					counts[4] = latency
+
+		self.frames += len(batch)
+		self.batches += 1
+		self.changes_received += received
+		self.changes_applied += applied
+		self.last_batch_size = len(batch)
+		if len(batch) > self.max_batch_size:
+			self.max_batch_size = len(batch)
+
+	# decode raw frames of one product and apply them to `orderbook` (None: not a book we follow)
+	# recv_time is when the newest of them came off the socket
+	# returns (changes received, changes applied, exchange time of the last update applied, unix seconds)
+	def apply_frames(self, product_id, orderbook, frames, recv_time=None):
+		decoder = self.decoder_for(orderbook)
+		sync = self.sync if orderbook is not None and product_id is not None else None
+		# (is_bid, price ticks) -> size lots, last write wins
+		pending = {}
+		received = 0
+		exchange_time = None
+		try:
+			decoded = decoder.decode_batch(frames)
+		except ValueError:
+			# bad json or a number we can't turn into ticks somewhere in the batch,
+			# redo it frame by frame so one bad frame doesn't cost the rest
+			decoded = []
+			for frame in frames:
+				try:
+					decoded.append(decoder.decode(frame))
+				except ValueError:
+					self.decode_errors += 1
+					print(f"- Frame decode failed: {frame}-")
+		decoded_time = time.time()
+		for msg_type, data in decoded:
+			if msg_type in ("l2update", "snapshot") and orderbook is None:
+				self.unrouted += 1
+			elif msg_type == "l2update":
+				sides, prices, sizes = data.sides, data.prices, data.sizes
+				last_frame = len(data.counts) - 1
+				if sync:
+					start, end = sync.updates(product_id, data.sequences)
+					if (start, end) != (0, len(data.counts)):
+						# only the frames in [start, end) are good, cut their changes out of the run
+						first = sum(data.counts[:start])
+						last = first + sum(data.counts[start:end]) if end > start else first
+						sides, prices, sizes = sides[first:last], prices[first:last], sizes[first:last]
+						last_frame = end - 1
+				for is_bid, price, size in zip(sides.tolist(), prices.tolist(), sizes.tolist()):
+					pending[(is_bid, price)] = size
+				received += len(prices)
+				if len(prices):
+					exchange_time = data.times[last_frame]
+			elif msg_type == "snapshot":
+				# a snapshot replaces the whole book, earlier changes in this batch are moot
+				pending.clear()
+				orderbook.load_snapshot(data.bid_prices.tolist(), data.bid_sizes.tolist(), data.ask_prices.tolist(), data.ask_sizes.tolist())
+				if sync:
+					sync.snapshot(product_id, data.sequence)
+			elif self.on_message:
+				self.on_message(msg_type, data)
+
+		exchange_time = parse_time(exchange_time) if exchange_time and self.live else None
+		if pending:
+			sides = []
+			prices = []
+			sizes = []
+			for (is_bid, price), size in pending.items():
+				sides.append(is_bid)
+				prices.append(price)
+				sizes.append(size)
+			orderbook.apply_changes(sides, prices, sizes, exchange_time)
+			snapshot = orderbook.snapshot
+			if sync:
+				sync.check(product_id, snapshot)
+			if self.latency is not None:
+				self.record_latency(product_id, exchange_time, recv_time, decoded_time, snapshot.timestamp)
+		return received, len(pending), exchange_time
+
+	# one sample per product per batch, timed by its newest frame
+	# (the newest frame is nearly always the newest update, a heartbeat after it only shifts receive by a frame)
+	def record_latency(self, product_id, exchange_time, recv_time, decoded_time, applied_time):
+		latency = self.latency
+		if exchange_time is not None and recv_time is not None:
+			latency.record('receive', product_id, recv_time - exchange_time)
+		if recv_time is not None:
+			latency.record('decode', product_id, decoded_time - recv_time)
+		latency.record('apply', product_id, applied_time - decoded_time)
+
+	# product -> (frames, changes applied, book updates), only filled when routing by product
+	def product_counts(self):
+		return {product_id: tuple(counts[:3]) for product_id, counts in list(self.per_product.items())}
+
+	# product -> (average, last) exchange -> book latency in seconds, None before any timed update
+	def product_latency(self):
+		return {product_id: (counts[3], counts[4]) for product_id, counts in list(self.per_product.items())}
+
+	# queue / overflow / batch stats for seeing when we fall behind
+	def stats(self):
+		return {
+			'queue_depth': len(self.ring),
+			'capacity': self.ring.capacity,
+			'high_water': self.ring.high_water,
+			'dropped': self.ring.dropped,
+			'frames': self.frames,
+			'batches': self.batches,
+			'last_batch_size': self.last_batch_size,
+			'max_batch_size': self.max_batch_size,
+			'avg_batch_size': self.frames / self.batches if self.batches else 0,
+			'changes_received': self.changes_received,
+			'changes_applied': self.changes_applied,
+			'decode_errors': self.decode_errors,
+			'decoded_fast': sum(decoder.fast for decoder in list(self.decoders.values())),
+			'decoded_fallback': sum(decoder.fallback for decoder in list(self.decoders.values())),
+			'unrouted': self.unrouted,
+			'cpu_seconds': self.cpu_seconds,
+			'products': sorted(self.books) if self.books is not None else None,
+		}
@@ -0,0 +1,185 @@
+import threading
+import time
+
+# where the time goes between the exchange and the screen
+#
+# every book update is stamped as it moves through the app and the gaps between the stamps
+# go into one histogram per (stage, product). a stage is named after the stamp it ends at:
+#   receive  exchange time -> socket receive (network, plus any clock skew with the exchange)
+#   decode   socket receive -> decoded (includes the wait in the ingest ring)
+#   apply    decoded -> applied to the book and published to readers in this process
+#   publish  applied -> copied to shared memory (MMV_MODE=ingest only)
+#   serve    applied -> sent to a browser (callback response or push message)
+#   total    exchange time -> sent to a browser, i.e. how stale the numbers on screen are
+# each process only sees its own stages, in ingest + web mode scrape both sides.
+#
+# histograms are hdr style: exact up to 2^bits microseconds, then 2^(bits-1) buckets per
+# power of two, so any value is within ~1.6% (bits=7) from a microsecond up to days,
+# in a few thousand fixed counters with no allocation per record.
+
+STAGES = ('receive', 'decode', 'apply', 'publish', 'serve', 'total')
+
+# bucket bounds (seconds) /metrics reports, the full resolution is behind the quantiles
+PROMETHEUS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+class LatencyHistogram:
+	def __init__(self, bits=7, max_bits=40):
+		self.bits = bits
+		self.sub_count = 1 << bits
+		self.half = self.sub_count >> 1
+		# largest value kept, microseconds (2^40 us is about 12 days), bigger ones are clamped
+		self.max_value = (1 << max_bits) - 1
+		self.counts = [0] * (self.index(self.max_value) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0
+		# negative gaps, only from clock skew (receive), recorded as 0
+		self.negative = 0
+		self.lock = threading.Lock()
+
+	# bucket holding a value in microseconds
+	def index(self, value):
+		if value < self.sub_count:
+			return value
+		shift = value.bit_length() - self.bits
+		return self.sub_count + (shift - 1) * self.half + (value >> shift) - self.half
+
+	# first value (microseconds) past a bucket
+	def upper(self, index):
+		if index < self.sub_count:
+			return index + 1
+		shift, offset = divmod(index - self.sub_count, self.half)
+		return (self.half + offset + 1) << (shift + 1)
+
+	def record(self, seconds):
+		value = int(seconds * 1e6)
+		with self.lock:
+			if value < 0:
+				self.negative += 1
+				value = 0
+			elif value > self.max_value:
+				value = self.max_value
+			self.counts[self.index(value)] += 1
+			self.count += 1
+			self.sum += seconds
+			if value > self.max:
+				self.max = value
+
+	# consistent copy of (counts, count, sum, max) for the readers below
+	def copy(self):
+		with self.lock:
+			return list(self.counts), self.count, self.sum, self.max
+
+	# value (seconds) at or below which `quantile` of the recorded values are, None when empty
+	def quantiles(self, quantiles, copy=None):
+		counts, count, total, largest = copy or self.copy()
+		if not count:
+			return [None] * len(quantiles)
+		targets = sorted((max(1, round(quantile * count)), position) for position, quantile in enumerate(quantiles))
+		results = [None] * len(quantiles)
+		seen = 0
+		index = 0
+		for target, position in targets:
+			while seen < target:
+				seen += counts[index]
+				index += 1
+			# top of the bucket, but never past the largest value actually seen
+			results[position] = min(self.upper(index - 1) - 1, largest) / 1e6
+		return results
+
+	# number of values below each bound (seconds), cumulative like prometheus' le buckets
+	# a bound inside a bucket counts the values below that bucket
+	def below(self, bounds, copy=None):
+		counts, count, total, largest = copy or self.copy()
+		results = []
+		seen = 0
+		index = 0
+		for bound in bounds:
+			limit = self.index(min(int(bound * 1e6), self.max_value))
+			while index < limit:
+				seen += counts[index]
+				index += 1
+			results.append(seen)
+		return results
+
+	def stats(self):
+		copy = self.copy()
+		counts, count, total, largest = copy
+		p50, p90, p99, p999 = [round(value * 1000, 3) if value is not None else None
+			for value in self.quantiles((0.5, 0.9, 0.99, 0.999), copy)]
+		return {
+			'count': count,
+			'mean_ms': round(total / count * 1000, 3) if count else None,
+			'p50_ms': p50,
+			'p90_ms': p90,
+			'p99_ms': p99,
+			'p999_ms': p999,
+			'max_ms': largest / 1000 if count else None,
+			'negative': self.negative,
+		}
+
+# one histogram per (stage, product), made on first use
+class LatencyRecorder:
+	def __init__(self, bits=7):
+		self.bits = bits
+		self.histograms = {}
+		self.lock = threading.Lock()
+
+	def histogram(self, stage, product_id):
+		key = (stage, product_id)
+		histogram = self.histograms.get(key)
+		if histogram is None:
+			with self.lock:
+				histogram = self.histograms.setdefault(key, LatencyHistogram(self.bits))
+		return histogram
+
+	def record(self, stage, product_id, seconds):
+		self.histogram(stage, product_id).record(seconds)
+
+	# a snapshot went out to a browser: its age since it was applied, and since the exchange sent it
+	def served(self, product_id, snapshot, now=None):
+		now = now if now is not None else time.time()
+		if snapshot.timestamp:
+			self.record('serve', product_id, now - snapshot.timestamp)
+		if snapshot.exchange_time is not None:
+			self.record('total', product_id, now - snapshot.exchange_time)
+
+	def items(self):
+		order = {stage: index for index, stage in enumerate(STAGES)}
+		with self.lock:
+			keys = list(self.histograms)
+		keys.sort(key=lambda key: (key[1], order.get(key[0], len(order)), key[0]))
+		return [(key, self.histograms[key]) for key in keys]
+
+	# product -> stage -> count / mean / percentiles in ms, for /stats
+	def stats(self):
+		stats = {}
+		for (stage, product_id), histogram in self.items():
+			stats.setdefault(product_id, {})[stage] = histogram.stats()
+		return stats
+
+	# prometheus text exposition: a histogram at PROMETHEUS_BUCKETS plus the hdr quantiles as a gauge
+	def prometheus(self, name='mmv_latency_seconds'):
+		items = self.items()
+		lines = [
+			f"# HELP {name} Time from one stage of a book update to the next (see latency.py).",
+			f"# TYPE {name} histogram",
+		]
+		quantile_lines = [
+			f"# HELP {name}_quantile Latency quantiles at full histogram resolution.",
+			f"# TYPE {name}_quantile gauge",
+		]
+		for (stage, product_id), histogram in items:
+			copy = histogram.copy()
+			counts, count, total, largest = copy
+			labels = f'stage="{stage}",product="{product_id}"'
+			for bound, below in zip(PROMETHEUS_BUCKETS, histogram.below(PROMETHEUS_BUCKETS, copy)):
+				lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {below}')
+			lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+			lines.append(f'{name}_sum{{{labels}}} {total:.6f}')
+			lines.append(f'{name}_count{{{labels}}} {count}')
+			for quantile, value in zip(PROMETHEUS_QUANTILES, histogram.quantiles(PROMETHEUS_QUANTILES, copy)):
+				if value is not None:
+					quantile_lines.append(f'{name}_quantile{{{labels},quantile="{quantile:g}"}} {value:.6f}')
+		return '\n'.join(lines + quantile_lines) + '\n'
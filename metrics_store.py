@@ -0,0 +1,204 @@
+import os
+import shutil
+import time
+import numpy as np
+from timeseries import METRICS
+try:
+	import fcntl
+except ImportError:
+	# no flock (windows), every store writes
+	fcntl = None
+
+# on-disk metric history that survives restarts
+#
+# columnar, one directory per utc day, one fixed width float64 file per column:
+#
+#   <directory>/20250101/time.f64
+#   <directory>/20250101/spread.f64  mid_price.f64  imbalance.f64
+#
+# files are preallocated (sparse) and memory mapped, an append is a few stores into
+# the maps with no fsync; the os writes the pages back on its own, and they're in the
+# page cache either way so a crashed or restarted worker loses nothing.
+# the time column is written last and a zero time marks the end, so a torn row is
+# simply not there on reopen. NaN = no value (empty book).
+#
+# one process writes a directory at a time: the store holding the flock on WRITER_LOCK appends,
+# any other (gunicorn workers each running their own sampler in standalone mode) only reads,
+# so rows never get clobbered and times stay sorted. a reader checks every TAKEOVER_INTERVAL
+# seconds whether the writer went away and takes over if it did.
+
+TIME_COLUMN = 'time'
+COLUMN_SUFFIX = '.f64'
+WRITER_LOCK = '.writer.lock'
+TAKEOVER_INTERVAL = 5.0
+
+def day_key(timestamp):
+	return time.strftime('%Y%m%d', time.gmtime(timestamp))
+
+# one day of rows, read only ones map what's on disk and never create or grow a file
+class Segment:
+	def __init__(self, path, columns, capacity, writable=True):
+		self.path = path
+		self.key = os.path.basename(path)
+		self.columns = columns
+		self.capacity = 0
+		self.maps = {}
+		# an existing segment keeps its size, even if the sample interval changed since
+		time_path = self.column_path(TIME_COLUMN)
+		if os.path.exists(time_path):
+			capacity = max(os.path.getsize(time_path) // 8, 1)
+		if writable:
+			os.makedirs(path, exist_ok=True)
+			self.resize(capacity)
+		else:
+			self.map_read_only()
+		# rows already there: everything before the first unwritten (zero) time
+		empty = np.flatnonzero(self.maps[TIME_COLUMN] == 0)
+		self.count = int(empty[0]) if len(empty) else self.capacity
+
+	def column_path(self, name):
+		return os.path.join(self.path, name + COLUMN_SUFFIX)
+
+	# grow every column file to `capacity` rows and (re)map them
+	def resize(self, capacity):
+		for name in (TIME_COLUMN,) + self.columns:
+			path = self.column_path(name)
+			with open(path, 'ab') as f:
+				if f.tell() < capacity * 8:
+					f.truncate(capacity * 8)
+			self.maps[name] = np.memmap(path, dtype=np.float64, mode='r+', shape=(capacity,))
+		self.capacity = capacity
+
+	# the columns as the writer left them, short ones (mid resize) limit the rows
+	def map_read_only(self):
+		sizes = [os.path.getsize(self.column_path(name)) // 8 if os.path.exists(self.column_path(name)) else 0
+			for name in (TIME_COLUMN,) + self.columns]
+		self.capacity = min(sizes)
+		for name in (TIME_COLUMN,) + self.columns:
+			if self.capacity:
+				self.maps[name] = np.memmap(self.column_path(name), dtype=np.float64, mode='r', shape=(self.capacity,))
+			else:
+				self.maps[name] = np.zeros(0)
+
+	def append(self, timestamp, values):
+		if self.count >= self.capacity:
+			# faster sampling than the segment was sized for, double it
+			self.resize(self.capacity * 2)
+		row = self.count
+		for name, value in zip(self.columns, values):
+			self.maps[name][row] = np.nan if value is None else value
+		self.maps[TIME_COLUMN][row] = timestamp
+		self.count += 1
+
+	# (times, {column: values}) for start <= time < end, views into the maps
+	def read(self, start, end):
+		times = self.maps[TIME_COLUMN][:self.count]
+		first = int(np.searchsorted(times, start, side='left'))
+		last = int(np.searchsorted(times, end, side='left'))
+		return times[first:last], {name: self.maps[name][first:last] for name in self.columns}
+
+	def flush(self):
+		for column in self.maps.values():
+			column.flush()
+
+class MetricsStore:
+	# rows_per_day is only the initial allocation, segments grow if it's exceeded
+	def __init__(self, directory, columns=METRICS, rows_per_day=86400, retention_days=30):
+		self.directory = directory
+		self.columns = tuple(columns)
+		self.rows_per_day = rows_per_day
+		self.retention_days = retention_days
+		self.segments = {} # day key -> open Segment, writer only
+		self.current = None
+		os.makedirs(directory, exist_ok=True)
+
+		# single writer, see the top
+		self.lock_file = open(os.path.join(directory, WRITER_LOCK), 'a')
+		self.writer = False
+		self.next_takeover = 0.0
+		self.take_writer()
+		if not self.writer:
+			print(f"+ {directory} is written by another process, reading only +")
+
+	# try for the writer lock, True if this store is (now) the writer
+	def take_writer(self):
+		if self.writer:
+			return True
+		if fcntl is not None:
+			try:
+				fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except OSError:
+				return False
+		self.writer = True
+		# segments seen while reading are stale, rescan them for writing
+		self.segments.clear()
+		self.current = None
+		return True
+
+	# day keys on disk, oldest first
+	def days(self):
+		return sorted(name for name in os.listdir(self.directory)
+			if name.isdigit() and os.path.isdir(os.path.join(self.directory, name)))
+
+	# readers get a fresh look every time, the writer moves on without them
+	def segment(self, key):
+		if not self.writer:
+			return Segment(os.path.join(self.directory, key), self.columns, self.rows_per_day, writable=False)
+		segment = self.segments.get(key)
+		if segment is None:
+			segment = Segment(os.path.join(self.directory, key), self.columns, self.rows_per_day)
+			self.segments[key] = segment
+		return segment
+
+	# hot path, called by the sampler thread
+	# a reader drops the row (its in-memory history still has it) until it becomes the writer
+	def append(self, timestamp, values):
+		if not self.writer:
+			now = time.monotonic()
+			if now < self.next_takeover:
+				return
+			self.next_takeover = now + TAKEOVER_INTERVAL
+			if not self.take_writer():
+				return
+			print(f"+ Took over writing {self.directory} +")
+		key = day_key(timestamp)
+		if self.current is None or self.current.key != key:
+			self.current = self.segment(key)
+			self.prune()
+		self.current.append(timestamp, values)
+
+	# drop segments past retention
+	def prune(self):
+		days = self.days()
+		for key in days[:max(len(days) - self.retention_days, 0)]:
+			segment = self.segments.pop(key, None)
+			if segment is not None:
+				segment.maps.clear()
+			shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+	# (times, {column: values}) for start <= time < end across day segments
+	# a range inside one day comes back as views into the maps, longer ones are concatenated
+	def read(self, start, end=None):
+		if end is None:
+			end = time.time() + 1
+		first, last = day_key(start), day_key(end)
+		parts = [self.segment(key).read(start, end) for key in self.days() if first <= key <= last]
+		parts = [part for part in parts if len(part[0])]
+		if not parts:
+			return np.empty(0), {name: np.empty(0) for name in self.columns}
+		if len(parts) == 1:
+			return parts[0]
+		times = np.concatenate([times for times, values in parts])
+		return times, {name: np.concatenate([values[name] for times, values in parts]) for name in self.columns}
+
+	def __len__(self):
+		return sum(self.segment(key).count for key in self.days())
+
+	def close(self):
+		for segment in self.segments.values():
+			segment.flush()
+		self.segments.clear()
+		self.current = None
+		# closing the file lets the flock go
+		self.lock_file.close()
+		self.writer = False
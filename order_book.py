@@ -1,63 +1,349 @@
 import threading
-from collections import deque
+import time
+from collections import namedtuple
+import numpy as np
+from sortedcontainers import SortedDict
+from timeseries import MetricsHistory
+from analytics import book_metrics
 
 # stores live order book for btc.
 
+# depths we keep running volume totals for
+DEPTH_LEVELS = (5, 10, 25, 50)
+
+# depth used for the headline imbalance number
+IMBALANCE_DEPTH = 10
+
+# the depths a book keeps totals for: the ones asked for plus IMBALANCE_DEPTH, which publish reads
+def book_depths(depths):
+	return tuple(sorted(set(depths) | {IMBALANCE_DEPTH}))
+
+# price buckets the whole book is also totalled in, in ticks (100 = $1 on a cents book)
+# coarser buckets and bps of mid are added up from these at read time, see depth.py
+BUCKET_TICKS = 100
+
+# how far either side of the mid bucket_band reads, as a fraction of the mid
+DEPTH_BAND = 0.05
+
+# fixed point precision of the coinbase wire format
+# btc-usd prices tick at 0.01 and sizes go down to 1e-8 (one satoshi)
+PRICE_DECIMALS = 2
+SIZE_DECIMALS = 8
+
+# parse a decimal string like "67012.34" straight into an int of 10^-decimals units
+# no float in between, so "67012.34" is always exactly 6701234 ticks
+def parse_fixed(text, decimals):
+	whole, _, frac = text.partition('.')
+	if len(frac) != decimals:
+		# pad or trim to the precision we store (coinbase pads sizes, not always prices)
+		frac = frac[:decimals].ljust(decimals, '0')
+	return int(whole + frac)
+
+# {price // bucket_ticks: total size} over parallel price / size sequences, for a whole side at once
+def bucket_totals(prices, sizes, bucket_ticks):
+	if not len(prices):
+		return SortedDict()
+	buckets = np.asarray(prices, dtype=np.int64) // bucket_ticks
+	sizes = np.asarray(sizes, dtype=np.int64)
+	order = np.argsort(buckets, kind='stable')
+	buckets = buckets[order]
+	starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+	totals = np.add.reduceat(sizes[order], starts)
+	keep = totals != 0
+	return SortedDict(zip(buckets[starts][keep].tolist(), totals[keep].tolist()))
+
+# immutable view of the book published by the writer after every applied update
+# readers grab `orderbook.snapshot` once and never touch the lock
+# bids/asks are the top levels best first, bid_volume/ask_volume line up with depths
+# prices are in ticks and sizes in lots, convert with OrderBook.to_price / to_size for display
+# mid_price can land on half a tick so it is a float number of ticks
+# exchange_time is when the exchange sent the newest update in it (None if unknown), see latency.py
+class BookSnapshot(namedtuple('BookSnapshot', [
+	'version', 'timestamp',
+	'best_bid', 'best_ask', 'spread', 'mid_price', 'imbalance',
+	'bids', 'asks', 'depths', 'bid_volume', 'ask_volume',
+	'exchange_time',
+], defaults=(None,))):
+	__slots__ = ()
+
+	# same shape get_metrics always returned
+	def metrics(self):
+		return {
+			'best_bid': self.best_bid,
+			'best_ask': self.best_ask,
+			'spread': self.spread,
+			'mid_price': self.mid_price,
+			'imbalance': self.imbalance
+		}
+
+	# same shape get_depth_snapshot always returned
+	def depth(self, levels=10):
+		return {
+			'bids': list(self.bids[:levels]),
+			'asks': list(self.asks[:levels])
+		}
+
+	# top `depth` levels as one contiguous int64 array [side (bid, ask), (price, size), rank],
+	# zero size past the end of a side; what the vectorized metrics work on (see analytics.py)
+	def level_array(self, depth):
+		array = np.zeros((2, 2, depth), dtype=np.int64)
+		for side, levels in enumerate((self.bids, self.asks)):
+			count = min(len(levels), depth)
+			if count:
+				array[side, :, :count] = np.array(levels[:count], dtype=np.int64).T
+		return array
+
+EMPTY_SNAPSHOT = BookSnapshot(0, 0.0, None, None, None, None, None, (), (), (), (), ())
+
+EMPTY_BAND = tuple(np.zeros(0, dtype=np.int64) for _ in range(4))
+
 class OrderBook:
-	def __init__(self):
-		# dicts for asks and buys
-		# price -> size
-		self.bids = {}
-		self.asks = {}
+	def __init__(self, depths=DEPTH_LEVELS, price_decimals=PRICE_DECIMALS, size_decimals=SIZE_DECIMALS, bucket_ticks=BUCKET_TICKS):
+		# integer fixed point, prices in ticks and sizes in lots
+		self.price_decimals = price_decimals
+		self.size_decimals = size_decimals
+		self.price_scale = 10 ** price_decimals
+		self.size_scale = 10 ** size_decimals
+
+		# sorted dicts for asks and buys
+		# price ticks -> size lots, kept in price order so top of book is just the first/last key
+		self.bids = SortedDict()
+		self.asks = SortedDict()
+
+		# running top-N aggregates, updated as each change is applied
+		# depth -> total size of the best `depth` levels on that side
+		self.depths = book_depths(depths)
+		self.max_depth = self.depths[-1]
+		self.bid_volume = {depth: 0 for depth in self.depths}
+		self.ask_volume = {depth: 0 for depth in self.depths}
+
+		# whole book totals per price bucket, bucket (price // bucket_ticks) -> size lots
+		# kept up to date change by change, so wide depth views never walk the levels
+		self.bucket_ticks = bucket_ticks
+		self.bid_buckets = SortedDict()
+		self.ask_buckets = SortedDict()
+
+		# cached best max_depth levels per side, rebuilt only when a change lands inside them
+		self.top_bids = ()
+		self.top_asks = ()
+		self.top_dirty = False
 
 		# safety - websocket runs on different thread
 		self.lock = threading.Lock()
 
-		# chart history
-		self.spread_history = deque(maxlen=300)
-		self.mid_price_history = deque(maxlen=300)
-		self.imbalance_history = deque(maxlen=300)
+		# latest published snapshot, swapped by reference so reads are atomic
+		self.version = 0
+		self.snapshot = EMPTY_SNAPSHOT
+
+		# chart history, one row per sample (see sampler.py) + 1m / 15m rollups (see timeseries.py)
+		# spread / mid are stored in ticks like everything else
+		self.history = MetricsHistory()
+		# optional on-disk copy of the history (metrics_store.MetricsStore), see open_store
+		self.store = None
+
+		# microprice, multi depth imbalance, slope... for get_metrics: the engine shared with the
+		# other books (analytics.BookAnalytics) and this book's key in it, see use_analytics
+		self.analytics = None
+		self.analytics_key = None
+		# (version, metrics) when the book has no engine
+		self.analytics_values = None
+
+	# wire string -> ticks / lots
+	def parse_price(self, text):
+		return parse_fixed(text, self.price_decimals)
+
+	def parse_size(self, text):
+		return parse_fixed(text, self.size_decimals)
+
+	# ticks / lots -> display floats, only used at the edges (charts, text)
+	def to_price(self, ticks):
+		return ticks / self.price_scale if ticks is not None else None
+
+	def to_size(self, lots):
+		return lots / self.size_scale if lots is not None else None
 
 	# called when recieve initial snapshot
-	# converts lists into our dictionaries
+	# converts lists of wire strings into our dictionaries
 	def initialize_snapshot(self, bids_list, asks_list):
+		parse_price = self.parse_price
+		parse_size = self.parse_size
+		bid_prices = [parse_price(price) for price, size in bids_list]
+		bid_sizes = [parse_size(size) for price, size in bids_list]
+		ask_prices = [parse_price(price) for price, size in asks_list]
+		ask_sizes = [parse_size(size) for price, size in asks_list]
+		self.load_snapshot(bid_prices, bid_sizes, ask_prices, ask_sizes)
+
+	# replace the whole book from parallel price tick / size lot sequences
+	# (resyncs land here too, the old book stays up until the new one is swapped in whole)
+	def load_snapshot(self, bid_prices, bid_sizes, ask_prices, ask_sizes):
+		# build the sorted dicts, top levels and aggregates before taking the lock,
+		# so it's only held for the swap and the publish
+		bids = SortedDict(zip(bid_prices, bid_sizes))
+		asks = SortedDict(zip(ask_prices, ask_sizes))
+		top_bids = self.top_levels(bids, self.max_depth, True)
+		top_asks = self.top_levels(asks, self.max_depth, False)
+		bid_volume = {depth: sum(size for price, size in top_bids[:depth]) for depth in self.depths}
+		ask_volume = {depth: sum(size for price, size in top_asks[:depth]) for depth in self.depths}
+		# the wire lists are much quicker to total than the dicts, unless a price repeats (the dict keeps the last)
+		if len(bids) == len(bid_prices) and len(asks) == len(ask_prices):
+			bid_buckets = bucket_totals(bid_prices, bid_sizes, self.bucket_ticks)
+			ask_buckets = bucket_totals(ask_prices, ask_sizes, self.bucket_ticks)
+		else:
+			bid_buckets = bucket_totals(list(bids.keys()), list(bids.values()), self.bucket_ticks)
+			ask_buckets = bucket_totals(list(asks.keys()), list(asks.values()), self.bucket_ticks)
 		with self.lock:
-			self.bids.clear()
-			self.asks.clear()
-			for price, size in bids_list:
-				self.bids[float(price)] = float(size)
-			for price, size in asks_list:
-				self.asks[float(price)] = float(size)
-			print(f"+ Initialized {len(self.bids)} bids, {len(self.asks)} asks +")
+			self.bids = bids
+			self.asks = asks
+			self.bid_buckets = bid_buckets
+			self.ask_buckets = ask_buckets
+			self.top_bids = top_bids
+			self.top_asks = top_asks
+			self.bid_volume = bid_volume
+			self.ask_volume = ask_volume
+			self.top_dirty = False
+			self.publish()
+		print(f"+ Initialized {len(bids)} bids, {len(asks)} asks +")
 	
 	# called upon updates to update book
+	# changes are coinbase [side, price, size] string triples
 	def process_update(self, changes):
+		parse_price = self.parse_price
+		parse_size = self.parse_size
+		sides = []
+		prices = []
+		sizes = []
+		for side, price, size in changes:
+			if side == "buy" or side == "sell":
+				sides.append(side == "buy")
+				prices.append(parse_price(price))
+				sizes.append(parse_size(size))
+		self.apply_changes(sides, prices, sizes)
+
+	# apply already parsed changes as parallel sequences
+	# sides are truthy for bids, prices in ticks, sizes in lots (0 removes the level)
+	# exchange_time (unix seconds) of the newest change is carried on the snapshot
+	def apply_changes(self, sides, prices, sizes, exchange_time=None):
 		with self.lock:
-			for side, price, size in changes:
-				if side == "buy":
-					# if size 0 remove from list
-					if float(size) == 0:
-						self.bids.pop(float(price), None)
-					else:
-						self.bids[float(price)] = float(size)
-				elif side == "sell":
-					if float(size) == 0:
-						self.asks.pop(float(price), None)
-					else:
-						self.asks[float(price)] = float(size)
+			bids, asks = self.bids, self.asks
+			bid_volume, ask_volume = self.bid_volume, self.ask_volume
+			bid_buckets, ask_buckets = self.bid_buckets, self.ask_buckets
+			for is_bid, price, size in zip(sides, prices, sizes):
+				if is_bid:
+					self.set_level(bids, bid_volume, bid_buckets, True, price, size)
+				else:
+					self.set_level(asks, ask_volume, ask_buckets, False, price, size)
+			self.publish(exchange_time)
+
+	# build and swap in a new snapshot of the current book
+	# caller must hold the lock, only the writer thread calls this
+	def publish(self, exchange_time=None):
+		self.refresh_top()
+		best_bid = self.top_bids[0][0] if self.top_bids else None
+		best_ask = self.top_asks[0][0] if self.top_asks else None
+		spread = mid_price = imbalance = None
+		if best_bid is not None and best_ask is not None:
+			spread = best_ask - best_bid
+			mid_price = (best_bid + best_ask) / 2
+			bid_volume = self.bid_volume[IMBALANCE_DEPTH]
+			ask_volume = self.ask_volume[IMBALANCE_DEPTH]
+			if bid_volume + ask_volume > 0:
+				imbalance = bid_volume / (bid_volume + ask_volume)
+		self.version += 1
+		self.snapshot = BookSnapshot(
+			self.version, time.time(),
+			best_bid, best_ask, spread, mid_price, imbalance,
+			self.top_bids, self.top_asks, self.depths,
+			tuple(self.bid_volume[depth] for depth in self.depths),
+			tuple(self.ask_volume[depth] for depth in self.depths),
+			exchange_time,
+		)
+
+	# position of a price from the top of its side (0 = best)
+	# bids are sorted ascending so we count from the end
+	def level_rank(self, book, price, is_bid):
+		index = book.index(price)
+		return len(book) - 1 - index if is_bid else index
+
+	# size of the level `rank` places from the top of its side
+	def level_at_rank(self, book, rank, is_bid):
+		return book.peekitem(-1 - rank if is_bid else rank)[1]
+
+	# apply one change to a side and keep its running volumes and bucket totals in sync
+	# only levels inside the deepest window touch the aggregates, everything else is O(log n)
+	# caller must hold the lock
+	def set_level(self, book, volumes, buckets, is_bid, price, size):
+		old = book.get(price)
+		delta = size - (old or 0)
+		if delta:
+			bucket = price // self.bucket_ticks
+			total = buckets.get(bucket, 0) + delta
+			if total:
+				buckets[bucket] = total
+			else:
+				del buckets[bucket]
+		if size == 0:
+			# if size 0 remove from list
+			if old is None:
+				return
+			rank = self.level_rank(book, price, is_bid)
+			del book[price]
+			if rank >= self.max_depth:
+				return
+			for depth in self.depths:
+				if rank < depth:
+					# the level just outside the window slides in
+					volumes[depth] -= old
+					if len(book) >= depth:
+						volumes[depth] += self.level_at_rank(book, depth - 1, is_bid)
+		elif old is None:
+			book[price] = size
+			rank = self.level_rank(book, price, is_bid)
+			if rank >= self.max_depth:
+				return
+			for depth in self.depths:
+				if rank < depth:
+					# the level that was last in the window gets pushed out
+					volumes[depth] += size
+					if len(book) > depth:
+						volumes[depth] -= self.level_at_rank(book, depth, is_bid)
+		else:
+			book[price] = size
+			rank = self.level_rank(book, price, is_bid)
+			if rank >= self.max_depth:
+				return
+			for depth in self.depths:
+				if rank < depth:
+					volumes[depth] += size - old
+		self.top_dirty = True
+
+	# best `levels` (price, size) pairs of one side, best first
+	def top_levels(self, book, levels, is_bid):
+		if is_bid:
+			return tuple(reversed(book.items()[-levels:])) if levels else ()
+		return tuple(book.items()[:levels])
+
+	# refresh the cached top levels if a change landed inside them
+	# caller must hold the lock
+	def refresh_top(self):
+		if self.top_dirty:
+			self.top_bids = self.top_levels(self.bids, self.max_depth, True)
+			self.top_asks = self.top_levels(self.asks, self.max_depth, False)
+			self.top_dirty = False
 	# get highest bid
+	# bids are sorted ascending so the best one is the last key
 	def get_best_bid(self):
 		with self.lock:
 			if self.bids:
-				return max(self.bids.keys())
+				return self.bids.peekitem(-1)[0]
 			else:
 				return None
 
-	# get highest ask
+	# get lowest ask
+	# asks are sorted ascending so the best one is the first key
 	def get_best_ask(self):
 		with self.lock:
 			if self.asks:
-				return min(self.asks.keys())
+				return self.asks.peekitem(0)[0]
 			else:
 				return None
 
@@ -66,7 +352,7 @@ class OrderBook:
 	def get_spread(self):
 		with self.lock:
 			if self.asks and self.bids:
-				return  min(self.asks.keys()) - max(self.bids.keys())
+				return self.asks.peekitem(0)[0] - self.bids.peekitem(-1)[0]
 			else:
 				return None
 	
@@ -74,49 +360,94 @@ class OrderBook:
 	def get_mid_price(self):
 		with self.lock:
 			if self.asks and self.bids:
-				return (max(self.bids.keys()) + min(self.asks.keys())) / 2
+				return (self.bids.peekitem(-1)[0] + self.asks.peekitem(0)[0]) / 2
 			else:
 				return None
 	
+	# get cumulative bid and ask volume over the top `depth` levels
+	# configured depths are read straight from the running totals
+	def get_depth_volume(self, depth=10):
+		with self.lock:
+			if depth in self.bid_volume:
+				return self.bid_volume[depth], self.ask_volume[depth]
+			bid_volume = sum(size for price, size in self.top_levels(self.bids, depth, True))
+			ask_volume = sum(size for price, size in self.top_levels(self.asks, depth, False))
+			return bid_volume, ask_volume
+
 	# get imbalance (buy vs sell pressure)
 	# remember, imbalance = bid_vol / (bid_vol + ask_vol)
 	# we use top 10 bid values and ask values to calculate this
 	# if == 0.5, balanced. > 0.5 -> buy pressure, < 0.5 -> sell pressure
-	def get_imbalance(self):
-		with self.lock:
-			if self.asks and self.bids:
-				top_ten_bids = sorted(self.bids.items(), reverse=True)[:10]
-				bid_volume = sum(size for price, size in top_ten_bids)
-				top_ten_asks = sorted(self.asks.items())[:10]
-				ask_volume = sum(size for price, size in top_ten_asks)
-				return bid_volume / (bid_volume + ask_volume)
-			else:
-				return None
+	def get_imbalance(self, depth=10):
+		if not (self.asks and self.bids):
+			return None
+		bid_volume, ask_volume = self.get_depth_volume(depth)
+		if bid_volume + ask_volume <= 0:
+			return None
+		return bid_volume / (bid_volume + ask_volume)
 	
 	# get depth snapshot (top N price levels)
 	def get_depth_snapshot(self, levels=10):
+		if levels <= self.max_depth:
+			return self.snapshot.depth(levels)
 		with self.lock:
-			sorted_bids = sorted(self.bids.items(), reverse = True)[:levels]
-			sorted_asks = sorted(self.asks.items())[:levels]
 			return {
-				'bids': sorted_bids,
-				'asks': sorted_asks
+				'bids': list(self.top_levels(self.bids, levels, True)),
+				'asks': list(self.top_levels(self.asks, levels, False))
 			}
 
+	# bucket totals within `band` (fraction of the mid) either side of the mid, nearest the mid first
+	# (bid buckets, bid lots, ask buckets, ask lots) as int64 arrays, empty while a side is missing
+	# only the band is copied under the lock, a few thousand buckets however many levels it holds
+	def bucket_band(self, band=DEPTH_BAND):
+		mid_price = self.snapshot.mid_price
+		if mid_price is None:
+			return EMPTY_BAND
+		low = int(mid_price * (1 - band)) // self.bucket_ticks
+		high = int(mid_price * (1 + band)) // self.bucket_ticks
+		with self.lock:
+			bid_buckets, ask_buckets = self.bid_buckets, self.ask_buckets
+			bid_keys = list(bid_buckets.irange(low, high, reverse=True))
+			bid_lots = [bid_buckets[key] for key in bid_keys]
+			ask_keys = list(ask_buckets.irange(low, high))
+			ask_lots = [ask_buckets[key] for key in ask_keys]
+		return (
+			np.array(bid_keys, dtype=np.int64), np.array(bid_lots, dtype=np.int64),
+			np.array(ask_keys, dtype=np.int64), np.array(ask_lots, dtype=np.int64),
+		)
+
 	# store metrics in history for charting
-	# this is called every second to build historical data
-	# appends to spread history, mid price history, and imbalance history
-	def update_history(self):
-		self.spread_history.append(self.get_spread())
-		self.mid_price_history.append(self.get_mid_price())
-		self.imbalance_history.append(self.get_imbalance())
-
-	# gets all metrics at once
+	# the sampler thread calls this on a fixed cadence to build historical data
+	# appends the sample time with the spread, mid price, and imbalance (see timeseries.METRICS)
+	# only the sampler writes, so the ring needs no lock
+	def update_history(self, timestamp=None):
+		snapshot = self.snapshot
+		timestamp = timestamp if timestamp is not None else time.time()
+		values = (snapshot.spread, snapshot.mid_price, snapshot.imbalance)
+		self.history.append(timestamp, values)
+		if self.store is not None:
+			self.store.append(timestamp, values)
+
+	# start persisting samples to `store`, first backfilling the in-memory history from it
+	# so the charts have the previous run's data straight away
+	def open_store(self, store, now=None):
+		now = now if now is not None else time.time()
+		times, columns = store.read(now - self.history.span(), now)
+		if len(times):
+			rows = np.column_stack([columns[name] for name in self.history.metrics])
+			self.history.extend(np.asarray(times), rows)
+			print(f"+ Loaded {len(times)} history samples from {store.directory} +")
+		self.store = store
+
+	# compute analytics in `analytics` (a BookAnalytics holding this book as `key`) from now on
+	def use_analytics(self, analytics, key):
+		self.analytics = analytics
+		self.analytics_key = key
+
+	# gets all metrics at once, the headline ones plus analytics.METRIC_NAMES
+	# all values come from the same published snapshot, no locking
 	def get_metrics(self):
-		return {	
-			'best_bid': self.get_best_bid(),
-			'best_ask': self.get_best_ask(),
-			'spread': self.get_spread(),
-			'mid_price': self.get_mid_price(),
-			'imbalance': self.get_imbalance()
-		}
\ No newline at end of file
+		snapshot = self.snapshot
+		metrics = snapshot.metrics()
+		metrics.update(book_metrics(self, snapshot))
+		return metrics
@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import deque
+from order_book import OrderBook, PRICE_DECIMALS
+from decoder import string_field
+from ingest import IngestPipeline
+from analytics import BookAnalytics
+
+# many products over one feed connection
+#
+# the registry holds one book per product id; ShardedIngest sits between the websocket and
+# the books and hands each frame to the ingest pipeline (ring buffer + applier thread) of the
+# shard its product lives on, so a busy pair backing up its ring can't hold up a quiet one.
+# for more than threads give you, run several ingest processes with different product lists
+# (see MMV_MODE in app.py), every product gets its own shared memory segment.
+
+DEFAULT_PRODUCTS = 'BTC-USD'
+
+# "BTC-USD,ETH-USD,DOGE-USD:5" -> [(product id, price decimals), ...]
+# the decimals default to cents, pairs quoted finer than that need them spelled out
+def parse_products(text):
+	products = []
+	for item in text.split(','):
+		item = item.strip()
+		if not item:
+			continue
+		product_id, _, decimals = item.partition(':')
+		products.append((product_id.upper(), int(decimals) if decimals else PRICE_DECIMALS))
+	if not products:
+		raise ValueError("no products given")
+	return products
+
+# "BTC-USD" -> "BTC", for axis titles and hover text
+def base_currency(product_id):
+	return product_id.split('-')[0]
+
+class ProductRegistry:
+	# factory(product_id, price_decimals) -> book, an OrderBook by default
+	def __init__(self, products, factory=None):
+		factory = factory or (lambda product_id, price_decimals: OrderBook(price_decimals=price_decimals))
+		self.books = {product_id: factory(product_id, price_decimals) for product_id, price_decimals in products}
+		self.product_ids = list(self.books)
+		self.primary_id = self.product_ids[0]
+		self.primary = self.books[self.primary_id]
+		# one analytics engine for every book: get_metrics and the dashboard share its cache,
+		# and a pass covers every product that moved
+		self.analytics = BookAnalytics(self.books)
+		for product_id, book in self.books.items():
+			book.use_analytics(self.analytics, product_id)
+
+	# unknown (or missing) ids get the first product, so a stale page still shows something
+	def book(self, product_id):
+		return self.books.get(product_id, self.primary)
+
+	def items(self):
+		return self.books.items()
+
+	def __iter__(self):
+		return iter(self.product_ids)
+
+	def __len__(self):
+		return len(self.books)
+
+# frame listener that routes frames to one IngestPipeline per shard by product id
+# products are dealt round robin, so with shards >= products every product has its own applier
+class ShardedIngest:
+	def __init__(self, registry, shards=1, on_message=None, rate_window=10.0, **pipeline_args):
+		shards = max(1, min(shards, len(registry)))
+		assigned = [{} for _ in range(shards)]
+		for index, (product_id, book) in enumerate(registry.items()):
+			assigned[index % shards][product_id] = book
+		self.pipelines = [IngestPipeline(books, on_message=on_message, **pipeline_args) for books in assigned]
+		self.routes = {product_id: pipeline for pipeline in self.pipelines for product_id in pipeline.books}
+		# with one shard there's nothing to route, skip the product lookup
+		if shards == 1:
+			self.push = self.pipelines[0].push
+			self.push_wait = self.pipelines[0].push_wait
+
+		# the feed frames come from, see attach
+		self.feed = None
+
+		# (monotonic time, {product: (frames, changes, updates)}, {thread: cpu seconds}) marks for the rates
+		self.rate_window = rate_window
+		self.marks = deque([(time.monotonic(), {}, {})])
+		self.lock = threading.Lock()
+
+	# take frames from `feed` (CoinbaseWebSocket, CaptureReplay), its receive thread's cpu is counted too
+	# a lossless feed (replay) is held back when a ring is full, the socket never is,
+	# and one that isn't live (replay again) has its exchange times ignored
+	def attach(self, feed):
+		self.feed = feed
+		for pipeline in self.pipelines:
+			pipeline.live = getattr(feed, 'live', True)
+		feed.add_frame_listener(self.push_wait if getattr(feed, 'lossless', False) else self.push)
+
+	# runs on the receive thread; frames without a product (subscriptions, errors) go to the first shard
+	def push(self, frame, recv_time):
+		pipeline = self.routes.get(string_field(frame, '"product_id":"'), self.pipelines[0])
+		pipeline.push(frame, recv_time)
+
+	# same, waiting for room instead of dropping (lossless feeds)
+	def push_wait(self, frame, recv_time):
+		pipeline = self.routes.get(string_field(frame, '"product_id":"'), self.pipelines[0])
+		pipeline.push_wait(frame, recv_time)
+
+	def start(self):
+		for pipeline in self.pipelines:
+			pipeline.start()
+
+	def stop(self):
+		for pipeline in self.pipelines:
+			pipeline.stop()
+
+	# product -> (frames, changes applied, book updates) since start
+	def counts(self):
+		counts = {}
+		for pipeline in self.pipelines:
+			counts.update(pipeline.product_counts())
+		return counts
+
+	# cpu seconds used so far by the receive thread and the appliers
+	def cpu(self):
+		return {
+			'receive': getattr(self.feed, 'cpu_seconds', 0.0),
+			'apply': sum(pipeline.cpu_seconds for pipeline in self.pipelines),
+		}
+
+	# per product rates and latency, and cpu as % of one core, over roughly the last rate_window seconds
+	# staleness is how old the book is on average when read: latency plus half the time between updates
+	def usage(self):
+		now = time.monotonic()
+		counts = self.counts()
+		cpu = self.cpu()
+		with self.lock:
+			self.marks.append((now, counts, cpu))
+			while len(self.marks) > 2 and now - self.marks[1][0] >= self.rate_window:
+				self.marks.popleft()
+			then, old_counts, old_cpu = self.marks[0]
+		elapsed = max(now - then, 1e-9)
+		latency = {}
+		for pipeline in self.pipelines:
+			latency.update(pipeline.product_latency())
+		products = {}
+		for product_id, (frames, changes, updates) in counts.items():
+			old_frames, old_changes, old_updates = old_counts.get(product_id, (0, 0, 0))
+			average, last = latency.get(product_id, (None, None))
+			updates_per_sec = (updates - old_updates) / elapsed
+			staleness = None
+			if average is not None and updates_per_sec:
+				staleness = average + 0.5 / updates_per_sec
+			products[product_id] = {
+				'frames_per_sec': (frames - old_frames) / elapsed,
+				'changes_per_sec': (changes - old_changes) / elapsed,
+				'book_updates_per_sec': updates_per_sec,
+				'frames': frames,
+				'changes': changes,
+				'latency_ms': average * 1000 if average is not None else None,
+				'last_latency_ms': last * 1000 if last is not None else None,
+				'staleness_ms': staleness * 1000 if staleness is not None else None,
+			}
+		cpu_percent = {thread: (seconds - old_cpu.get(thread, 0.0)) / elapsed * 100 for thread, seconds in cpu.items()}
+		return products, cpu_percent
+
+	def stats(self):
+		products, cpu_percent = self.usage()
+		return {
+			'shards': [pipeline.stats() for pipeline in self.pipelines],
+			'products': products,
+			'cpu_percent': cpu_percent,
+		}
@@ -0,0 +1,226 @@
+import functools
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# opt-in instrumentation (MMV_PROFILE=1) for when the dashboard gets sluggish
+#
+# - every dash callback is timed twice: `callback.<name>` is our function (building the
+#   figure / values), `response.<name>` is the whole dash request handling around it, so the
+#   difference is dash's own work (mostly json serialization); responses also count bytes.
+# - every OrderBook method is timed as `book.<name>`, except the per-level helpers that run
+#   thousands of times inside the others (their cost shows in the callers and the lock hold).
+# - each book's lock records, per thread, how long it waited to get the lock and how long it
+#   held it, which tells a writer hogging the book apart from readers piling up behind it.
+# - sample() is a poor man's sampling profiler over every thread's stack, for /profile.
+#
+# nothing is wrapped when profiling is off, so it costs nothing then.
+
+# called per level / per value from inside other book methods
+BOOK_SKIP = {'set_level', 'level_rank', 'level_at_rank', 'top_levels', 'refresh_top', 'publish',
+	'parse_price', 'parse_size', 'to_price', 'to_size'}
+
+# thread names with their counters folded, so "Thread-12 (process_request_thread)" and
+# "Thread-13 (...)" add up to one row
+def thread_group(name):
+	return re.sub(r'\d+', 'N', name)
+
+class CallStats:
+	__slots__ = ('calls', 'raised', 'wall', 'wall_max', 'cpu', 'bytes')
+
+	def __init__(self):
+		self.calls = 0
+		# calls that ended in an exception, PreventUpdate included
+		self.raised = 0
+		self.wall = 0.0
+		self.wall_max = 0.0
+		self.cpu = 0.0
+		self.bytes = 0
+
+	def stats(self):
+		calls = self.calls or 1
+		return {
+			'calls': self.calls,
+			'raised': self.raised,
+			'avg_ms': self.wall / calls * 1000,
+			'max_ms': self.wall_max * 1000,
+			'total_s': self.wall,
+			'cpu_s': self.cpu,
+			'avg_bytes': self.bytes / calls if self.bytes else None,
+		}
+
+class LockStats:
+	__slots__ = ('acquires', 'wait', 'wait_max', 'hold', 'hold_max')
+
+	def __init__(self):
+		self.acquires = 0
+		self.wait = 0.0
+		self.wait_max = 0.0
+		self.hold = 0.0
+		self.hold_max = 0.0
+
+	def stats(self):
+		acquires = self.acquires or 1
+		return {
+			'acquires': self.acquires,
+			'avg_wait_ms': self.wait / acquires * 1000,
+			'max_wait_ms': self.wait_max * 1000,
+			'avg_hold_ms': self.hold / acquires * 1000,
+			'max_hold_ms': self.hold_max * 1000,
+			'wait_s': self.wait,
+			'hold_s': self.hold,
+		}
+
+# drop-in for threading.Lock that times waits and holds per thread group
+# only ever used with `with`, like the book uses its lock
+class InstrumentedLock:
+	def __init__(self, lock, stats, stats_lock):
+		self.lock = lock
+		# thread group -> LockStats, owned by the profiler
+		self.stats = stats
+		self.stats_lock = stats_lock
+		self.acquired_at = 0.0
+
+	def acquire(self, blocking=True, timeout=-1):
+		started = time.perf_counter()
+		acquired = self.lock.acquire(blocking, timeout)
+		if acquired:
+			self.acquired_at = time.perf_counter()
+			wait = self.acquired_at - started
+			group = thread_group(threading.current_thread().name)
+			with self.stats_lock:
+				stats = self.stats.get(group)
+				if stats is None:
+					stats = self.stats[group] = LockStats()
+				stats.acquires += 1
+				stats.wait += wait
+				if wait > stats.wait_max:
+					stats.wait_max = wait
+		return acquired
+
+	def release(self):
+		hold = time.perf_counter() - self.acquired_at
+		self.lock.release()
+		group = thread_group(threading.current_thread().name)
+		with self.stats_lock:
+			stats = self.stats[group]
+			stats.hold += hold
+			if hold > stats.hold_max:
+				stats.hold_max = hold
+
+	def locked(self):
+		return self.lock.locked()
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, *exc):
+		self.release()
+
+class Profiler:
+	def __init__(self):
+		# name -> CallStats
+		self.calls = {}
+		# lock name -> thread group -> LockStats
+		self.locks = {}
+		self.lock = threading.Lock()
+		self.started = time.time()
+		# one sampling run at a time
+		self.sampling = threading.Lock()
+
+	# time fn as `name`; payload(result) -> bytes, for responses
+	def wrap(self, name, fn, payload=None):
+		@functools.wraps(fn)
+		def timed(*args, **kwargs):
+			started = time.perf_counter()
+			cpu_started = time.thread_time()
+			failed = True
+			try:
+				result = fn(*args, **kwargs)
+				failed = False
+				return result
+			finally:
+				wall = time.perf_counter() - started
+				cpu = time.thread_time() - cpu_started
+				size = payload(result) if payload is not None and not failed else 0
+				with self.lock:
+					stats = self.calls.get(name)
+					if stats is None:
+						stats = self.calls[name] = CallStats()
+					stats.calls += 1
+					stats.wall += wall
+					stats.cpu += cpu
+					stats.bytes += size
+					if wall > stats.wall_max:
+						stats.wall_max = wall
+					if failed:
+						stats.raised += 1
+		return timed
+
+	# time every callback registered on `app` from now on; call before the @app.callback's run
+	def instrument_app(self, app):
+		register = app.callback
+		def callback(*args, **kwargs):
+			known = set(app.callback_map)
+			decorate = register(*args, **kwargs)
+			def wrap(func):
+				decorate(self.wrap(f'callback.{func.__name__}', func))
+				# dash keeps its own wrapper (which returns the json body) in callback_map
+				for output in set(app.callback_map) - known:
+					spec = app.callback_map[output]
+					spec['callback'] = self.wrap(f'response.{func.__name__}', spec['callback'], payload=response_bytes)
+				return func
+			return wrap
+		app.callback = callback
+
+	# time the public methods of one book (OrderBook or SharedOrderBook) and its lock, if it has one
+	def instrument_book(self, book, name):
+		for attr, member in inspect.getmembers(type(book), inspect.isfunction):
+			if attr.startswith('_') or attr in BOOK_SKIP:
+				continue
+			setattr(book, attr, self.wrap(f'book.{attr}', getattr(book, attr)))
+		if isinstance(getattr(book, 'lock', None), type(threading.Lock())):
+			book.lock = InstrumentedLock(book.lock, self.locks.setdefault(name, {}), self.lock)
+
+	# every thread's stack `interval` apart for `seconds`, as collapsed stacks
+	# ("thread;outer;...;inner count" per line, what flamegraph.pl and speedscope read)
+	def sample(self, seconds=5.0, interval=0.005):
+		with self.sampling:
+			me = threading.get_ident()
+			names = {}
+			stacks = Counter()
+			deadline = time.monotonic() + seconds
+			samples = 0
+			while time.monotonic() < deadline:
+				for thread in threading.enumerate():
+					names[thread.ident] = thread_group(thread.name)
+				for ident, frame in sys._current_frames().items():
+					if ident == me:
+						continue
+					stack = []
+					while frame is not None:
+						code = frame.f_code
+						stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+						frame = frame.f_back
+					stack.append(names.get(ident, str(ident)))
+					stacks[';'.join(reversed(stack))] += 1
+				samples += 1
+				time.sleep(interval)
+			lines = [f"# {samples} samples every {interval * 1000:g} ms over {seconds:g}s"]
+			lines += [f"{stack} {count}" for stack, count in stacks.most_common()]
+			return '\n'.join(lines) + '\n'
+
+	def stats(self):
+		with self.lock:
+			calls = {name: stats.stats() for name, stats in self.calls.items()}
+			locks = {name: {group: stats.stats() for group, stats in groups.items()} for name, groups in self.locks.items()}
+		return {'since': self.started, 'calls': calls, 'locks': locks}
+
+# dash callbacks return the response body as a json string
+def response_bytes(body):
+	return len(body) if isinstance(body, (str, bytes)) else 0
@@ -0,0 +1,188 @@
+import json
+import queue
+import threading
+import time
+import numpy as np
+
+# server push of market state to browsers (server-sent events on /stream)
+#
+# one broadcaster thread renders the book once per new version (at most every `interval`
+# seconds) and hands the same encoded message to every subscriber, so server cost scales
+# with the update rate instead of clients x callbacks x polls.
+#
+# messages are json:
+#   {"type": "full",  "version", "now", "parts": {...every part}, "samples": [[t, spread], ...], "templates": {...}}
+#   {"type": "delta", "version", "now", "parts": {...parts that changed}, "samples": [[t, spread], ...new ones]}
+# a subscriber always starts with a full message (on the first broadcast, if it connected before
+# there was one); one that falls behind is reset with a new full one. full messages are only
+# built when a subscriber needs one, a steady stream of deltas never pays for the window.
+
+class PushBroadcaster:
+	# render(snapshot) -> {part name: json-able value}, called on the broadcaster thread only
+	# templates are static per process (figure layouts, styles) and only sent in full messages
+	def __init__(self, orderbook, render, templates=None, window=300, interval=0.1, queue_size=64):
+		self.orderbook = orderbook
+		self.render = render
+		self.templates = templates or {}
+		self.window = window
+		self.interval = interval
+		self.queue_size = queue_size
+		self.subscribers = set()
+		self.lock = threading.Lock()
+		self.running = False
+		self.thread = None
+
+		# last broadcast state
+		self.version = -1
+		self.parts = {}
+		self.history_count = 0
+		# (version, now, time of the newest sample sent) of the last broadcast, None before the first
+		self.last = None
+		# its full message, see full()
+		self.full_message = None
+		# subscribers that haven't had a full message yet
+		self.waiting = set()
+
+		# stats
+		self.messages = 0
+		self.resets = 0
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name='push')
+		self.thread.daemon = True
+		self.thread.start()
+		print(f"+ Pushing updates every {self.interval:g}s at most +")
+
+	def stop(self):
+		self.running = False
+		if self.thread:
+			self.thread.join(timeout=1)
+
+	def subscribe(self):
+		subscriber = queue.Queue(self.queue_size)
+		with self.lock:
+			full = self.full()
+			if full is not None:
+				subscriber.put(full)
+			else:
+				self.waiting.add(subscriber)
+			self.subscribers.add(subscriber)
+		return subscriber
+
+	def unsubscribe(self, subscriber):
+		with self.lock:
+			self.subscribers.discard(subscriber)
+			self.waiting.discard(subscriber)
+
+	def run(self):
+		while self.running:
+			started = time.monotonic()
+			try:
+				self.tick()
+			except Exception as e:
+				print(f"- Push error: {e} -")
+			delay = self.interval - (time.monotonic() - started)
+			if delay > 0:
+				time.sleep(delay)
+
+	def tick(self):
+		snapshot = self.orderbook.snapshot
+		history = self.orderbook.history.raw
+		history_count = history.count
+		if snapshot.best_bid is None or (snapshot.version == self.version and history_count == self.history_count):
+			return
+		now = time.time()
+		parts = self.render(snapshot)
+		changed = {name: value for name, value in parts.items() if self.parts.get(name) != value}
+		# rows newer than the last one sent, by time, so a row the sampler adds mid tick isn't sent twice
+		sent = self.last[2] if self.last is not None else -np.inf
+		times, data = history.last()
+		start = int(np.searchsorted(times, sent, side='right'))
+		new_times, new_data = times[start:], data[start:]
+		delta = {
+			'type': 'delta',
+			'version': snapshot.version,
+			'now': now,
+			'parts': changed,
+			'samples': self.samples((new_times, new_data)),
+		}
+		with self.lock:
+			self.version = snapshot.version
+			self.parts = parts
+			self.history_count = history_count
+			self.last = (snapshot.version, now, new_times[-1] if len(new_times) else sent)
+			self.full_message = None
+			# under the same lock, so a subscriber joins either before this broadcast or after it
+			self.broadcast(json.dumps(delta, separators=(',', ':')))
+
+	# the full message for the last broadcast, built on first use; None before the first broadcast
+	# samples stop at the newest one that broadcast had, the deltas after it carry on from there.
+	# same series (means for long windows) the dash callbacks draw. caller holds the lock
+	def full(self):
+		if self.full_message is None and self.last is not None:
+			version, now, newest = self.last
+			times, series = self.orderbook.history.window(self.window, now)
+			end = int(np.searchsorted(times, newest, side='right'))
+			self.full_message = json.dumps({
+				'type': 'full',
+				'version': version,
+				'now': now,
+				'parts': self.parts,
+				'samples': self.samples((times[:end], {metric: values[:end] for metric, values in series.items()})),
+				'window': self.window,
+				'templates': self.templates,
+			}, separators=(',', ':'))
+		return self.full_message
+
+	# [[t, spread in dollars], ...] from (times, data) or (times, {metric: values}), NaNs dropped
+	def samples(self, series):
+		times, data = series
+		spreads = data['spread'] if isinstance(data, dict) else self.orderbook.history.raw.column(data, 'spread')
+		valid = ~np.isnan(spreads)
+		values = spreads[valid] / self.orderbook.price_scale
+		return [[round(t, 3), round(v, 6)] for t, v in zip(times[valid].tolist(), values.tolist())]
+
+	# caller holds the lock
+	def broadcast(self, delta):
+		for subscriber in self.subscribers:
+			if subscriber in self.waiting:
+				# connected before there was anything to send, its first message is a full one
+				subscriber.put_nowait(self.full())
+				continue
+			try:
+				subscriber.put_nowait(delta)
+			except queue.Full:
+				# slow client: drop what it hasn't read and start it over from the current state
+				self.resets += 1
+				while True:
+					try:
+						subscriber.get_nowait()
+					except queue.Empty:
+						break
+				subscriber.put_nowait(self.full())
+		self.waiting.clear()
+		self.messages += 1
+
+	# sse body for one client, runs on the request thread until the browser goes away
+	def stream(self, keepalive=15.0):
+		subscriber = self.subscribe()
+		try:
+			yield "retry: 2000\n\n"
+			while True:
+				try:
+					message = subscriber.get(timeout=keepalive)
+				except queue.Empty:
+					yield ": keepalive\n\n"
+					continue
+				yield f"data: {message}\n\n"
+		finally:
+			self.unsubscribe(subscriber)
+
+	def stats(self):
+		return {
+			'subscribers': len(self.subscribers),
+			'messages': self.messages,
+			'resets': self.resets,
+			'version': self.version,
+		}
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from capture import capture_files, read_index, iter_chunks, iter_frames, is_snapshot, snapshot_product
+from decoder import string_field
+
+# replays a capture (file or directory from capture.py) in place of CoinbaseWebSocket
+# same start / stop / add_frame_listener / on_message_callback surface, so app.py,
+# handle_websocket_message and the ingest pipeline can't tell the difference.
+# speed: 1 = real time, N = N times faster, 0 = as fast as possible
+# a replay can wait, so listeners may block it (lossless): a full ingest ring holds the replay
+# back instead of dropping frames, which keeps max speed replays deterministic
+# it isn't live either: the exchange times in the frames are the capture's, so the ingest path
+# leaves out everything timed from them (receive / total latency, staleness)
+class CaptureReplay:
+	lossless = True
+	live = False
+
+	def __init__(self, path, on_message_callback=None, speed=1.0, start_time=None):
+		self.path = path
+		self.callback = on_message_callback
+		self.speed = speed
+		self.running = False
+		self.thread = None
+		self.frame_listeners = []
+
+		# where to start: (file index, chunk offset) of a snapshot, and the time to pace from
+		self.start_file = 0
+		self.start_offset = None
+		self.target_ns = None
+		# product -> (file index, chunk offset) of the snapshot its frames start from, see seek
+		self.snapshot_at = {}
+		if start_time is not None:
+			self.seek(start_time)
+
+		# progress
+		self.frames = 0
+		# frames of a product from before its snapshot, held back (see run)
+		self.skipped = 0
+		self.position_ns = 0
+		self.finished = False
+
+	def add_frame_listener(self, listener):
+		self.frame_listeners.append(listener)
+
+	# jump to `timestamp` (epoch seconds): every product starts from its latest snapshot at or
+	# before it (its first one after, if it has none before), the replay starts at the earliest
+	# of those and fast forwards through the updates up to the timestamp before pacing starts
+	def seek(self, timestamp):
+		target_ns = int(timestamp * 1e9)
+		# product -> (recv ns, file index, offset), index entries come oldest first
+		chosen = {}
+		for file_index, file_path in enumerate(capture_files(self.path)):
+			for recv_ns, offset in read_index(file_path):
+				product_id = snapshot_product(file_path, offset)
+				if recv_ns <= target_ns or product_id not in chosen:
+					chosen[product_id] = (recv_ns, file_index, offset)
+		if not chosen:
+			raise ValueError(f"no snapshots in {self.path}, can't seek")
+		recv_ns, self.start_file, self.start_offset = min(chosen.values())
+		self.snapshot_at = {product_id: (file_index, offset) for product_id, (_, file_index, offset) in chosen.items()}
+		self.target_ns = target_ns
+		print(f"+ Replay seek: {len(chosen)} product snapshot(s) from {recv_ns / 1e9:.3f}, target {timestamp:.3f} +")
+
+	# (file index, chunk offset, recv ns, frame) from the seek point to the end
+	def frames_from_start(self):
+		files = capture_files(self.path)
+		for file_index in range(self.start_file, len(files)):
+			offset = self.start_offset if file_index == self.start_file else None
+			for chunk_offset, first_ns, last_ns, records in iter_chunks(files[file_index], offset):
+				for recv_ns, frame in records:
+					yield file_index, chunk_offset, recv_ns, frame
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name='feed')
+		self.thread.daemon = True
+		self.thread.start()
+		print(f"+ Replaying {self.path} at {'max' if not self.speed else f'{self.speed:g}x'} speed +")
+
+	def stop(self):
+		self.running = False
+		if self.thread and self.thread is not threading.current_thread():
+			self.thread.join(timeout=1)
+		print("- Stopped - ")
+
+	# a product's frames only go out from its snapshot on (the one seek picked for it, any
+	# snapshot otherwise), updates with nothing under them would only build a bogus book
+	def run(self):
+		wall_start = None
+		capture_start = None
+		based = set()
+		for file_index, chunk_offset, recv_ns, frame in self.frames_from_start():
+			if not self.running:
+				return
+			product_id = string_field(frame, '"product_id":"')
+			if product_id is not None and product_id not in based:
+				if not is_snapshot(frame) or self.snapshot_at.get(product_id, (file_index, chunk_offset)) != (file_index, chunk_offset):
+					self.skipped += 1
+					continue
+				based.add(product_id)
+			# pace against the capture clock once we're past the seek target
+			if self.speed and (self.target_ns is None or recv_ns >= self.target_ns):
+				if wall_start is None:
+					wall_start = time.perf_counter()
+					capture_start = recv_ns
+				delay = (recv_ns - capture_start) / 1e9 / self.speed - (time.perf_counter() - wall_start)
+				if delay > 0:
+					time.sleep(delay)
+			self.deliver(frame)
+			self.frames += 1
+			self.position_ns = recv_ns
+		self.finished = True
+		print(f"+ Replay finished, {self.frames} frames ({self.skipped} held back before their snapshot) +")
+
+	# same hand off as CoinbaseWebSocket.on_message
+	def deliver(self, frame):
+		recv_time = time.time()
+		for listener in self.frame_listeners:
+			listener(frame, recv_time)
+		if self.callback:
+			try:
+				data = json.loads(frame)
+				self.callback(data.get("type"), data)
+			except json.JSONDecodeError:
+				print(f"- Json parse failed: {frame}-")
+
+# max sustainable ingest throughput of the book: decode + coalesce + apply, no threads, no pacing
+def measure_throughput(path, batch_size=1024):
+	from order_book import OrderBook
+	from ingest import IngestPipeline
+	frames = [(recv_ns / 1e9, frame) for recv_ns, frame in iter_frames(path)]
+	pipeline = IngestPipeline(OrderBook(), max_batch=batch_size)
+	start = time.perf_counter()
+	for index in range(0, len(frames), batch_size):
+		pipeline.apply_batch(frames[index:index + batch_size])
+	elapsed = time.perf_counter() - start
+	stats = pipeline.stats()
+	print(f"{len(frames)} frames, {stats['changes_received']} changes in {elapsed:.2f}s")
+	print(f"{len(frames) / elapsed:,.0f} frames/s, {stats['changes_received'] / elapsed:,.0f} changes/s")
+	if frames:
+		span = frames[-1][0] - frames[0][0]
+		if span > 0:
+			print(f"capture spans {span:.1f}s, replayable at {span / elapsed:,.1f}x real time")
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description="replay a feed capture")
+	parser.add_argument('path', help="capture file or directory")
+	parser.add_argument('--speed', type=float, default=1.0, help="1 = real time, 0 = as fast as possible")
+	parser.add_argument('--start', type=float, help="epoch seconds to seek to")
+	parser.add_argument('--throughput', action='store_true', help="measure max ingest throughput and exit")
+	args = parser.parse_args()
+
+	if args.throughput:
+		measure_throughput(args.path)
+	else:
+		def my_callback(msg_type, data):
+			if msg_type == "snapshot":
+				print(f" snapshot: {len(data.get('bids', []))} bids, {len(data.get('asks', []))} asks")
+		replay = CaptureReplay(args.path, on_message_callback=my_callback, speed=args.speed, start_time=args.start)
+		replay.start()
+		try:
+			while not replay.finished:
+				time.sleep(0.5)
+		except KeyboardInterrupt:
+			print("\n- User Interrupt (keypress) -\n")
+		replay.stop()
+		print(f"+ finished. {replay.frames} frames +")
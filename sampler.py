@@ -0,0 +1,49 @@
+import threading
+import time
+
+# samples the books' metrics into their history on a fixed cadence
+# runs on its own thread so the history rate doesn't depend on how many browsers
+# are open or how often the charts refresh; chart callbacks only read the history
+# takes one book or a list of them (one per product), all sampled at the same time
+class MetricsSampler:
+	def __init__(self, orderbook, interval=1.0):
+		self.orderbooks = list(orderbook) if isinstance(orderbook, (list, tuple)) else [orderbook]
+		self.interval = interval
+		self.running = False
+		self.thread = None
+
+		# stats
+		self.samples = 0
+		self.late = 0
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name='sampler')
+		self.thread.daemon = True
+		self.thread.start()
+		print(f"+ Sampling metrics every {self.interval:g}s +")
+
+	def stop(self):
+		self.running = False
+		if self.thread:
+			self.thread.join(timeout=self.interval + 1)
+
+	def run(self):
+		# schedule off a fixed grid so samples don't drift by the time each one takes
+		next_tick = time.monotonic()
+		while self.running:
+			self.sample()
+			next_tick += self.interval
+			delay = next_tick - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				# fell behind (suspend, gc pause...), skip the missed ticks instead of bursting
+				self.late += 1
+				next_tick = time.monotonic()
+
+	def sample(self):
+		now = time.time()
+		for orderbook in self.orderbooks:
+			orderbook.update_history(now)
+		self.samples += 1
@@ -0,0 +1,374 @@
+import os
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from order_book import BookSnapshot, EMPTY_SNAPSHOT, EMPTY_BAND, DEPTH_LEVELS, book_depths, PRICE_DECIMALS, SIZE_DECIMALS, BUCKET_TICKS, DEPTH_BAND
+from timeseries import MetricsHistory
+from analytics import book_metrics
+
+# one ingest process, many web workers
+#
+# the ingest process owns the feed and the OrderBook and copies each new snapshot into a
+# shared memory segment; gunicorn workers attach to it with SharedOrderBook, which has the
+# read side of the OrderBook api (snapshot, history, to_price...) the app uses.
+#
+# snapshots are guarded by a seqlock: the writer bumps the sequence to odd, writes, bumps it
+# to even; a reader copies the (small) block and retries if the sequence moved under it.
+# the metric history rings live in the segment too and are read in place, no copies.
+# the price buckets near the mid (for the cumulative depth chart) have a seqlock of their own,
+# so the bigger block is only copied by the readers that want it.
+
+SHM_NAME = 'mmv_book'
+LAYOUT_MAGIC = 0x334b4f4f42564d4d # "MMVBOOK3"
+
+# header slots (int64)
+MAGIC, SIZE, SEQ, GENERATION, STATE, MAX_DEPTH, DEPTH_COUNT, HEARTBEAT_NS, BUCKET_SEQ, BUCKET_WIDTH = range(10)
+HEADER_SLOTS = 10
+LIVE, CLOSED = 1, 2
+
+# int fields, ticks / lots; NONE stands in for None
+VERSION, BEST_BID, BEST_ASK, SPREAD = range(4)
+NONE = np.iinfo(np.int64).min
+
+# price buckets per side the segment has room for, the ones furthest from the mid are cut
+# (±5% of a 100k btc in $1 buckets is 5000 a side)
+BUCKET_SLOTS = 16384
+
+# float fields (mid can be half a tick), NaN for None
+TIMESTAMP, MID_PRICE, IMBALANCE, EXCHANGE_TIME = range(4)
+
+# numpy views into the segment live as long as the process does, so skip SharedMemory's
+# close-on-gc (it can't close with views exported) and let the os unmap it at exit
+class Segment(shared_memory.SharedMemory):
+	def __del__(self):
+		pass
+
+def to_int(value):
+	return NONE if value is None else value
+
+def from_int(value):
+	return None if value == NONE else int(value)
+
+def to_float(value):
+	return np.nan if value is None else value
+
+def from_float(value):
+	return None if np.isnan(value) else float(value)
+
+# carves the segment into arrays, the same way on both sides
+# with buffer=None it only adds up the size (layout_size)
+class Layout:
+	def __init__(self, buffer, depths=DEPTH_LEVELS):
+		self.buffer = memoryview(buffer) if buffer is not None else None
+		self.offset = 0
+		max_depth = max(depths)
+		self.header = self.array((HEADER_SLOTS,), np.int64)
+		self.ints = self.array((4,), np.int64)
+		self.floats = self.array((4,), np.float64)
+		# [side (bid, ask), (price, size), rank]
+		self.levels = self.array((2, 2, max_depth), np.int64)
+		self.level_counts = self.array((2,), np.int64)
+		# [side, depth]
+		self.volumes = self.array((2, len(depths)), np.int64)
+		# [side, (bucket, size), slot], nearest the mid first
+		self.buckets = self.array((2, 2, BUCKET_SLOTS), np.int64)
+		self.bucket_counts = self.array((2,), np.int64)
+		self.history = MetricsHistory(allocate=self.allocate)
+
+	def allocate(self, nbytes):
+		if self.buffer is None:
+			view = bytearray(nbytes)
+		else:
+			view = self.buffer[self.offset:self.offset + nbytes]
+		# keep every array 8 byte aligned
+		self.offset += (nbytes + 7) // 8 * 8
+		return view
+
+	def array(self, shape, dtype):
+		nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+		return np.ndarray(shape, dtype, self.allocate(nbytes))
+
+def layout_size(depths=DEPTH_LEVELS):
+	return Layout(None, depths).offset
+
+# ingest side: copies the book's snapshot into shared memory every `interval` when it changed
+# and moves the book's history into the segment, so the sampler writes straight to readers
+# latency (latency.LatencyRecorder) gets how long each snapshot waited to be copied, under product_id
+class SharedBookWriter:
+	def __init__(self, orderbook, name=SHM_NAME, interval=0.05, latency=None, product_id=None, band=DEPTH_BAND):
+		self.orderbook = orderbook
+		self.name = name
+		self.interval = interval
+		self.band = band
+		self.latency = latency
+		self.product_id = product_id
+		self.depths = orderbook.depths
+		size = layout_size(self.depths)
+		# left over from a run that crashed, readers still on it notice the generation change
+		try:
+			stale = Segment(name)
+			stale.unlink()
+			stale.close()
+		except FileNotFoundError:
+			pass
+		self.shm = Segment(name, create=True, size=size)
+		self.layout = Layout(self.shm.buf, self.depths)
+		header = self.layout.header
+		header[MAGIC] = LAYOUT_MAGIC
+		header[SIZE] = size
+		header[GENERATION] = int.from_bytes(os.urandom(7), 'little')
+		header[MAX_DEPTH] = orderbook.max_depth
+		header[DEPTH_COUNT] = len(self.depths)
+		header[BUCKET_WIDTH] = orderbook.bucket_ticks
+		header[STATE] = LIVE
+		# history written by the sampler now lands in the segment
+		orderbook.history = self.layout.history
+		self.published = -1
+		self.running = False
+		self.thread = None
+
+		# stats
+		self.publishes = 0
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name='shared-writer')
+		self.thread.daemon = True
+		self.thread.start()
+		print(f"+ Publishing book to shared memory {self.name} ({self.shm.size // 1024} KB) +")
+
+	def stop(self):
+		self.running = False
+		if self.thread:
+			self.thread.join(timeout=1)
+		self.layout.header[STATE] = CLOSED
+		self.shm.unlink()
+
+	def run(self):
+		while self.running:
+			self.publish()
+			# heartbeat even when the book is quiet, so readers can tell idle from dead
+			self.layout.header[HEARTBEAT_NS] = time.time_ns()
+			time.sleep(self.interval)
+
+	def publish(self):
+		snapshot = self.orderbook.snapshot
+		if snapshot.version == self.published:
+			return
+		layout = self.layout
+		header = layout.header
+		header[SEQ] += 1 # odd, readers back off
+		layout.ints[:] = (snapshot.version, to_int(snapshot.best_bid), to_int(snapshot.best_ask), to_int(snapshot.spread))
+		layout.floats[:] = (snapshot.timestamp, to_float(snapshot.mid_price), to_float(snapshot.imbalance),
+			to_float(snapshot.exchange_time))
+		for side, levels in enumerate((snapshot.bids, snapshot.asks)):
+			count = len(levels)
+			if count:
+				layout.levels[side, :, :count] = np.array(levels, dtype=np.int64).T
+			layout.level_counts[side] = count
+		if snapshot.depths:
+			layout.volumes[0] = snapshot.bid_volume
+			layout.volumes[1] = snapshot.ask_volume
+		header[SEQ] += 1 # even again, consistent
+		self.publish_buckets()
+		self.published = snapshot.version
+		self.publishes += 1
+		if self.latency is not None and snapshot.timestamp:
+			self.latency.record('publish', self.product_id, time.time() - snapshot.timestamp)
+
+	def publish_buckets(self):
+		band = self.orderbook.bucket_band(self.band)
+		layout = self.layout
+		header = layout.header
+		header[BUCKET_SEQ] += 1
+		for side, (keys, lots) in enumerate((band[:2], band[2:])):
+			count = min(len(keys), BUCKET_SLOTS)
+			layout.buckets[side, 0, :count] = keys[:count]
+			layout.buckets[side, 1, :count] = lots[:count]
+			layout.bucket_counts[side] = count
+		header[BUCKET_SEQ] += 1
+
+# web worker side: the read half of OrderBook on top of the shared segment
+# attaches lazily (the ingest process may start later) and follows it across restarts
+class SharedOrderBook:
+	def __init__(self, name=SHM_NAME, depths=DEPTH_LEVELS, price_decimals=PRICE_DECIMALS, size_decimals=SIZE_DECIMALS,
+			check_interval=5.0):
+		self.name = name
+		# same depths as the writer's OrderBook, or the layouts won't match
+		self.depths = book_depths(depths)
+		self.max_depth = self.depths[-1]
+		self.price_decimals = price_decimals
+		self.size_decimals = size_decimals
+		self.price_scale = 10 ** price_decimals
+		self.size_scale = 10 ** size_decimals
+		self.bucket_ticks = BUCKET_TICKS
+		self.check_interval = check_interval
+		self.size = layout_size(self.depths)
+		self.shm = None
+		self.layout = None
+		self.generation = None
+		self.retired = []
+		self.attach_lock = threading.Lock()
+		self.next_check = 0.0
+		# empty until attached
+		self.history = MetricsHistory()
+		self.store = None
+		# see OrderBook
+		self.analytics = None
+		self.analytics_key = None
+		self.analytics_values = None
+
+		# last consistent read, reused while the sequence doesn't move
+		self.cached = EMPTY_SNAPSHOT
+		self.cached_seq = -1
+		self.cached_band = EMPTY_BAND
+		self.cached_band_seq = -1
+
+		# stats
+		self.retries = 0
+
+	def to_price(self, ticks):
+		return ticks / self.price_scale if ticks is not None else None
+
+	def to_size(self, lots):
+		return lots / self.size_scale if lots is not None else None
+
+	# (re)attach when there's no segment yet, the writer closed it, or a new one replaced it
+	def attach(self):
+		# request threads race here on first use, the losers wait and then see the attached layout
+		with self.attach_lock:
+			self.attach_segment()
+
+	def attach_segment(self):
+		now = time.monotonic()
+		if now < self.next_check:
+			return
+		self.next_check = now + self.check_interval
+		try:
+			shm = Segment(self.name)
+		except FileNotFoundError:
+			return
+		# before 3.13 every attaching process registers the segment and unlinks it on exit
+		resource_tracker.unregister(shm._name, 'shared_memory')
+		header = np.ndarray((HEADER_SLOTS,), np.int64, shm.buf)
+		generation = int(header[GENERATION])
+		valid = header[MAGIC] == LAYOUT_MAGIC and header[SIZE] == self.size and header[MAX_DEPTH] == self.max_depth
+		del header
+		if generation == self.generation:
+			shm.close()
+			return
+		if not valid:
+			shm.close()
+			raise ValueError(f"shared memory {self.name} has a different layout, is the ingest process the same version?")
+		if self.shm is not None:
+			# views into the old segment may still be out there (chart callbacks), keep it mapped
+			self.retired.append(self.shm)
+		layout = Layout(shm.buf, self.depths)
+		self.shm = shm
+		self.layout = layout
+		self.generation = generation
+		self.history = layout.history
+		self.bucket_ticks = int(layout.header[BUCKET_WIDTH])
+		self.cached = EMPTY_SNAPSHOT
+		self.cached_seq = -1
+		self.cached_band = EMPTY_BAND
+		self.cached_band_seq = -1
+		print(f"+ Attached to shared book {self.name} +")
+
+	@property
+	def snapshot(self):
+		if self.layout is None or self.layout.header[STATE] == CLOSED or time.monotonic() >= self.next_check:
+			self.attach()
+		if self.layout is None:
+			return EMPTY_SNAPSHOT
+		return self.read()
+
+	@property
+	def version(self):
+		return self.snapshot.version
+
+	# seqlock read: copy the block, keep it only if the sequence didn't change meanwhile
+	def read(self, attempts=1000):
+		layout = self.layout
+		header = layout.header
+		for _ in range(attempts):
+			seq = int(header[SEQ])
+			if seq == self.cached_seq:
+				return self.cached
+			if seq & 1:
+				self.retries += 1
+				time.sleep(0)
+				continue
+			ints = layout.ints.copy()
+			floats = layout.floats.copy()
+			counts = layout.level_counts.copy()
+			levels = layout.levels[:, :, :max(counts.max(), 0)].copy()
+			volumes = layout.volumes.copy()
+			if int(header[SEQ]) != seq:
+				self.retries += 1
+				continue
+			bid_count, ask_count = min(int(counts[0]), self.max_depth), min(int(counts[1]), self.max_depth)
+			self.cached = BookSnapshot(
+				version=int(ints[VERSION]),
+				timestamp=float(floats[TIMESTAMP]),
+				best_bid=from_int(ints[BEST_BID]),
+				best_ask=from_int(ints[BEST_ASK]),
+				spread=from_int(ints[SPREAD]),
+				mid_price=from_float(floats[MID_PRICE]),
+				imbalance=from_float(floats[IMBALANCE]),
+				bids=tuple(zip(levels[0, 0, :bid_count].tolist(), levels[0, 1, :bid_count].tolist())),
+				asks=tuple(zip(levels[1, 0, :ask_count].tolist(), levels[1, 1, :ask_count].tolist())),
+				depths=self.depths,
+				bid_volume=tuple(volumes[0].tolist()),
+				ask_volume=tuple(volumes[1].tolist()),
+				exchange_time=from_float(floats[EXCHANGE_TIME]),
+			)
+			self.cached_seq = seq
+			return self.cached
+		# writer is hammering the block, the last good read will do
+		return self.cached
+
+	# OrderBook.bucket_band off the segment, always the writer's band (MMV_DEPTH_BAND on the ingest side)
+	def bucket_band(self, band=DEPTH_BAND, attempts=1000):
+		if self.snapshot is EMPTY_SNAPSHOT or self.layout is None:
+			return EMPTY_BAND
+		layout = self.layout
+		header = layout.header
+		for _ in range(attempts):
+			seq = int(header[BUCKET_SEQ])
+			if seq == self.cached_band_seq:
+				return self.cached_band
+			if seq & 1:
+				self.retries += 1
+				time.sleep(0)
+				continue
+			bid_count, ask_count = (min(int(count), BUCKET_SLOTS) for count in layout.bucket_counts)
+			bids = layout.buckets[0, :, :bid_count].copy()
+			asks = layout.buckets[1, :, :ask_count].copy()
+			if int(header[BUCKET_SEQ]) != seq:
+				self.retries += 1
+				continue
+			self.cached_band = (bids[0], bids[1], asks[0], asks[1])
+			self.cached_band_seq = seq
+			return self.cached_band
+		return self.cached_band
+
+	# seconds since the ingest process' publisher last ran (None before attaching)
+	def staleness(self):
+		if self.layout is None:
+			return None
+		return time.time() - int(self.layout.header[HEARTBEAT_NS]) / 1e9
+
+	def use_analytics(self, analytics, key):
+		self.analytics = analytics
+		self.analytics_key = key
+
+	def get_metrics(self):
+		snapshot = self.snapshot
+		metrics = snapshot.metrics()
+		metrics.update(book_metrics(self, snapshot))
+		return metrics
+
+	def get_depth_snapshot(self, levels=10):
+		return self.snapshot.depth(levels)
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from decoder import fixed_column, exact_column
+from order_book import parse_fixed
+
+DECIMALS = (0, 2, 5, 8)
+
+# strings the float path gets wrong if it isn't careful: more digits than a double holds,
+# a last lot a double can't see, and extra decimals parse_fixed cuts instead of rounding
+EDGE_CASES = (
+	"1234567890.12345678",
+	"250000000.00000001",
+	"67012.345",
+	"67012.999999999",
+	"0.00000001",
+	"0.000000019",
+	"0",
+	"0.0",
+	"100",
+	"99999.99",
+)
+
+def random_strings(count, seed=1):
+	rng = random.Random(seed)
+	strings = []
+	for _ in range(count):
+		whole = str(rng.randrange(10 ** rng.randrange(1, 10)))
+		frac = ''.join(rng.choice('0123456789') for _ in range(rng.randrange(0, 10)))
+		strings.append(whole + '.' + frac if frac else whole)
+	return tuple(strings)
+
+@pytest.mark.parametrize('decimals', DECIMALS)
+def test_edge_cases_match_parse_fixed(decimals):
+	expected = [parse_fixed(text, decimals) for text in EDGE_CASES]
+	assert fixed_column(EDGE_CASES, decimals).tolist() == expected
+	assert exact_column(EDGE_CASES, decimals).tolist() == expected
+
+@pytest.mark.parametrize('decimals', DECIMALS)
+def test_each_edge_case_alone_matches_parse_fixed(decimals):
+	# a batch of one takes whichever path that string alone picks
+	for text in EDGE_CASES:
+		assert fixed_column((text,), decimals).tolist() == [parse_fixed(text, decimals)]
+
+@pytest.mark.parametrize('decimals', DECIMALS)
+def test_random_strings_match_parse_fixed(decimals):
+	strings = random_strings(5000, seed=decimals)
+	expected = [parse_fixed(text, decimals) for text in strings]
+	assert exact_column(strings, decimals).tolist() == expected
+	# short batches so both the float path and the fallback get exercised
+	for start in range(0, len(strings), 50):
+		batch = strings[start:start + 50]
+		assert fixed_column(batch, decimals).tolist() == expected[start:start + 50]
+
+def test_short_prices_take_the_float_path_exactly():
+	prices = ("67012.34", "67012.35", "0.01", "12.5")
+	assert fixed_column(prices, 2).tolist() == [6701234, 6701235, 1, 1250]
+
+def test_empty_column():
+	assert fixed_column((), 8).tolist() == []
+
+def test_exact_column_rejects_junk():
+	with pytest.raises(ValueError):
+		exact_column(("1.2.3",), 2)
+	with pytest.raises(ValueError):
+		exact_column(("12a",), 2)
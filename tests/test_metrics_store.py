@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import metrics_store
+from metrics_store import MetricsStore
+
+# two stores on one directory stand in for two processes: flock locks belong to the
+# open file, so the second store's lock conflicts with the first even in one process
+pytestmark = pytest.mark.skipif(metrics_store.fcntl is None, reason="no flock on this platform")
+
+COLUMNS = ('spread', 'mid')
+NOW = 1_800_000_000.0
+
+def rows(store, start, count):
+	for second in range(count):
+		store.append(start + second, (1.0, float(second)))
+
+def test_only_the_first_store_writes(tmp_path):
+	writer = MetricsStore(str(tmp_path), columns=COLUMNS, rows_per_day=16)
+	reader = MetricsStore(str(tmp_path), columns=COLUMNS, rows_per_day=16)
+	assert writer.writer and not reader.writer
+
+	rows(writer, NOW, 10)
+	# the reader's rows would interleave with the writer's, they're dropped instead
+	rows(reader, NOW + 0.5, 10)
+	times, values = reader.read(NOW - 1, NOW + 100)
+	assert len(times) == 10
+	assert np.all(np.diff(times) > 0)
+	assert values['mid'].tolist() == [float(second) for second in range(10)]
+	writer.close()
+	reader.close()
+
+def test_reader_sees_the_writers_new_rows(tmp_path):
+	writer = MetricsStore(str(tmp_path), columns=COLUMNS, rows_per_day=4)
+	reader = MetricsStore(str(tmp_path), columns=COLUMNS, rows_per_day=4)
+	rows(writer, NOW, 3)
+	assert len(reader) == 3
+	# past the initial allocation, the segment grows under the reader
+	rows(writer, NOW + 3, 7)
+	assert len(reader) == 10
+	writer.close()
+	reader.close()
+
+def test_reader_takes_over_when_the_writer_goes(tmp_path, monkeypatch):
+	monkeypatch.setattr(metrics_store, 'TAKEOVER_INTERVAL', 0.0)
+	writer = MetricsStore(str(tmp_path), columns=COLUMNS, rows_per_day=16)
+	reader = MetricsStore(str(tmp_path), columns=COLUMNS, rows_per_day=16)
+	rows(writer, NOW, 5)
+
+	# still held, so no takeover however often it retries
+	rows(reader, NOW + 5, 1)
+	assert not reader.writer
+
+	writer.close()
+	rows(reader, NOW + 5, 5)
+	assert reader.writer
+	# carries on after the old writer's rows rather than over them
+	times, values = reader.read(NOW - 1, NOW + 100)
+	assert times.tolist() == [NOW + second for second in range(10)]
+	assert values['mid'].tolist() == [float(second) for second in range(5)] * 2
+
+	# and a store opened now reads only
+	late = MetricsStore(str(tmp_path), columns=COLUMNS, rows_per_day=16)
+	assert not late.writer
+	late.close()
+	reader.close()
+
+def test_takeover_waits_for_the_interval(tmp_path, monkeypatch):
+	monkeypatch.setattr(metrics_store, 'TAKEOVER_INTERVAL', 3600.0)
+	writer = MetricsStore(str(tmp_path), columns=COLUMNS, rows_per_day=16)
+	reader = MetricsStore(str(tmp_path), columns=COLUMNS, rows_per_day=16)
+	# first append tries the lock and fails, the next try is an hour away
+	rows(reader, NOW, 1)
+	writer.close()
+	rows(reader, NOW + 1, 5)
+	assert not reader.writer
+	assert len(reader) == 0
+	reader.close()
@@ -0,0 +1,78 @@
+import random
+
+from order_book import OrderBook, IMBALANCE_DEPTH
+
+MID = 6_700_000
+
+def random_book(rng, depths, levels=60):
+	book = OrderBook(depths=depths)
+	bid_prices = [MID - 1 - rng.randrange(levels * 2) for _ in range(levels)]
+	ask_prices = [MID + 1 + rng.randrange(levels * 2) for _ in range(levels)]
+	book.load_snapshot(bid_prices, [rng.randrange(1, 10 ** 8) for _ in bid_prices],
+		ask_prices, [rng.randrange(1, 10 ** 8) for _ in ask_prices])
+	return book
+
+# one batch of changes near the top, where they move the windows: new levels, resizes and deletes
+def random_changes(rng, book, count):
+	sides, prices, sizes = [], [], []
+	for _ in range(count):
+		is_bid = rng.random() < 0.5
+		side = book.bids if is_bid else book.asks
+		if side and rng.random() < 0.4:
+			# an existing level, deleted or resized
+			price = side.keys()[rng.randrange(len(side))]
+			size = 0 if rng.random() < 0.5 else rng.randrange(1, 10 ** 8)
+		else:
+			distance = 1 + rng.randrange(150)
+			price = MID - distance if is_bid else MID + distance
+			size = 0 if rng.random() < 0.1 else rng.randrange(1, 10 ** 8)
+		sides.append(is_bid)
+		prices.append(price)
+		sizes.append(size)
+	book.apply_changes(sides, prices, sizes)
+
+# the running state of `book` against the same numbers worked out from scratch
+def check_against_recompute(book):
+	bids = sorted(book.bids.items(), reverse=True)
+	asks = sorted(book.asks.items())
+	snapshot = book.snapshot
+	assert snapshot.bids == tuple(bids[:book.max_depth])
+	assert snapshot.asks == tuple(asks[:book.max_depth])
+	for index, depth in enumerate(book.depths):
+		assert book.bid_volume[depth] == sum(size for price, size in bids[:depth])
+		assert book.ask_volume[depth] == sum(size for price, size in asks[:depth])
+		assert snapshot.bid_volume[index] == book.bid_volume[depth]
+		assert snapshot.ask_volume[index] == book.ask_volume[depth]
+	assert snapshot.best_bid == (bids[0][0] if bids else None)
+	assert snapshot.best_ask == (asks[0][0] if asks else None)
+	if bids and asks:
+		bid_volume = sum(size for price, size in bids[:IMBALANCE_DEPTH])
+		ask_volume = sum(size for price, size in asks[:IMBALANCE_DEPTH])
+		assert snapshot.imbalance == bid_volume / (bid_volume + ask_volume)
+
+def test_running_totals_match_a_recompute():
+	rng = random.Random(7)
+	book = random_book(rng, (5, 10, 25, 50))
+	check_against_recompute(book)
+	for _ in range(2000):
+		random_changes(rng, book, rng.randrange(1, 8))
+		check_against_recompute(book)
+
+def test_totals_survive_a_side_running_empty():
+	rng = random.Random(11)
+	book = random_book(rng, (5, 10, 25, 50), levels=8)
+	for price in list(book.bids.keys()):
+		book.apply_changes([True], [price], [0])
+		check_against_recompute(book)
+	for _ in range(200):
+		random_changes(rng, book, 3)
+		check_against_recompute(book)
+
+def test_imbalance_depth_is_always_kept():
+	rng = random.Random(3)
+	book = random_book(rng, (5, 25))
+	assert IMBALANCE_DEPTH in book.depths
+	for _ in range(500):
+		random_changes(rng, book, 4)
+		check_against_recompute(book)
+	assert book.snapshot.imbalance is not None
@@ -0,0 +1,48 @@
+import numpy as np
+from timeseries import MetricsHistory, METRICS
+
+NOW = 1_800_000_000.0
+
+# `seconds` of 1s samples ending at NOW, as a restart would read them back from the store
+def backfilled(seconds):
+	history = MetricsHistory()
+	times = NOW - seconds + np.arange(seconds, dtype=np.float64)
+	rows = np.column_stack([np.full(seconds, index + 1.0) for index in range(len(METRICS))])
+	history.extend(times, rows)
+	return history
+
+def test_short_window_after_backfill_reads_raw():
+	history = backfilled(6 * 3600)
+	times, series = history.window(300, NOW)
+	assert history.source(NOW - 300) is history.raw
+	assert len(times) == 300
+	assert times[0] >= NOW - 300
+
+def test_long_windows_after_backfill_read_rollups():
+	history = backfilled(6 * 3600)
+	for hours in (3, 6):
+		since = NOW - hours * 3600
+		times, series = history.window(hours * 3600, NOW)
+		assert history.source(since) is history.tier(60)
+		# the whole window, not just the hour raw holds
+		assert times[0] - since < 60
+		assert NOW - times[-1] <= 120
+		assert np.all(series['spread'] == 1.0)
+
+def test_window_longer_than_data_stays_fine_grained():
+	history = backfilled(600)
+	times, series = history.window(3600, NOW)
+	assert history.source(NOW - 3600) is history.raw
+	assert len(times) == 600
+
+def test_live_appends_after_backfill():
+	history = backfilled(6 * 3600)
+	for second in range(1, 121):
+		history.append(NOW + second, [1.0, 2.0, 3.0])
+	now = NOW + 120
+	times, series = history.window(3 * 3600, now)
+	assert history.source(now - 3 * 3600) is history.tier(60)
+	assert times[0] - (now - 3 * 3600) < 60
+	times, series = history.window(60, now)
+	assert history.source(now - 60) is history.raw
+	assert times[0] == now - 60 and times[-1] == now
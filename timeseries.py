@@ -0,0 +1,236 @@
+import math
+import numpy as np
+
+# fixed memory metric history for the charts
+# raw samples go into a preallocated numpy ring, and are rolled up into coarser tiers
+# (1m and 15m by default) with open/high/low/close/mean per metric, so the last 5 minutes,
+# the last few hours or the last week all chart from the same small fixed footprint.
+
+# metrics the sampler records, in column order
+METRICS = ('spread', 'mid_price', 'imbalance')
+
+# per metric stats kept by the rollup tiers (high / low are the max / min)
+ROLLUP_STATS = ('open', 'high', 'low', 'close', 'mean')
+
+# preallocated ring of (timestamp, row) with every row written twice, at i and i + capacity.
+# that mirror means the newest n rows are always one contiguous slice, so reads are
+# zero-copy numpy views no matter where the ring has wrapped to.
+# one writer thread; views are live, copy them if you need to hold on to the values
+# `buffer` lets the ring live in memory someone else owns (shared memory, see shared_book.py);
+# the row count is stored in it too so a reader attached to the same buffer sees appends
+class RingSeries:
+	def __init__(self, capacity, columns, buffer=None):
+		self.capacity = capacity
+		self.columns = tuple(columns)
+		self.index = {name: i for i, name in enumerate(self.columns)}
+		if buffer is None:
+			buffer = bytearray(ring_bytes(capacity, len(self.columns)))
+		# layout: count int64, times float64[2 * capacity], data float64[2 * capacity, columns]
+		self.counter = np.ndarray((1,), np.int64, buffer, 0)
+		self.times = np.ndarray((2 * capacity,), np.float64, buffer, 8)
+		self.data = np.ndarray((2 * capacity, len(self.columns)), np.float64, buffer, 8 + 16 * capacity)
+
+	# total rows ever appended
+	@property
+	def count(self):
+		return int(self.counter[0])
+
+	@count.setter
+	def count(self, value):
+		self.counter[0] = value
+
+	def __len__(self):
+		return min(self.count, self.capacity)
+
+	def append(self, timestamp, row):
+		position = self.count % self.capacity
+		mirror = position + self.capacity
+		self.times[position] = self.times[mirror] = timestamp
+		self.data[position] = self.data[mirror] = row
+		# count last, a reader never sees a row before it's written
+		self.count += 1
+
+	# bulk append (backfill), rows oldest first; only the newest `capacity` are kept
+	def extend(self, times, rows):
+		times = times[-self.capacity:]
+		rows = rows[-self.capacity:]
+		count = self.count
+		positions = (count + np.arange(len(times))) % self.capacity
+		self.times[positions] = self.times[positions + self.capacity] = times
+		self.data[positions] = self.data[positions + self.capacity] = rows
+		self.count = count + len(times)
+
+	# the newest n rows (all of them by default), oldest first, as views
+	def last(self, n=None):
+		count = self.count
+		available = min(count, self.capacity)
+		n = available if n is None else min(n, available)
+		if not n:
+			return self.times[:0], self.data[:0]
+		end = (count - 1) % self.capacity + self.capacity + 1
+		return self.times[end - n:end], self.data[end - n:end]
+
+	# rows with timestamp >= since, as views
+	def since(self, since):
+		times, data = self.last()
+		start = int(np.searchsorted(times, since, side='left'))
+		return times[start:], data[start:]
+
+	def column(self, data, name):
+		return data[:, self.index[name]]
+
+def ring_bytes(capacity, width):
+	return 8 + 16 * capacity * (1 + width)
+
+# accumulates raw samples into fixed width time buckets and appends one row per
+# closed bucket to its own RingSeries (timestamp = bucket start)
+class Rollup:
+	def __init__(self, width, capacity, metrics=METRICS, buffer=None):
+		self.width = width
+		self.metrics = metrics
+		columns = [f"{metric}_{stat}" for metric in metrics for stat in ROLLUP_STATS]
+		self.series = RingSeries(capacity, columns, buffer)
+		self.bucket = None
+		self.reset()
+
+	def reset(self):
+		size = len(self.metrics)
+		self.open = np.full(size, np.nan)
+		self.high = np.full(size, -np.inf)
+		self.low = np.full(size, np.inf)
+		self.close = np.full(size, np.nan)
+		self.total = np.zeros(size)
+		self.seen = np.zeros(size)
+
+	def add(self, timestamp, values):
+		bucket = math.floor(timestamp / self.width) * self.width
+		if self.bucket is not None and bucket != self.bucket:
+			self.flush()
+		self.bucket = bucket
+		valid = ~np.isnan(values)
+		first = valid & (self.seen == 0)
+		self.open[first] = values[first]
+		self.high[valid] = np.maximum(self.high[valid], values[valid])
+		self.low[valid] = np.minimum(self.low[valid], values[valid])
+		self.close[valid] = values[valid]
+		self.total[valid] += values[valid]
+		self.seen[valid] += 1
+
+	# vectorized add() for backfilling an empty rollup from sorted samples
+	# closed buckets are reduced in one go, the last one is left filling like a live bucket
+	def extend(self, times, values):
+		if not len(times):
+			return
+		buckets = np.floor(times / self.width) * self.width
+		starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+		tail = starts[-1]
+		if tail:
+			starts = starts[:-1]
+			chunk = values[:tail]
+			valid = ~np.isnan(chunk)
+			seen = np.add.reduceat(valid, starts, axis=0)
+			total = np.add.reduceat(np.where(valid, chunk, 0.0), starts, axis=0)
+			# fmax / fmin skip NaN, all NaN stays NaN
+			high = np.fmax.reduceat(chunk, starts, axis=0)
+			low = np.fmin.reduceat(chunk, starts, axis=0)
+			# first / last valid row of each bucket, per column
+			index = np.arange(tail)[:, None]
+			first = np.minimum.reduceat(np.where(valid, index, tail - 1), starts, axis=0)
+			last = np.maximum.reduceat(np.where(valid, index, 0), starts, axis=0)
+			columns = np.arange(chunk.shape[1])
+			empty = seen == 0
+			with np.errstate(invalid='ignore', divide='ignore'):
+				mean = total / seen
+			opens = np.where(empty, np.nan, chunk[first, columns])
+			closes = np.where(empty, np.nan, chunk[last, columns])
+			rows = np.stack((opens, high, low, closes, mean), axis=2).reshape(len(starts), -1)
+			self.series.extend(buckets[starts], rows)
+		for timestamp, row in zip(times[tail:], values[tail:]):
+			self.add(timestamp, row)
+
+	def flush(self):
+		if self.bucket is None:
+			return
+		empty = self.seen == 0
+		with np.errstate(invalid='ignore', divide='ignore'):
+			mean = self.total / self.seen
+		high = np.where(empty, np.nan, self.high)
+		low = np.where(empty, np.nan, self.low)
+		# interleave to metric-major order: spread_open, spread_high, ... imbalance_mean
+		row = np.column_stack((self.open, high, low, self.close, mean)).ravel()
+		self.series.append(self.bucket, row)
+		self.bucket = None
+		self.reset()
+
+# raw samples + rollup tiers behind one append
+# default sizes: an hour of 1s samples, a day of 1m bars, a week of 15m bars (~1 MB total)
+# allocate(nbytes) -> buffer places each ring, by default they're private bytearrays
+class MetricsHistory:
+	def __init__(self, raw_capacity=3600, tiers=((60, 1440), (900, 672)), metrics=METRICS, allocate=bytearray):
+		self.metrics = metrics
+		self.raw = RingSeries(raw_capacity, metrics, allocate(ring_bytes(raw_capacity, len(metrics))))
+		self.rollups = [
+			Rollup(width, capacity, metrics, allocate(ring_bytes(capacity, len(metrics) * len(ROLLUP_STATS))))
+			for width, capacity in tiers
+		]
+
+	def __len__(self):
+		return len(self.raw)
+
+	# values lines up with metrics, None becomes NaN
+	def append(self, timestamp, values):
+		row = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+		self.raw.append(timestamp, row)
+		for rollup in self.rollups:
+			rollup.add(timestamp, row)
+
+	# backfill from stored samples (times sorted, rows lined up with metrics)
+	def extend(self, times, rows):
+		self.raw.extend(times, rows)
+		for rollup in self.rollups:
+			rollup.extend(times, rows)
+
+	# seconds of history the coarsest tier can hold, how far back a backfill is worth reading
+	def span(self):
+		return max([self.raw.capacity] + [rollup.width * rollup.series.capacity for rollup in self.rollups])
+
+	def tier(self, width):
+		for rollup in self.rollups:
+			if rollup.width == width:
+				return rollup.series
+		raise KeyError(width)
+
+	# the series a window starting at `since` is read from: the finest one that reaches back
+	# that far, else the one reaching furthest back. a coarser tier only wins when its first
+	# bucket ends before the finer one's oldest row, i.e. it really holds older data
+	# (after a backfill or a restart raw is short but the rollups go back days)
+	def source(self, since):
+		best = self.raw
+		for rollup in self.rollups:
+			if covers(best, since):
+				break
+			start, best_start = oldest(rollup.series), oldest(best)
+			if start is not None and (best_start is None or start + rollup.width <= best_start):
+				best = rollup.series
+		return best
+
+	# everything since now - seconds from source(); returns (times, {metric: values}), raw
+	# samples for short windows, the `stat` column of a rollup (mean by default) for long ones.
+	# all values are views.
+	def window(self, seconds, now, stat='mean'):
+		since = now - seconds
+		series = self.source(since)
+		times, data = series.since(since)
+		if series is self.raw:
+			return times, {metric: series.column(data, metric) for metric in self.metrics}
+		return times, {metric: series.column(data, f"{metric}_{stat}") for metric in self.metrics}
+
+# timestamp of the oldest row a series holds, None when it's empty
+def oldest(series):
+	times = series.last()[0]
+	return times[0] if len(times) else None
+
+# true if the series holds everything back to `since`
+def covers(series, since):
+	start = oldest(series)
+	return start is not None and start <= since
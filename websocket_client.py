@@ -1,35 +1,127 @@
+import base64
+import hashlib
+import hmac
 import json
+import socket
+import backoff
 import websocket
 import threading
 import time
 
-# connects to coinbase and subscribes to btc-usd order book
+COINBASE_URL = "wss://ws-feed.exchange.coinbase.com"
+
+# book channels: level2_batch comes in ~50ms batches, level2 has every change as it happens
+# (coinbase only serves level2 to signed subscriptions, see credentials)
+FEED_CHANNELS = ("level2_batch", "level2")
+
+# a connection that stayed up this long counts as healthy, the next drop starts backing off from scratch
+STABLE_SECONDS = 30
+
+# how often the receive thread reads its own cpu time, it's a syscall and frames come by the thousand
+CPU_SAMPLE_INTERVAL = 0.5
+
+def print_backoff(details):
+	print(f"- Reconnecting in {details['wait']:.1f}s (attempt {details['tries']}) -")
+
+# connects to coinbase and subscribes to the order books of product_ids (btc-usd by default)
 # we will use this to get real time updates and data insights
+# every product comes over the one connection, frames say which product they belong to
+# url can point at anything speaking the same protocol (e.g. feed_server.py)
+# a dropped connection is reopened with exponential backoff and resubscribes everything,
+# which brings fresh snapshots; close listeners hear about each drop (see book_sync.py)
+# with heartbeats on, a product that goes heartbeat_timeout seconds without one is resubscribed,
+# and if they all do the connection is treated as dead and reopened
+# credentials are an exchange api (key, secret, passphrase), used to sign subscriptions
 class CoinbaseWebSocket:
-	def __init__(self, on_message_callback=None):
-		self.url = "wss://ws-feed.exchange.coinbase.com"
-		self.product_id = "BTC-USD"
+	def __init__(self, on_message_callback=None, url=COINBASE_URL, product_ids=("BTC-USD",), ping_interval=20,
+			channel="level2_batch", heartbeat=True, heartbeat_timeout=5.0, credentials=None):
+		self.url = url
+		self.product_ids = list(product_ids)
+		if channel not in FEED_CHANNELS:
+			raise ValueError(f"channel must be one of {', '.join(FEED_CHANNELS)}, not {channel!r}")
+		self.channel = channel #order book
+		self.channels = [channel] + (["heartbeat"] if heartbeat else [])
+		self.heartbeat_timeout = heartbeat_timeout
+		self.credentials = credentials
+		self.ping_interval = ping_interval
 		self.ws = None #websocket
 		self.callback = on_message_callback
-		self.running = False #connected?
+		self.running = False #should be connected?
+		self.connected = False
+		self.opened_at = None
+		self.thread = None
+		self.close_listeners = []
+
+		# product -> monotonic time of its last heartbeat, and of the last resubscribe for missing them
+		self.heartbeats = {}
+		self.heartbeat_retries = {}
+
+		# connection stats
+		self.connects = 0
+		self.drops = 0
+		self.resubscribes = 0
+		self.heartbeat_misses = 0
+		# cpu time of the receive thread, refreshed every CPU_SAMPLE_INTERVAL seconds of frames
+		self.cpu_seconds = 0.0
+		self.cpu_sampled_at = 0.0
+
+		# raw frame listeners, called on the receive thread with (frame, recv_time)
+		# these must be cheap (enqueue and return), decoding happens elsewhere
+		self.frame_listeners = []
+
+	# register a raw frame listener
+	def add_frame_listener(self, listener):
+		self.frame_listeners.append(listener)
+
+	# register a no-argument callback for when an open connection goes away
+	def add_close_listener(self, listener):
+		self.close_listeners.append(listener)
 
 	# when socket opens
 	def on_open(self, ws):
-		print("+ Coinbase Connected +")
+		print(f"+ Connected to {self.url} +")
+		self.connected = True
+		self.opened_at = time.monotonic()
+		self.connects += 1
+
+		self.heartbeats.clear()
+		self.heartbeat_retries.clear()
 
 		# request
-		sub_message = {
+		sub_message = self.sign({
 			"type": "subscribe",
-			"product_ids": [self.product_id],
-			"channels": ["level2_batch"] #order book
-		}
+			"product_ids": self.product_ids,
+			"channels": self.channels
+		})
 
 		# send message
 		ws.send(json.dumps(sub_message))
-		print(f"+ subscribed successfully to {self.product_id} order book +")
+		print(f"+ subscribed successfully to {', '.join(self.product_ids)} order book ({', '.join(self.channels)}) +")
+
+	# exchange api auth: hmac of timestamp + GET + /users/self/verify with the base64 secret
+	def sign(self, message):
+		if not self.credentials:
+			return message
+		key, secret, passphrase = self.credentials
+		timestamp = str(time.time())
+		digest = hmac.new(base64.b64decode(secret), (timestamp + 'GET' + '/users/self/verify').encode(), hashlib.sha256).digest()
+		message.update(signature=base64.b64encode(digest).decode(), key=key, passphrase=passphrase, timestamp=timestamp)
+		return message
 	
 	# called when a response is recieved
 	def on_message(self, ws, message):
+		recv_time = time.time()
+		# book frames never have the word in them, so only heartbeats (and the odd
+		# subscriptions reply) get decoded here, whatever order the exchange puts the keys in
+		if '"heartbeat"' in message:
+			self.heartbeat(message)
+		for listener in self.frame_listeners:
+			listener(message, recv_time)
+		if recv_time - self.cpu_sampled_at >= CPU_SAMPLE_INTERVAL:
+			self.cpu_seconds = time.thread_time()
+			self.cpu_sampled_at = recv_time
+		if not self.callback:
+			return
 		try:
 			data = json.loads(message) #dict of data
 			msg_type = data.get("type")
@@ -41,11 +133,18 @@ class CoinbaseWebSocket:
 			'''
 
 			#call orderbook update
-			if self.callback:
-				self.callback(msg_type, data)
+			self.callback(msg_type, data)
 		except json.JSONDecodeError:
 			print(f"- Json parse failed: {message}-")
 
+	def heartbeat(self, message):
+		try:
+			data = json.loads(message)
+		except json.JSONDecodeError:
+			return
+		if isinstance(data, dict) and data.get("type") == "heartbeat":
+			self.heartbeats[data.get("product_id")] = time.monotonic()
+
 	# if error
 	def on_error(self, ws, error):
 		print(f"error: {error}")
@@ -53,11 +152,90 @@ class CoinbaseWebSocket:
 	# when websocket closes
 	def on_close(self, ws, close_status_code, close_msg):
 		print("- Connection Closed Successfully -")
-		self.running = False
+		self.closed()
+
+	# the connection is gone, however it went; tell the listeners once
+	def closed(self):
+		if not self.connected:
+			return
+		self.connected = False
+		self.drops += 1
+		for listener in self.close_listeners:
+			listener()
+
+	# ask for fresh snapshots of product_ids on the open connection
+	# if the send fails the connection is on its way down and the reconnect resubscribes anyway
+	def resubscribe(self, product_ids):
+		self.resubscribes += 1
+		try:
+			self.ws.send(json.dumps(self.sign({"type": "unsubscribe", "product_ids": product_ids, "channels": [self.channel]})))
+			self.ws.send(json.dumps(self.sign({"type": "subscribe", "product_ids": product_ids, "channels": [self.channel]})))
+		except (websocket.WebSocketException, OSError, AttributeError) as e:
+			print(f"- Resubscribe {', '.join(product_ids)} failed: {e} -")
 
 	# starts websocket on it's own thread
 	def start(self):
 		self.running = True
+
+		# run on thread
+		self.thread = threading.Thread(target=self.run, name='feed')
+		self.thread.daemon = True
+		self.thread.start()
+		if "heartbeat" in self.channels:
+			watchdog = threading.Thread(target=self.watch, name='heartbeat-watch')
+			watchdog.daemon = True
+			watchdog.start()
+
+		print("+ Websocket started running in background... +")
+
+	# heartbeat watchdog: quiet products are resubscribed, all quiet means the connection is gone
+	def watch(self):
+		while self.running:
+			time.sleep(1)
+			opened_at = self.opened_at
+			if not self.connected or opened_at is None:
+				continue
+			now = time.monotonic()
+			quiet = [product_id for product_id in self.product_ids
+				if now - self.heartbeats.get(product_id, opened_at) > self.heartbeat_timeout]
+			if len(quiet) == len(self.product_ids):
+				self.heartbeat_misses += 1
+				print(f"- No heartbeats for {self.heartbeat_timeout:g}s, reconnecting -")
+				self.drop()
+				continue
+			# give each resubscribe a full timeout before trying again
+			retry = [product_id for product_id in quiet
+				if now - self.heartbeat_retries.get(product_id, opened_at) > self.heartbeat_timeout]
+			if not retry:
+				continue
+			self.heartbeat_misses += 1
+			print(f"- No heartbeats from {', '.join(retry)}, resubscribing -")
+			for product_id in retry:
+				self.heartbeat_retries[product_id] = now
+			self.resubscribe(retry)
+
+	# ws.close() from another thread leaves run_forever waiting on a socket it no longer reads,
+	# shutting the socket down wakes the read loop, which closes and returns to connect()
+	def drop(self):
+		sock = self.ws.sock if self.ws else None
+		if sock is None or sock.sock is None:
+			return
+		try:
+			sock.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+
+	def run(self):
+		while self.running:
+			self.connect()
+
+	# one connection after another until one is healthy, waiting 1, 2, 4... (max 30, jittered)
+	# seconds between failures; returns when a healthy connection drops (or we're stopped)
+	@backoff.on_predicate(backoff.expo, max_value=30, on_backoff=print_backoff, logger=None)
+	def connect(self):
+		if not self.running:
+			return True
+		self.opened_at = None
 		self.ws = websocket.WebSocketApp(
 			self.url,
 			on_open=self.on_open,
@@ -65,13 +243,9 @@ class CoinbaseWebSocket:
 			on_error=self.on_error,
 			on_close=self.on_close
 		)
-
-		# run on thread
-		thread = threading.Thread(target=self.ws.run_forever)
-		thread.daemon = True
-		thread.start()
-
-		print("+ Websocket started running in background... +")
+		self.ws.run_forever(ping_interval=self.ping_interval, ping_timeout=self.ping_interval / 2)
+		self.closed()
+		return not self.running or (self.opened_at is not None and time.monotonic() - self.opened_at > STABLE_SECONDS)
 
 	# stop connection (elegant)
 	def stop(self):
@@ -80,6 +254,18 @@ class CoinbaseWebSocket:
 			self.ws.close()
 		print("- Stopped - ")
 
+	def stats(self):
+		return {
+			'connected': self.connected,
+			'connects': self.connects,
+			'drops': self.drops,
+			'resubscribes': self.resubscribes,
+			'heartbeat_misses': self.heartbeat_misses,
+			'channels': self.channels,
+			'cpu_seconds': self.cpu_seconds,
+			'uptime': time.monotonic() - self.opened_at if self.connected and self.opened_at else None,
+		}
+
 # test class standalone
 if __name__ == "__main__":
 	def my_callback(msg_type, data):